@@ -68,5 +68,19 @@ git submodule update
 # be able to run its scripts.
 cd $HYDRO_HOME/cluster
 export PYTHONPATH=$PYTHONPATH:$(pwd)
+
+# If WARM_POOL_SIZE is set, that many function nodes are kept booted on
+# standby, and new function nodes are promoted from them.
 python3.6 hydro/management/k8s_server.py &
-python3.6 hydro/management/management_server.py $IP
+
+# If MANAGEMENT_SHARDS is set, statistics are aggregated by that many worker
+# processes.
+# If MANAGEMENT_RECORD is set, every message the server receives is recorded
+# to the log at that path, which can be replayed with hydro/management/replay.py.
+# If MANAGEMENT_PREDICTIVE is set, replicas and nodes are added ahead of
+# forecast load rather than once it arrives. If MANAGEMENT_SLOS is also set,
+# the SLO policy scales on top of this rather than the default policy.
+# MANAGEMENT_LEAD_TIME (in seconds, 60 by default) and MANAGEMENT_CONFIDENCE
+# (0.9 by default) set how far ahead it plans and the confidence bound it
+# plans for.
+python3.6 hydro/management/management_server.py $IP $MANAGEMENT_SHARDS
@@ -19,10 +19,16 @@ import os
 
 import boto3
 
+from hydro.cluster.warm_pool import get_pool_node_names
 from hydro.shared import util
+from hydro.shared.wait import watch_until
 
 ec2_client = boto3.client('ec2', os.getenv('AWS_REGION', 'us-east-1'))
 
+# How long (in seconds) we wait for another of the new nodes' pods to start
+# running before we give up on the rest with a WaitTimeout.
+PROVISION_TIMEOUT = 900
+
 # Generate list of all recently created pods.
 def get_current_pod_container_pairs(pods):
     pod_container_pairs = set()
@@ -33,27 +39,126 @@ def get_current_pod_container_pairs(pods):
             pod_container_pairs.add((pname, cname))
     return pod_container_pairs
 
-def add_nodes(client, apps_client, cfile, kinds, counts, create=False,
-              prefix=None):
-    previously_created_pods_list = []
-    expected_counts = []
-    for i in range(len(kinds)):
-        print('Adding %d %s server node(s) to cluster...' %
-              (counts[i], kinds[i]))
+def get_pod_counts(client, kinds, excluded_nodes=()):
+    '''
+    Returns the number of running pods of each kind and the number of pods of
+    each kind in any phase, with one list call for all of them. Pods on the
+    nodes in excluded_nodes aren't counted.
+    '''
+    pods = client.list_namespaced_pod(namespace=util.NAMESPACE,
+                                      label_selector=get_role_selector(kinds))
+    return count_pods(pods.items, kinds, excluded_nodes)
 
-        pods = client.list_namespaced_pod(namespace=util.NAMESPACE,
-                                          label_selector='role=' +
-                                          kinds[i]).items
+def get_role_selector(kinds):
+    return 'role in (%s)' % (','.join(kinds))
 
-        previously_created_pods_list.append(get_current_pod_container_pairs(pods))
+def count_pods(pods, kinds, excluded_nodes=()):
+    running = {kind: 0 for kind in kinds}
+    total = {kind: 0 for kind in kinds}
+    for pod in pods:
+        role = pod.metadata.labels.get('role')
+        if role not in total or pod.spec.node_name in excluded_nodes:
+            continue
+
+        total[role] += 1
+        if pod.status.phase == 'Running' and pod.status.pod_ip:
+            running[role] += 1
+
+    return running, total
+
+def resize_instance_groups(sizes):
+    '''
+    Sets the size of each kind's instance group, given a map from kind to
+    size, and applies them all with a single cluster update.
+    '''
+    command = ['./modify_ig.sh']
+    for kind, size in sizes.items():
+        command += [kind, str(size)]
+
+    util.run_process(command)
+
+def provision(client, targets, batch_size=None, timeout=PROVISION_TIMEOUT,
+              watch_factory=None):
+    '''
+    Grows the instance group of each kind to its target size, given as a map
+    from kind to the number of nodes it should have, and returns once a pod of
+    that kind is running on every node.
+
+    All of the kinds are resized together and waited on together, with a
+    watch on their pods. If batch_size is given, at most that many nodes of
+    each kind are requested but not yet running at a time: as nodes come up,
+    the next ones are requested, so large counts are pipelined rather than
+    added in batches that each wait for the last one to finish.
+
+    If no new pod starts running for timeout seconds, e.g., because a node
+    never boots, we raise a WaitTimeout rather than wait forever.
+
+    The warm pool's nodes are labeled as function nodes but are in their own
+    instance group, so we don't count the pods on them.
+    '''
+    kinds = list(targets)
+    pool_nodes = get_pool_node_names(client)
+    running, total = get_pod_counts(client, kinds, pool_nodes)
+    sizes = {}
+    for kind, target in targets.items():
+        # Nodes that already have a pod, running or not, are kept.
+        sizes[kind] = target if batch_size is None else \
+            min(target, max(running[kind] + batch_size, total[kind]))
+
+    resize_instance_groups(sizes)
+
+    while any(running[kind] < target for kind, target in targets.items()):
+        running = wait_for_progress(client, targets, running, timeout,
+                                    pool_nodes, watch_factory)
+
+        # Request more nodes once at least half of a batch has come up, so we
+        # don't run a cluster update every time a single node is ready.
+        resized = {}
+        for kind, target in targets.items():
+            if batch_size is None:
+                break
+
+            size = min(target, running[kind] + batch_size)
+            step = size - sizes[kind]
+            if step > 0 and (size == target or
+                             step >= max(batch_size // 2, 1)):
+                resized[kind] = size
+
+        if resized:
+            print('Requesting %s more node(s)...' % (', '.join(
+                '%d %s' % (size - sizes[kind], kind) for kind, size in
+                resized.items())))
+            sizes.update(resized)
+            resize_instance_groups(sizes)
 
-        prev_count = util.get_previous_count(client, kinds[i])
-        util.run_process(['./modify_ig.sh', kinds[i], str(counts[i] +
-                                                          prev_count)])
-        expected_counts.append(counts[i] + prev_count)
+        print('Running: %s.' % (', '.join('%d/%d %s' % (running[kind],
+                                                        target, kind)
+                                          for kind, target in
+                                          targets.items())))
 
-    util.run_process(['./validate_cluster.sh'])
+def wait_for_progress(client, targets, running, timeout, excluded_nodes=(),
+                      watch_factory=None):
+    '''
+    Waits until more pods of some kind are running than in running, and
+    returns the new counts.
+    '''
+    kinds = list(targets)
 
+    def progressed(pods):
+        counts, _ = count_pods(pods.values(), kinds, excluded_nodes)
+        if any(counts[kind] > running[kind] for kind in kinds):
+            return counts
+
+        return None
+
+    description = 'more of %s to start running' % (', '.join(
+        '%d/%d %s pods' % (running[kind], target, kind) for kind, target in
+        targets.items()))
+    return watch_until(client.list_namespaced_pod, progressed, description,
+                       timeout, watch_factory, namespace=util.NAMESPACE,
+                       label_selector=get_role_selector(kinds))
+
+def create_daemon_sets(client, apps_client, kinds, prefix=None):
     management_ip = util.get_pod_ips(client, 'role=management')[0]
     route_ips = util.get_pod_ips(client, 'role=routing')
 
@@ -69,35 +174,59 @@ def add_nodes(client, apps_client, cfile, kinds, counts, create=False,
     route_addr = util.get_service_address(client, 'routing-service')
     function_addr = util.get_service_address(client, 'function-service')
 
+    for kind in kinds:
+        fname = 'yaml/ds/%s-ds.yml' % kind
+        yml = util.load_yaml(fname, prefix)
+
+        for container in yml['spec']['template']['spec']['containers']:
+            env = container['env']
+
+            util.replace_yaml_val(env, 'ROUTING_IPS', route_str)
+            util.replace_yaml_val(env, 'ROUTE_ADDR', route_addr)
+            util.replace_yaml_val(env, 'SCHED_IPS', sched_str)
+            util.replace_yaml_val(env, 'FUNCTION_ADDR', function_addr)
+            util.replace_yaml_val(env, 'MON_IPS', mon_str)
+            util.replace_yaml_val(env, 'MGMT_IP', management_ip)
+            util.replace_yaml_val(env, 'SEED_IP', seed_ip)
+
+        apps_client.create_namespaced_daemon_set(namespace=util.NAMESPACE,
+                                                 body=yml)
+
+def add_nodes(client, apps_client, cfile, kinds, counts, create=False,
+              prefix=None, batch_size=None, watch_factory=None):
+    # Function pods on the warm pool's nodes don't count towards the size of
+    # the function instance group.
+    pool_nodes = get_pool_node_names(client)
+
+    previously_created_pods_list = []
+    targets = {}
     for i in range(len(kinds)):
-        kind = kinds[i]
+        print('Adding %d %s server node(s) to cluster...' %
+              (counts[i], kinds[i]))
+
+        pods = client.list_namespaced_pod(namespace=util.NAMESPACE,
+                                          label_selector='role=' +
+                                          kinds[i]).items
+
+        previously_created_pods_list.append(get_current_pod_container_pairs(pods))
+        targets[kinds[i]] = counts[i] + len([pod for pod in pods if
+                                             pod.spec.node_name not in
+                                             pool_nodes])
+
+    # Create should only be true when the DaemonSets are being created for the
+    # first time -- i.e., when this is called from create_cluster. After that,
+    # we can basically ignore this because the DaemonSets will take care of
+    # adding pods to created nodes. We create them before the nodes come up,
+    # so each node gets its pod as soon as it joins the cluster.
+    if create:
+        create_daemon_sets(client, apps_client, kinds, prefix)
+
+    provision(client, targets, batch_size, watch_factory=watch_factory)
 
-        # Create should only be true when the DaemonSet is being created for the
-        # first time -- i.e., when this is called from create_cluster. After that,
-        # we can basically ignore this because the DaemonSet will take care of
-        # adding pods to created nodes.
-        if create:
-            fname = 'yaml/ds/%s-ds.yml' % kind
-            yml = util.load_yaml(fname, prefix)
-
-            for container in yml['spec']['template']['spec']['containers']:
-                env = container['env']
-
-                util.replace_yaml_val(env, 'ROUTING_IPS', route_str)
-                util.replace_yaml_val(env, 'ROUTE_ADDR', route_addr)
-                util.replace_yaml_val(env, 'SCHED_IPS', sched_str)
-                util.replace_yaml_val(env, 'FUNCTION_ADDR', function_addr)
-                util.replace_yaml_val(env, 'MON_IPS', mon_str)
-                util.replace_yaml_val(env, 'MGMT_IP', management_ip)
-                util.replace_yaml_val(env, 'SEED_IP', seed_ip)
-
-            apps_client.create_namespaced_daemon_set(namespace=util.NAMESPACE,
-                                                     body=yml)
-
-        # Wait until all pods of this kind are running
-        res = []
-        while len(res) != expected_counts[i]:
-            res = util.get_pod_ips(client, 'role='+kind, is_running=True)
+    # Copy the KVS config into all recently created pods at once.
+    targets = []
+    for i in range(len(kinds)):
+        kind = kinds[i]
 
         pods = client.list_namespaced_pod(namespace=util.NAMESPACE,
                                           label_selector='role=' +
@@ -107,46 +236,28 @@ def add_nodes(client, apps_client, cfile, kinds, counts, create=False,
 
         new_pods = created_pods.difference(previously_created_pods_list[i])
 
-        # Copy the KVS config into all recently created pods.
-        os.system('cp %s ./anna-config.yml' % cfile)
-
         for pname, cname in new_pods:
             if kind != 'function' and kind != 'gpu':
-                util.copy_file_to_pod(client, 'anna-config.yml', pname,
-                                      '/hydro/anna/conf/', cname)
+                targets.append((pname, '/hydro/anna/conf/', cname))
             else:
                 if cname == 'cache-container':
                     # For the cache pods, we also copy the conf into the cache
                     # conf directory.
-                    util.copy_file_to_pod(client, 'anna-config.yml', pname,
-                                          '/hydro/anna-cache/conf/', cname)
+                    targets.append((pname, '/hydro/anna-cache/conf/', cname))
 
-        os.system('rm ./anna-config.yml')
+    results = util.copy_file_to_pods(client, cfile, targets,
+                                     arcname='anna-config.yml')
+    if results:
+        print(('Copied the KVS config into %d containers; the slowest ' +
+               'took %.2f seconds.') % (len(results), max(
+                   result.elapsed for result in results)))
+    util.check_copies(results)
 
-def batch_add_nodes(client, apps_client, cfile, node_types, node_counts, batch_size, prefix):
-  if sum(node_counts) <= batch_size:
+def batch_add_nodes(client, apps_client, cfile, node_types, node_counts,
+                    batch_size, prefix):
+    '''
+    Adds the given numbers of nodes of each type at once, keeping at most
+    batch_size nodes of each type requested but not yet running.
+    '''
     add_nodes(client, apps_client, cfile, node_types, node_counts, True,
-              prefix)
-  else:
-    for i in range(len(node_types)):
-        if node_counts[i] <= batch_size:
-            batch_add_nodes(client, apps_client, cfile, [node_types[i]], [node_counts[i]], batch_size, prefix)
-        else:
-            batch_count = 1
-            print('Batch %d: adding %d nodes...' % (batch_count, batch_size))
-            add_nodes(client, apps_client, cfile, [node_types[i]], [batch_size], True,
-                      prefix)
-            remaining_count = node_counts[i] - batch_size
-            batch_count += 1
-            while remaining_count > 0:
-              if remaining_count <= batch_size:
-                print('Batch %d: adding %d nodes...' % (batch_count, remaining_count))
-                add_nodes(client, apps_client, cfile, [node_types[i]], [remaining_count], False,
-                          prefix)
-                remaining_count = 0
-              else:
-                print('Batch %d: adding %d nodes...' % (batch_count, batch_size))
-                add_nodes(client, apps_client, cfile, [node_types[i]], [batch_size], False,
-                          prefix)
-                remaining_count = remaining_count - batch_size
-              batch_count += 1
+              prefix, batch_size)
@@ -75,16 +75,17 @@ def create_cluster(mem_count, ebs_count, func_count, gpu_count, sched_count,
     management_podname = management_spec['metadata']['name']
     kcname = management_spec['spec']['containers'][0]['name']
 
-    os.system('cp %s anna-config.yml' % cfile)
+    # These all go in one archive, unpacked at the root of the pod.
     kubecfg = os.path.join(os.environ['HOME'], '.kube/config')
-    util.copy_file_to_pod(client, kubecfg, management_podname, '/root/.kube/',
-                          kcname)
-    util.copy_file_to_pod(client, ssh_key, management_podname, '/root/.ssh/',
-                          kcname)
-    util.copy_file_to_pod(client, ssh_key + '.pub', management_podname,
-                          '/root/.ssh/', kcname)
-    util.copy_file_to_pod(client, 'anna-config.yml', management_podname,
-                          '/hydro/anna/conf/', kcname)
+    key_name = os.path.basename(ssh_key)
+    archive = util.make_archive([
+        (kubecfg, 'root/.kube/config'),
+        (ssh_key, 'root/.ssh/' + key_name),
+        (ssh_key + '.pub', 'root/.ssh/' + key_name + '.pub'),
+        (cfile, 'hydro/anna/conf/anna-config.yml')
+    ])
+    util.check_copies(util.copy_archive_to_pods(
+        client, archive, [(management_podname, '/', kcname)]))
 
     # Start the monitoring pod.
     mon_spec = util.load_yaml('yaml/pods/monitoring-pod.yml', prefix)
@@ -95,11 +96,10 @@ def create_cluster(mem_count, ebs_count, func_count, gpu_count, sched_count,
     # Wait until the monitoring pod is finished creating to get its IP address
     # and then copy KVS config into the monitoring pod.
     util.get_pod_ips(client, 'role=monitoring')
-    util.copy_file_to_pod(client, 'anna-config.yml',
-                          mon_spec['metadata']['name'],
+    util.copy_file_to_pod(client, cfile, mon_spec['metadata']['name'],
                           '/hydro/anna/conf/',
-                          mon_spec['spec']['containers'][0]['name'])
-    os.system('rm anna-config.yml')
+                          mon_spec['spec']['containers'][0]['name'],
+                          arcname='anna-config.yml')
 
     print('Creating %d routing nodes...' % (route_count))
     batch_add_nodes(client, apps_client, cfile, ['routing'], [route_count], BATCH_SIZE, prefix)
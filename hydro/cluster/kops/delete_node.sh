@@ -1,36 +1,48 @@
 #!/bin/bash
 
-# Safely evict the pods from the node that we are trying to delete
-kubectl drain $1 --ignore-daemonsets --delete-local-data > /dev/null 2>&1
-
-kubectl delete node $1 > /dev/null 2>&1
-
-YML_FILE=yaml/igs/$2-ig.yml
-
-sed "s|CLUSTER_NAME|$HYDRO_CLUSTER_NAME|g" $YML_FILE > tmp.yml
-sed -i "s|MAX_DUMMY|$3|g" tmp.yml
-sed -i "s|MIN_DUMMY|$4|g" tmp.yml
-
-kops replace -f tmp.yml --force > /dev/null 2>&1
-rm tmp.yml
-
-kops update cluster --name ${HYDRO_CLUSTER_NAME} --yes > /dev/null 2>&1
-
-ID=$(aws ec2 --region us-east-1 describe-instances --filter Name=private-dns-name,Values=$1 --query 'Reservations[].Instances[].InstanceId' --output text)
-
-# Detach the ec2 instance associated with the node we just deleted.
+if [ -z "$1" ] || [ -z "$2" ] || [ -z "$3" ]; then
+  echo "Usage: ./delete_node.sh node-type new-count hostname [hostname ...]"
+  echo "Removes every listed node from the node type's instance group at once."
+  exit 1
+fi
+
+KIND=$1
+NEW=$2
+shift 2
+
+ASG=$KIND-instances.$HYDRO_CLUSTER_NAME
+YML_FILE=yaml/igs/$KIND-ig.yml
+
+# Safely evict the pods from the nodes that we are trying to delete, in
+# parallel.
+for HOST in "$@"; do
+  (kubectl drain $HOST --ignore-daemonsets --delete-local-data > /dev/null 2>&1
+   kubectl delete node $HOST > /dev/null 2>&1) &
+done
+wait
+
+# Lower the group's minimum size first, so that detaching the instances can
+# decrement its desired capacity.
+aws autoscaling --region us-east-1 update-auto-scaling-group --auto-scaling-group-name $ASG --min-size $NEW > /dev/null 2>&1
+
+HOSTS=$(echo "$@" | tr ' ' ',')
+IDS=$(aws ec2 --region us-east-1 describe-instances --filter Name=private-dns-name,Values=$HOSTS --query 'Reservations[].Instances[].InstanceId' --output text)
+
+# Detach the ec2 instances associated with the nodes we just deleted; at most
+# 20 instances can be detached per call.
 # --should-decrement-desired-capacity is a mandatory flag that we need to specify to signal
 # how the desired cluster size should change. For our purpose, the desired value does not matter.
-aws autoscaling --region us-east-1 detach-instances --instance-ids $ID --auto-scaling-group-name $2-instances.$HYDRO_CLUSTER_NAME --should-decrement-desired-capacity > /dev/null 2>&1
+echo $IDS | xargs -n 20 aws autoscaling --region us-east-1 detach-instances --auto-scaling-group-name $ASG --should-decrement-desired-capacity --instance-ids > /dev/null 2>&1
 
-# Terminate the en2 instance.
-aws ec2 --region us-east-1 terminate-instances --instance-ids $ID > /dev/null 2>&1
+# Terminate the ec2 instances.
+aws ec2 --region us-east-1 terminate-instances --instance-ids $IDS > /dev/null 2>&1
 
-sed "s|CLUSTER_NAME|$HYDRO_CLUSTER_NAME|g" $YML_FILE > tmp.yml
-sed -i "s|MAX_DUMMY|$4|g" tmp.yml
-sed -i "s|MIN_DUMMY|$4|g" tmp.yml
+# Apply the new size to the instance group with a single cluster update.
+sed "s|CLUSTER_NAME|$HYDRO_CLUSTER_NAME|g" $YML_FILE > tmp-$KIND.yml
+sed -i "s|MAX_DUMMY|$NEW|g" tmp-$KIND.yml
+sed -i "s|MIN_DUMMY|$NEW|g" tmp-$KIND.yml
 
-kops replace -f tmp.yml --force > /dev/null 2>&1
-rm tmp.yml
+kops replace -f tmp-$KIND.yml --force > /dev/null 2>&1
+rm tmp-$KIND.yml
 
-kops update cluster --name ${HYDRO_CLUSTER_NAME} --yes > /dev/null 2>&1
\ No newline at end of file
+kops update cluster --name ${HYDRO_CLUSTER_NAME} --yes > /dev/null 2>&1
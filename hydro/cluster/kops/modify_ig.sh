@@ -14,20 +14,26 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-if [ -z "$1" ] && [ -z "$2" ]; then
-  echo "Usage: ./add_servers.sh node-type instance-count"
-  echo "Valid node types are memory, ebs, benchmark, and routing."
-  echo "If number of previous instances is not specified, it is assumed to be 0."
+if [ -z "$1" ] || [ -z "$2" ]; then
+  echo "Usage: ./modify_ig.sh node-type instance-count [node-type instance-count ...]"
+  echo "Valid node types are memory, ebs, function, gpu, scheduler, benchmark, and routing."
+  echo "Each instance group is resized to the given count, and the cluster is updated once."
   exit 1
 fi
 
-YML_FILE=yaml/igs/$1-ig.yml
+# Replace every instance group first, so that a single cluster update applies
+# all of the size changes at once.
+while [ -n "$1" ] && [ -n "$2" ]; do
+  YML_FILE=yaml/igs/$1-ig.yml
 
-sed "s|CLUSTER_NAME|$HYDRO_CLUSTER_NAME|g" $YML_FILE > tmp.yml
-sed -i "s|MAX_DUMMY|$2|g" tmp.yml
-sed -i "s|MIN_DUMMY|$2|g" tmp.yml
+  sed "s|CLUSTER_NAME|$HYDRO_CLUSTER_NAME|g" $YML_FILE > tmp-$1.yml
+  sed -i "s|MAX_DUMMY|$2|g" tmp-$1.yml
+  sed -i "s|MIN_DUMMY|$2|g" tmp-$1.yml
 
-kops replace -f tmp.yml --force > /dev/null 2>&1
-rm tmp.yml
+  kops replace -f tmp-$1.yml --force > /dev/null 2>&1
+  rm tmp-$1.yml
+
+  shift 2
+done
 
 kops update cluster --name ${HYDRO_CLUSTER_NAME} --yes > /dev/null 2>&1
@@ -14,10 +14,21 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+# Retries kops validate with jittered exponential backoff (up to 30 seconds
+# between attempts) until the cluster is valid, and fails after
+# VALIDATE_TIMEOUT seconds (by default, 30 minutes).
+TIMEOUT=${VALIDATE_TIMEOUT:-1800}
+DELAY=2
+START=$SECONDS
+
 echo "Validating cluster..."
-kops validate cluster > /dev/null 2>&1
-while [ $? -ne 0 ]
+until kops validate cluster > /dev/null 2>&1
 do
-  kops validate cluster > /dev/null 2>&1
-done
+  if [ $((SECONDS - START)) -ge $TIMEOUT ]; then
+    echo "Timed out after $TIMEOUT seconds waiting for the cluster to validate."
+    exit 1
+  fi
 
+  sleep $((DELAY / 2 + RANDOM % (DELAY / 2 + 1)))
+  DELAY=$((DELAY * 2 > 30 ? 30 : DELAY * 2))
+done
@@ -14,14 +14,43 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from hydro.cluster.warm_pool import get_pool_node_names
 from hydro.shared import util
 
-def remove_node(ip, ntype):
-    client, _ = util.init_k8s()
+def remove_nodes(ips, ntype, pod_cache=None):
+    '''
+    Removes every node in ips, all of kind ntype, from its instance group with
+    a single cluster update.
+    '''
+    client = pod_cache.client if pod_cache else util.init_k8s()[0]
 
-    pod = util.get_pod_from_ip(client, ip)
-    hostname = 'ip-%s.ec2.internal' % (ip.replace('.', '-'))
+    # The warm pool's nodes are labeled as function nodes, but they are in
+    # their own instance group, so the pods on them don't count towards the
+    # size of this one.
+    pool_nodes = get_pool_node_names(client)
 
-    prev_count = util.get_previous_count(client, ntype)
+    # If the caller keeps a pod cache, we answer the lookups from it rather
+    # than listing pods on the API server.
+    if pod_cache is None:
+        pods = [util.get_pod_from_ip(client, ip) for ip in ips]
+        prev_count = util.get_previous_count(client, ntype, pool_nodes)
+    else:
+        pods = [pod_cache.get_pod_from_ip(ip) for ip in ips]
+        prev_count = pod_cache.get_previous_count(ntype, pool_nodes)
 
-    util.run_process(['./delete_node.sh', hostname, ntype, str(prev_count), str(prev_count - 1)])
\ No newline at end of file
+    hostnames = [get_hostname(ip) for ip in ips]
+
+    util.run_process(['./delete_node.sh', ntype, str(prev_count - len(ips))] +
+                     hostnames)
+
+    # The pods are gone now, so make sure we don't hand out their IPs again
+    # before the watch catches up.
+    if pod_cache is not None:
+        for pod in pods:
+            pod_cache.invalidate(name=pod.metadata.name)
+
+def remove_node(ip, ntype, pod_cache=None):
+    remove_nodes([ip], ntype, pod_cache)
+
+def get_hostname(ip):
+    return 'ip-%s.ec2.internal' % (ip.replace('.', '-'))
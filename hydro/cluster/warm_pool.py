@@ -0,0 +1,250 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import threading
+
+import kubernetes as k8s
+
+from hydro.shared import util
+from hydro.shared.wait import WaitTimeout, watch_until
+
+# The kind (and instance group) of the warm pool's nodes.
+STANDBY_KIND = 'standby'
+
+# Every node in the standby instance group has this label, whether it is still
+# on standby or has been promoted.
+POOL_LABEL = 'hydro-pool'
+
+# Nodes on standby have this taint, which keeps the function DaemonSet from
+# scheduling executors on them. Promoting a node removes it.
+STANDBY_TAINT = 'hydro-standby'
+
+# How long (in seconds) we wait for a promoted node's executors to start.
+PROMOTE_TIMEOUT = 120
+
+# How often (in seconds) we check the pool when nothing has asked us to.
+REFILL_PERIOD = 30
+
+
+class WarmPool():
+    '''
+    Keeps size function nodes booted but held out of the executor set, so that
+    adding function nodes doesn't have to wait for kops, EC2, and image pulls.
+    take promotes standby nodes into executors, and the pool is topped back
+    up in the background by a thread started with start. The backend does the
+    actual work on the cluster; see KopsPoolBackend.
+    '''
+
+    def __init__(self, backend, size, refill_period=REFILL_PERIOD):
+        self.backend = backend
+        self.size = size
+        self.refill_period = refill_period
+
+        # Promoting nodes doesn't change the size of the instance group, so it
+        # doesn't have to wait for a resize, which can take a while.
+        self.promote_lock = threading.Lock()
+        self.group_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def take(self, count):
+        '''
+        Promotes up to count standby nodes into function nodes, and returns
+        how many were promoted; the caller adds the rest the slow way.
+        '''
+        with self.promote_lock:
+            nodes = self.backend.standby_nodes()[:count]
+            if nodes:
+                logging.info('Promoting %d standby node(s): %s.' %
+                             (len(nodes), ', '.join(nodes)))
+                self.backend.promote(nodes)
+
+        self.wake.set()
+        return len(nodes)
+
+    def owns(self, ip):
+        return self.backend.owns(ip)
+
+    def remove(self, ips):
+        '''
+        Removes the promoted nodes in ips from the standby instance group.
+        '''
+        with self.group_lock:
+            self.backend.remove(ips)
+
+        self.wake.set()
+
+    def refill(self):
+        '''
+        Grows the standby instance group so that, once every node in it has
+        booted, size of them are on standby. We never shrink the pool here;
+        promoted nodes leave it through remove.
+        '''
+        with self.group_lock:
+            active = self.backend.active_count()
+            size = self.backend.group_size()
+
+            target = active + self.size
+            if size < target:
+                logging.info(('Warm pool has %d of %d nodes booted or ' +
+                              'booting. Requesting %d more.') %
+                             (size - active, self.size, target - size))
+                self.backend.resize(target)
+
+    def _run(self):
+        while self.running:
+            try:
+                self.refill()
+            except Exception as e:
+                logging.error('Unable to refill the warm pool: %s' % (str(e)))
+
+            self.wake.wait(self.refill_period)
+            self.wake.clear()
+
+
+class KopsPoolBackend():
+    '''
+    Keeps the warm pool's nodes in their own kops instance group (see
+    yaml/igs/standby-ig.yml). They come up labeled as function nodes, but
+    tainted, so only the standby DaemonSet (which pulls the executor images)
+    runs on them. Promoting a node removes the taint, waits for the function
+    DaemonSet to start its executors, and copies in the KVS config, as
+    add_nodes does for new function nodes.
+    '''
+
+    def __init__(self, client, apps_client, cfile, prefix=None,
+                 watch_factory=None):
+        self.client = client
+        self.cfile = cfile
+        self.watch_factory = watch_factory
+
+        # Nodes we asked for before a restart may not have registered yet,
+        # so the next refill might request a few too many.
+        self.size = len(self._nodes())
+
+        try:
+            apps_client.read_namespaced_daemon_set('standby-nodes',
+                                                   namespace=util.NAMESPACE)
+        except k8s.client.rest.ApiException:
+            yml = util.load_yaml('yaml/ds/standby-ds.yml', prefix)
+            apps_client.create_namespaced_daemon_set(namespace=util.NAMESPACE,
+                                                     body=yml)
+
+    def standby_nodes(self):
+        return sorted(node.metadata.name for node in self._nodes()
+                      if _is_standby(node) and _is_ready(node))
+
+    def active_count(self):
+        return len([node for node in self._nodes() if not _is_standby(node)])
+
+    def group_size(self):
+        return self.size
+
+    def resize(self, size):
+        util.run_process(['./modify_ig.sh', STANDBY_KIND, str(size)])
+        self.size = size
+
+    def promote(self, names):
+        for name in names:
+            node = self.client.read_node(name)
+            taints = [{'key': taint.key, 'value': taint.value,
+                       'effect': taint.effect}
+                      for taint in node.spec.taints or []
+                      if taint.key != STANDBY_TAINT]
+            self.client.patch_node(name, {'spec': {'taints': taints}})
+
+        def started(pods):
+            pods = [pod for pod in pods.values()
+                    if pod.spec.node_name in names]
+            if len(pods) < len(names) or any(
+                    pod.status.phase != 'Running' for pod in pods):
+                return None
+
+            return pods
+
+        # If the executors are slow to start, the nodes still join once they
+        # do, but without the KVS config in their caches.
+        try:
+            pods = watch_until(self.client.list_namespaced_pod, started,
+                               'executors on %s' % (', '.join(names)),
+                               PROMOTE_TIMEOUT, self.watch_factory,
+                               namespace=util.NAMESPACE,
+                               label_selector='role=function')
+        except WaitTimeout as e:
+            logging.error(str(e))
+            return
+
+        targets = [(pod.metadata.name, '/hydro/anna-cache/conf/',
+                    'cache-container') for pod in pods]
+        results = util.copy_file_to_pods(self.client, self.cfile, targets,
+                                         arcname='anna-config.yml')
+        for result in results:
+            if not result.success:
+                logging.error('Unable to copy the KVS config to %s: %s' %
+                              (result.pod, result.error))
+
+    def owns(self, ip):
+        return self._find(ip) is not None
+
+    def remove(self, ips):
+        hostnames = [self._find(ip).metadata.name for ip in ips]
+        util.run_process(['./delete_node.sh', STANDBY_KIND,
+                          str(self.size - len(ips))] + hostnames)
+        self.size -= len(ips)
+
+    def _find(self, ip):
+        for node in self._nodes():
+            for address in node.status.addresses or []:
+                if address.type == 'InternalIP' and address.address == ip:
+                    return node
+
+        return None
+
+    def _nodes(self):
+        return list_pool_nodes(self.client)
+
+
+def list_pool_nodes(client):
+    return client.list_node(label_selector='%s=%s' %
+                            (POOL_LABEL, STANDBY_KIND)).items
+
+
+def get_pool_node_names(client):
+    '''
+    Returns the names of the nodes in the standby instance group, on standby
+    or promoted. They are labeled as function nodes, so the function pods on
+    them have to be left out when sizing the function instance group.
+    '''
+    return {node.metadata.name for node in list_pool_nodes(client)}
+
+
+def _is_standby(node):
+    return any(taint.key == STANDBY_TAINT for taint in
+               node.spec.taints or [])
+
+
+def _is_ready(node):
+    return any(condition.type == 'Ready' and condition.status == 'True'
+               for condition in node.status.conditions or [])
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+Exercises the warm pool against a fake backend, in which nodes take
+boot_delay seconds to come up and promote_delay seconds to promote, and
+reports how long each of a series of scale-out requests takes to get its
+capacity, with and without a pool. Requests the pool can't cover are added
+cold, like k8s_server does, and take boot_delay. Delays are in (scaled-down)
+real seconds, so the pool's background refill runs just as it would in a
+cluster.
+
+With --check-kops, we instead run KopsPoolBackend, add_nodes, and
+remove_nodes against a fake cluster (see FakeKopsCluster), and check the
+instance group sizes they ask kops for.
+'''
+
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from hydro.cluster.add_nodes import add_nodes
+from hydro.cluster.remove_node import get_hostname, remove_nodes
+from hydro.cluster.warm_pool import (
+    KopsPoolBackend,
+    POOL_LABEL,
+    STANDBY_KIND,
+    STANDBY_TAINT,
+    WarmPool
+)
+from hydro.shared import util
+from hydro.shared.fake_k8s import FakeCoreV1Api, FakeWatch, make_node, make_pod
+from hydro.shared.pod_cache import PodCache
+
+BOOTING = 'booting'
+STANDBY = 'standby'
+ACTIVE = 'active'
+
+
+class FakePoolBackend():
+    '''
+    An in-memory stand-in for KopsPoolBackend. Each node is named after its
+    fake IP, and is on standby boot_delay seconds after the group is resized
+    to include it.
+    '''
+
+    def __init__(self, boot_delay, promote_delay, resize_delay=0):
+        self.boot_delay = boot_delay
+        self.promote_delay = promote_delay
+        self.resize_delay = resize_delay
+
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.next_node = 0
+        self.resizes = 0
+
+    def standby_nodes(self):
+        with self.lock:
+            return sorted(name for name, state in self.nodes.items() if
+                          self._state(state) == STANDBY)
+
+    def active_count(self):
+        with self.lock:
+            return len([state for state in self.nodes.values() if
+                        state == ACTIVE])
+
+    def group_size(self):
+        with self.lock:
+            return len(self.nodes)
+
+    def resize(self, size):
+        time.sleep(self.resize_delay)
+        with self.lock:
+            self.resizes += 1
+            while len(self.nodes) < size:
+                name = '10.1.%d.%d' % (self.next_node // 250,
+                                       self.next_node % 250 + 1)
+                self.next_node += 1
+                self.nodes[name] = time.time() + self.boot_delay
+
+    def promote(self, names):
+        time.sleep(self.promote_delay)
+        with self.lock:
+            for name in names:
+                self.nodes[name] = ACTIVE
+
+    def owns(self, ip):
+        with self.lock:
+            return ip in self.nodes
+
+    def remove(self, ips):
+        with self.lock:
+            for ip in ips:
+                del self.nodes[ip]
+
+    def _state(self, state):
+        # Booting nodes are stored as the time they come up.
+        if state == ACTIVE:
+            return ACTIVE
+
+        return STANDBY if time.time() >= state else BOOTING
+
+
+class FakeKopsCluster(FakeCoreV1Api):
+    '''
+    A fake cluster whose instance groups are resized by the kops scripts:
+    run_process stands in for util.run_process, and applies modify_ig.sh and
+    delete_node.sh to the fake nodes. Nodes boot as soon as their group is
+    resized, and each gets the pods its DaemonSets would run on it: a function
+    pod on function nodes, a standby pod on the warm pool's nodes, and both
+    once a pool node is promoted.
+    '''
+
+    def __init__(self):
+        super().__init__()
+
+        self.groups = {}
+        self.sizes = {}
+        self.commands = []
+        self.next_node = 0
+
+    def run_process(self, command):
+        self.commands.append(command)
+        args = command[1:]
+
+        if command[0] == './modify_ig.sh':
+            for kind, size in zip(args[::2], args[1::2]):
+                self.resize(kind, int(size))
+        elif command[0] == './delete_node.sh':
+            kind, size, hostnames = args[0], int(args[1]), args[2:]
+            for hostname in hostnames:
+                self.terminate(hostname)
+
+            self.sizes[kind] = size
+
+    def resize(self, kind, size):
+        self.sizes[kind] = size
+        while len(self.group(kind)) < size:
+            self.boot(kind)
+
+    def group(self, kind):
+        return sorted(name for name, group in self.groups.items() if
+                      group == kind)
+
+    def boot(self, kind):
+        ip = '10.2.%d.%d' % (self.next_node // 250, self.next_node % 250 + 1)
+        self.next_node += 1
+
+        labels = {'role': kind}
+        taints = ()
+        if kind == STANDBY_KIND:
+            labels = {'role': 'function', POOL_LABEL: STANDBY_KIND}
+            taints = [(STANDBY_TAINT, 'true', 'NoSchedule')]
+
+        name = get_hostname(ip)
+        self.groups[name] = kind
+        self.add_node(make_node(name, labels, ip, taints))
+        self.schedule(name)
+
+    def terminate(self, name):
+        self.groups.pop(name, None)
+        self.remove_node(name)
+        for pod in list(self.pods.values()):
+            if pod.spec.node_name == name:
+                self.delete_pod(pod.metadata.name)
+
+    def patch_node(self, name, body, **kwargs):
+        node = super().patch_node(name, body, **kwargs)
+        self.schedule(name)
+        return node
+
+    def schedule(self, name):
+        node = self.nodes[name]
+        ip = node.status.addresses[0].address
+
+        roles = []
+        if POOL_LABEL in node.metadata.labels:
+            roles.append(STANDBY_KIND)
+        if not node.spec.taints:
+            roles.append(node.metadata.labels['role'])
+
+        for role in roles:
+            pname = '%s-%s' % (role, name.split('.')[0])
+            if pname not in self.pods:
+                self.add_pod(make_pod(pname, role, ip, node_name=name))
+
+
+def check_kops_backend():
+    '''
+    Promotes a standby node, then adds and removes function nodes, and checks
+    that the function instance group is sized from its own nodes alone: the
+    promoted node is labeled as a function node, but it stays in the standby
+    group. Returns the group sizes after each step, along with the sizes we
+    expect.
+    '''
+    cluster = FakeKopsCluster()
+    cluster.resize('function', 2)
+
+    cfile = tempfile.NamedTemporaryFile(suffix='.yml')
+    apps_client = SimpleNamespace(
+        read_namespaced_daemon_set=lambda *args, **kwargs: None)
+    pod_cache = PodCache(cluster, watch_factory=FakeWatch)
+    pod_cache.start()
+
+    steps = []
+
+    def record(step):
+        steps.append((step, cluster.sizes.get('function'),
+                      cluster.sizes.get(STANDBY_KIND)))
+
+    # The fake cluster can't exec into pods, so copying the KVS config into
+    # promoted nodes fails; that isn't what we are checking here.
+    logging.disable(logging.ERROR)
+    run_process = util.run_process
+    util.run_process = cluster.run_process
+    try:
+        backend = KopsPoolBackend(cluster, apps_client, cfile.name,
+                                  watch_factory=FakeWatch)
+        pool = WarmPool(backend, 2)
+        pool.refill()
+        record('refill')
+
+        promoted = backend.standby_nodes()[0]
+        pool.take(1)
+        record('promote')
+
+        add_nodes(cluster, apps_client, cfile.name, ['function'], [1],
+                  watch_factory=FakeWatch)
+        record('add')
+
+        victim = cluster.group('function')[0]
+        remove_nodes([cluster.nodes[victim].status.addresses[0].address],
+                     'function', pod_cache)
+        record('remove')
+
+        pool.remove([cluster.nodes[promoted].status.addresses[0].address])
+        record('pool_remove')
+
+        pool.refill()
+        record('refill')
+    finally:
+        util.run_process = run_process
+        logging.disable(logging.NOTSET)
+        pod_cache.stop()
+        cfile.close()
+
+    expected = [('refill', 2, 2), ('promote', 2, 2), ('add', 3, 2),
+                ('remove', 2, 2), ('pool_remove', 2, 1), ('refill', 2, 2)]
+    return {
+        'steps': steps,
+        'expected': expected,
+        'passed': steps == expected,
+        'commands': cluster.commands
+    }
+
+
+def run_requests(pool_size, args):
+    '''
+    Issues args.requests scale-out requests of args.count nodes each,
+    args.interval seconds apart, and returns the seconds each took to get
+    all of its nodes.
+    '''
+    backend = FakePoolBackend(args.boot_delay, args.promote_delay,
+                              args.resize_delay)
+    pool = None
+    if pool_size > 0:
+        pool = WarmPool(backend, pool_size, refill_period=args.boot_delay / 4)
+
+        # The pool is filled when the cluster is created, before any load.
+        pool.refill()
+        time.sleep(args.boot_delay)
+        pool.start()
+
+    latencies = []
+    for i in range(args.requests):
+        start = time.time()
+        promoted = pool.take(args.count) if pool else 0
+
+        # Anything the pool couldn't cover is added cold.
+        if args.count > promoted:
+            time.sleep(args.boot_delay)
+
+        latencies.append(time.time() - start)
+        time.sleep(max(args.interval - (time.time() - start), 0))
+
+    if pool:
+        pool.stop()
+
+    return {
+        'pool_size': pool_size,
+        'time_to_capacity': latencies,
+        'mean': sum(latencies) / len(latencies),
+        'max': max(latencies),
+        'resizes': backend.resizes
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=4,
+                        help='The number of scale-out requests.')
+    parser.add_argument('--count', type=int, default=2,
+                        help='The number of nodes each request asks for.')
+    parser.add_argument('--interval', type=float, default=1,
+                        help='Seconds between requests.')
+    parser.add_argument('--boot-delay', type=float, default=2)
+    parser.add_argument('--promote-delay', type=float, default=.05)
+    parser.add_argument('--resize-delay', type=float, default=.1)
+    parser.add_argument('--check-kops', action='store_true',
+                        help='Check the instance group sizes that ' +
+                        'KopsPoolBackend, add_nodes, and remove_nodes ask ' +
+                        'for on a fake cluster, and exit.')
+    args = parser.parse_args()
+
+    if args.check_kops:
+        result = check_kops_backend()
+        print(json.dumps(result))
+        sys.exit(0 if result['passed'] else 1)
+
+    for pool_size in (0, args.pool_size):
+        print(json.dumps(run_requests(pool_size, args)))
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+A load-replay benchmark for the management server. This runs
+management_server.run in-process against a fake Kubernetes client, and drives
+it over local ZMQ endpoints with synthetic ThreadStatus and
+ExecutorStatistics streams from N executor threads and M functions. Each
+executor node gets its own loopback address (127.1.x.y), so the management
+server sees the same addresses and ports it would see in a real cluster, and
+the fake executors acknowledge pins just like Cloudburst executors do.
+
+At the end of the run, we report message ingestion throughput, per-epoch
+policy time, pin latency, loop iteration time, and the round-trip time of a
+list_schedulers request, which measures how far behind the loop is.
+
+This requires the compiled protobufs (see scripts/compile-proto.sh), and it
+binds the management server's usual ports, so it can't run alongside a real
+management server.
+'''
+
+import argparse
+import heapq
+import json
+import random
+import threading
+import time
+
+import zmq
+
+from hydro.management import management_server
+from hydro.management.instrumentation import LoopStats
+from hydro.management.sketch import QuantileSketch
+from hydro.management.util import (
+    EXECUTOR_PIN_PORT,
+    NUM_EXEC_THREADS,
+    TCP_BASE
+)
+from hydro.shared.fake_k8s import FakeCoreV1Api, FakeWatch, make_pod
+from hydro.shared.pod_cache import PodCache
+from hydro.shared.proto.cloudburst_pb2 import GenericResponse
+from hydro.shared.proto.internal_pb2 import (
+    CPU,
+    ExecutorStatistics,
+    PinFunction,
+    ThreadStatus
+)
+
+MANAGEMENT_IP = '127.0.0.1'
+
+STATUS_PORT = 7003
+LIST_SCHEDULERS_PORT = 7004
+STATISTICS_PORT = 7006
+
+
+def get_node_ip(index):
+    return '127.1.%d.%d' % (index // 250, index % 250 + 1)
+
+
+class FakeExecutors(threading.Thread):
+    '''
+    Listens on the pin port of every executor thread and acknowledges each pin
+    after pin_delay seconds, from the node's own address, so the management
+    server can attribute the response.
+    '''
+
+    def __init__(self, context, num_nodes, pin_delay):
+        super().__init__(daemon=True)
+        self.context = context
+        self.pin_delay = pin_delay
+        self.stopped = threading.Event()
+
+        # The functions each executor thread has been asked to pin.
+        self.functions = {}
+
+        self.poller = zmq.Poller()
+        self.pin_sockets = {}
+        self.response_sockets = {}
+        for i in range(num_nodes):
+            ip = get_node_ip(i)
+
+            sckt = self.context.socket(zmq.PUSH)
+            sckt.connect('tcp://%s:0;%s:%s' % (ip, MANAGEMENT_IP,
+                                               management_server
+                                               .PIN_ACCEPT_PORT))
+            self.response_sockets[ip] = sckt
+
+            for tid in range(NUM_EXEC_THREADS):
+                sckt = self.context.socket(zmq.PULL)
+                sckt.bind(TCP_BASE % (ip, EXECUTOR_PIN_PORT + tid))
+                self.poller.register(sckt, zmq.POLLIN)
+
+                self.pin_sockets[sckt] = (ip, tid)
+                self.functions[(ip, tid)] = set()
+
+    def run(self):
+        # Responses that are due, ordered by the time they should be sent.
+        responses = []
+        while not self.stopped.is_set():
+            socks = dict(self.poller.poll(timeout=10))
+
+            for sckt in socks:
+                msg = PinFunction()
+                msg.ParseFromString(sckt.recv())
+
+                key = self.pin_sockets[sckt]
+                self.functions[key].add(msg.name)
+                heapq.heappush(responses, (time.time() + self.pin_delay,
+                                           key[0]))
+
+            while responses and responses[0][0] <= time.time():
+                _, ip = heapq.heappop(responses)
+
+                response = GenericResponse()
+                response.success = True
+                self.response_sockets[ip].send(response.SerializeToString())
+
+    def stop(self):
+        self.stopped.set()
+
+
+class LoadGenerator(threading.Thread):
+    '''
+    Sends a ThreadStatus from every executor thread status_rate times per
+    second, and an ExecutorStatistics message from every scheduler
+    stats_rate times per second, covering every function and DAG.
+    '''
+
+    def __init__(self, context, executors, num_functions, num_schedulers,
+                 status_rate, stats_rate, calls, runtime):
+        super().__init__(daemon=True)
+        self.context = context
+        self.executors = executors
+        self.num_functions = num_functions
+        self.num_schedulers = num_schedulers
+        self.status_rate = status_rate
+        self.stats_rate = stats_rate
+        self.calls = calls
+        self.runtime = runtime
+        self.stopped = threading.Event()
+
+        self.sent = {'status': 0, 'statistics': 0}
+
+        self.status_socket = self.context.socket(zmq.PUSH)
+        self.status_socket.connect(TCP_BASE % (MANAGEMENT_IP, STATUS_PORT))
+
+        self.statistics_socket = self.context.socket(zmq.PUSH)
+        self.statistics_socket.connect(TCP_BASE % (MANAGEMENT_IP,
+                                                   STATISTICS_PORT))
+
+    def run(self):
+        keys = sorted(self.executors.functions)
+
+        # Every executor thread starts out with one function pinned.
+        for i, key in enumerate(keys):
+            self.executors.functions[key].add(self.get_function(i))
+
+        status_interval = 1.0 / (self.status_rate * len(keys))
+        stats_interval = 1.0 / (self.stats_rate * self.num_schedulers)
+        next_status = next_stats = time.time()
+
+        i = 0
+        while not self.stopped.is_set():
+            now = time.time()
+
+            while next_status <= now:
+                self.send_status(keys[i % len(keys)])
+                i += 1
+                next_status += status_interval
+
+            while next_stats <= now:
+                self.send_statistics()
+                next_stats += stats_interval
+
+            time.sleep(max(0, min(next_status, next_stats) - time.time()))
+
+    def send_status(self, key):
+        status = ThreadStatus()
+        status.ip, status.tid = key
+        status.running = True
+        status.type = CPU
+        status.utilization = random.random()
+        status.functions.extend(list(self.executors.functions[key]))
+
+        self.status_socket.send(status.SerializeToString())
+        self.sent['status'] += 1
+
+    def send_statistics(self):
+        stats = ExecutorStatistics()
+        for i in range(self.num_functions):
+            fname = self.get_function(i)
+
+            # Schedulers report how many calls they made, and executors
+            # report how long those calls ran for.
+            fstats = stats.functions.add()
+            fstats.name = fname
+            fstats.call_count = self.calls
+
+            runtimes = [random.expovariate(1 / self.runtime)
+                        for _ in range(self.calls)]
+            fstats = stats.functions.add()
+            fstats.name = fname
+            fstats.call_count = self.calls
+            fstats.runtime.extend(runtimes)
+
+            dstats = stats.dags.add()
+            dstats.name = 'dag-' + fname
+            dstats.call_count = self.calls
+            dstats.interarrival.extend([random.expovariate(self.calls)
+                                        for _ in range(self.calls)])
+            dstats.runtimes.extend(runtimes)
+
+        self.statistics_socket.send(stats.SerializeToString())
+        self.sent['statistics'] += 1
+
+    def get_function(self, index):
+        return 'function-%d' % (index % self.num_functions)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def probe_loop_lag(context, stopped, period, latencies):
+    # Sends a list_schedulers request every period seconds and records how
+    # long the management server took to answer it.
+    sckt = context.socket(zmq.REQ)
+    sckt.connect(TCP_BASE % (MANAGEMENT_IP, LIST_SCHEDULERS_PORT))
+
+    while not stopped.wait(period):
+        start = time.time()
+        sckt.send_string('')
+        sckt.recv()
+        latencies.add(time.time() - start)
+
+
+def run_benchmark(num_nodes, num_functions, num_schedulers, status_rate,
+                  stats_rate, calls, runtime, pin_delay, duration,
+                  num_shards=0):
+    pods = [make_pod('management-pod', 'management', MANAGEMENT_IP)]
+    for i in range(num_nodes):
+        pods.append(make_pod('function-%d' % i, 'function', get_node_ip(i)))
+    for i in range(num_schedulers):
+        pods.append(make_pod('scheduler-%d' % i, 'scheduler',
+                             '127.2.0.%d' % (i + 1)))
+
+    pod_cache = PodCache(FakeCoreV1Api(pods), watch_factory=FakeWatch)
+    pod_cache.start()
+
+    loop_stats = LoopStats()
+    stopped = threading.Event()
+    server = threading.Thread(target=management_server.run,
+                              args=(MANAGEMENT_IP, pod_cache, loop_stats,
+                                    stopped, num_shards),
+                              daemon=True)
+    server.start()
+
+    context = zmq.Context(1)
+    context.set(zmq.MAX_SOCKETS, num_nodes * (NUM_EXEC_THREADS + 1) + 64)
+
+    executors = FakeExecutors(context, num_nodes, pin_delay)
+    executors.start()
+
+    generator = LoadGenerator(context, executors, num_functions,
+                              num_schedulers, status_rate, stats_rate, calls,
+                              runtime)
+    generator.start()
+
+    request_latencies = QuantileSketch()
+    probe = threading.Thread(target=probe_loop_lag,
+                             args=(context, stopped, 1, request_latencies),
+                             daemon=True)
+    probe.start()
+
+    time.sleep(duration)
+
+    generator.stop()
+    executors.stop()
+    stopped.set()
+    server.join()
+
+    report = loop_stats.snapshot()
+    report['sent'] = dict(generator.sent)
+    report['ingestion_rate'] = (report['messages'].get('status', 0) +
+                                report['messages'].get('statistics', 0)) / \
+        report['uptime']
+    report['request'] = {
+        'count': request_latencies.count,
+        'p50': request_latencies.p50,
+        'p99': request_latencies.p99,
+        'max': request_latencies.max if request_latencies.count else None
+    }
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Drives an in-process
+                                     management server with synthetic
+                                     executor and scheduler load, and reports
+                                     how well it keeps up.''')
+
+    parser.add_argument('-e', '--executors', type=int, default=100,
+                        help='The number of executor nodes (each with %d '
+                        % (NUM_EXEC_THREADS) + 'threads)')
+    parser.add_argument('-f', '--functions', type=int, default=50,
+                        help='The number of registered functions')
+    parser.add_argument('-s', '--schedulers', type=int, default=4,
+                        help='The number of schedulers reporting statistics')
+    parser.add_argument('--status-rate', type=float, default=1.0,
+                        help='ThreadStatus messages per executor thread per '
+                        + 'second')
+    parser.add_argument('--stats-rate', type=float, default=1.0,
+                        help='ExecutorStatistics messages per scheduler per '
+                        + 'second')
+    parser.add_argument('--calls', type=int, default=10,
+                        help='Calls per function in each statistics message')
+    parser.add_argument('--runtime', type=float, default=.05,
+                        help='The mean function runtime, in seconds')
+    parser.add_argument('--pin-delay', type=float, default=.01,
+                        help='How long executors take to acknowledge a pin')
+    parser.add_argument('-d', '--duration', type=float, default=30,
+                        help='How long to run the benchmark, in seconds')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='The number of statistics worker processes')
+
+    args = parser.parse_args()
+
+    report = run_benchmark(args.executors, args.functions, args.schedulers,
+                           args.status_rate, args.stats_rate, args.calls,
+                           args.runtime, args.pin_delay, args.duration,
+                           args.shards)
+    print(json.dumps(report, indent=2))
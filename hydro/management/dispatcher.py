@@ -0,0 +1,175 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import time
+
+import zmq
+
+# The most messages we take from one socket before moving on to the next one.
+DEFAULT_MAX_BATCH = 100
+
+# The most time (in seconds) we spend draining one socket before moving on to
+# the next one.
+DEFAULT_TIME_BUDGET = .05
+
+
+class SocketHandler():
+    '''
+    A socket registered with the dispatcher, along with the function that
+    handles each message received on it and the limits on how much of its
+    queue is drained at a time.
+    '''
+
+    def __init__(self, name, socket, handler, reply, copy, max_batch,
+                 time_budget):
+        self.name = name
+        self.socket = socket
+        self.handler = handler
+        self.reply = reply
+        self.copy = copy
+        self.max_batch = max_batch
+        self.time_budget = time_budget
+
+
+class SocketDispatcher():
+    '''
+    Polls a set of sockets and drains each ready socket in batches, calling
+    its handler once per message. Each socket gets a message budget and a
+    time budget per turn, so a burst on one socket can't starve the others.
+    The order in which the other sockets are served rotates each turn.
+
+    REP sockets (registered with reply=True) have priority: they are served
+    before any other socket and again between every other socket's batch, so
+    a requester waits for at most one batch. Their handlers return the reply
+    to send.
+
+    If a deadline is given, we stop draining when it passes and leave the
+    rest of the queue for the next turn. The management server uses this to
+    start each policy epoch on time, even under overload.
+    '''
+
+    def __init__(self, loop_stats=None):
+        self.loop_stats = loop_stats
+        self.poller = zmq.Poller()
+
+        self.priority = []
+        self.handlers = []
+
+        # The index in self.handlers of the socket to serve first next turn.
+        self.next_start = 0
+
+    def register(self, name, socket, handler, reply=False, copy=True,
+                 max_batch=DEFAULT_MAX_BATCH, time_budget=DEFAULT_TIME_BUDGET):
+        '''
+        Registers a socket to be drained by the given handler. If copy is
+        False, the handler receives zmq.Frame objects rather than bytes.
+        '''
+        entry = SocketHandler(name, socket, handler, reply, copy, max_batch,
+                              time_budget)
+        if reply:
+            self.priority.append(entry)
+        else:
+            self.handlers.append(entry)
+
+        self.poller.register(socket, zmq.POLLIN)
+
+    def poll(self, timeout):
+        '''
+        Waits up to timeout milliseconds for any socket to become readable,
+        and returns the readable sockets.
+        '''
+        return dict(self.poller.poll(timeout=timeout))
+
+    def dispatch(self, ready, deadline=None):
+        '''
+        Serves every socket in ready, as returned by poll, along with any REP
+        socket that has a request waiting. Returns the number of messages
+        handled.
+        '''
+        if not ready:
+            return 0
+
+        count = self._serve_priority(deadline)
+
+        num_handlers = len(self.handlers)
+        start = self.next_start
+        self.next_start = (start + 1) % max(num_handlers, 1)
+
+        for i in range(num_handlers):
+            entry = self.handlers[(start + i) % num_handlers]
+            if entry.socket not in ready:
+                continue
+
+            if deadline is not None and time.time() >= deadline:
+                break
+
+            count += self._drain(entry, deadline)
+
+            # The REP sockets may have received requests while we were
+            # draining; we serve them right away rather than making the
+            # requesters wait for the rest of the turn.
+            count += self._serve_priority(deadline)
+
+        return count
+
+    def _serve_priority(self, deadline):
+        count = 0
+        for entry in self.priority:
+            # This is cheaper than polling again, and it is accurate even for
+            # sockets the last poll didn't report as ready.
+            if entry.socket.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                count += self._drain(entry, deadline)
+
+        return count
+
+    def _drain(self, entry, deadline):
+        start = time.time()
+        stop = start + entry.time_budget
+        if deadline is not None:
+            # We always handle at least one message from a ready socket, so a
+            # REP socket is never left waiting for its reply.
+            stop = min(stop, deadline)
+
+        count = 0
+        while count < entry.max_batch:
+            try:
+                msg = entry.socket.recv(zmq.DONTWAIT, copy=entry.copy)
+            except zmq.ZMQError:
+                break  # We've run out of messages.
+
+            count += 1
+            try:
+                response = entry.handler(msg)
+            except Exception as e:
+                logging.error('Unexpected error handling %s message: %s' %
+                              (entry.name, str(e)))
+                response = None
+
+            if entry.reply:
+                if response is None:
+                    response = b''
+                elif type(response) == str:
+                    response = response.encode()
+
+                entry.socket.send(response)
+
+            if time.time() >= stop:
+                break
+
+        if self.loop_stats and count:
+            self.loop_stats.record_handler(entry.name, time.time() - start,
+                                           count, entry.socket)
+
+        return count
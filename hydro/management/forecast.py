@@ -0,0 +1,136 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import math
+
+
+class HoltWintersForecaster():
+    '''
+    Forecasts a time series with one value per epoch (e.g., the number of
+    calls to a function) using additive Holt-Winters exponential smoothing:
+    a smoothed level, a smoothed trend, and, if season_length is positive, a
+    smoothed seasonal offset for each position in a season of that many
+    epochs. alpha, beta, and gamma are the smoothing factors for the level,
+    trend, and seasonal components; with beta = gamma = 0, this is a plain
+    EWMA.
+
+    We also keep an exponentially weighted estimate of the variance of the
+    one-step-ahead forecast errors, which gives us confidence bounds on each
+    forecast.
+    '''
+
+    def __init__(self, alpha=.5, beta=.1, gamma=.1, season_length=0):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.season_length = season_length
+
+        self.level = 0.0
+        self.trend = 0.0
+        self.seasons = [0.0] * season_length
+        self.error_variance = 0.0
+
+        # The number of values observed so far.
+        self.count = 0
+
+        # The values observed in the first season, which we use to initialize
+        # the seasonal offsets once we have seen a whole season.
+        self.first_season = []
+
+    def update(self, value):
+        if self.count == 0:
+            self.level = float(value)
+            self.count = 1
+            self._record_first_season(value)
+            return
+
+        error = value - self.forecast(1)
+        self.error_variance = (self.alpha * error * error +
+                               (1 - self.alpha) * self.error_variance)
+
+        season = self._season(self.count)
+        previous_level = self.level
+
+        self.level = (self.alpha * (value - season) +
+                      (1 - self.alpha) * (self.level + self.trend))
+        self.trend = (self.beta * (self.level - previous_level) +
+                      (1 - self.beta) * self.trend)
+
+        if self._is_seasonal():
+            index = self.count % self.season_length
+            self.seasons[index] = (self.gamma * (value - self.level) +
+                                   (1 - self.gamma) * season)
+
+        self.count += 1
+        self._record_first_season(value)
+
+    def forecast(self, horizon):
+        '''
+        Returns the forecast value horizon epochs after the last one observed
+        (horizon = 1 is the next epoch).
+        '''
+        return (self.level + horizon * self.trend +
+                self._season(self.count + horizon - 1))
+
+    def interval(self, horizon, z):
+        '''
+        Returns the (lower, point, upper) forecast for horizon epochs ahead,
+        where the bounds are z standard deviations of the forecast error
+        away from the point forecast. The error grows with the horizon, and
+        we never forecast a negative value.
+        '''
+        point = self.forecast(horizon)
+        spread = z * math.sqrt(self.error_variance * horizon)
+
+        return max(point - spread, 0.0), max(point, 0.0), \
+            max(point + spread, 0.0)
+
+    def _season(self, index):
+        if not self._is_seasonal():
+            return 0.0
+
+        return self.seasons[index % self.season_length]
+
+    def _is_seasonal(self):
+        # We don't apply seasonal offsets until we have seen a full season to
+        # initialize them from.
+        return self.season_length > 0 and \
+            len(self.first_season) == self.season_length
+
+    def _record_first_season(self, value):
+        if len(self.first_season) >= self.season_length:
+            return
+
+        self.first_season.append(value)
+        if len(self.first_season) == self.season_length:
+            mean = sum(self.first_season) / self.season_length
+            self.seasons = [v - mean for v in self.first_season]
+            self.level = mean
+            self.trend = 0.0
+
+
+def normal_quantile(p):
+    '''
+    Returns z such that a standard normal variable is below z with probability
+    p, by bisection on the normal CDF.
+    '''
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        mid = (low + high) / 2
+        if .5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+            low = mid
+        else:
+            high = mid
+
+    return (low + high) / 2
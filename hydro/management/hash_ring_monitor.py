@@ -0,0 +1,222 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import namedtuple
+import logging
+import queue
+import random
+import threading
+import time
+
+import zmq
+
+from hydro.management.util import (
+    get_monitoring_depart_address,
+    get_routing_depart_address,
+    get_routing_seed_address,
+    get_storage_depart_address,
+    send_messages
+)
+from hydro.shared.proto.metadata_pb2 import ClusterMembership, MEMORY
+
+# How often (in seconds) we compare the hash ring against Kubernetes.
+CHECK_PERIOD = 5
+
+# How long (in seconds) we wait for a routing node to return the cluster
+# membership before we fail over to another one.
+ROUTING_TIMEOUT = 2
+
+# The outcome of one hash ring check: when it finished, which routing node
+# answered (None if none did), the departed (tier, ServerThread) pairs we
+# notified the cluster about, and an error message if the check failed.
+HashRingCheck = namedtuple('HashRingCheck', ['time', 'router', 'departed',
+                                             'error'])
+
+
+class HashRingMonitor(threading.Thread):
+    '''
+    Periodically compares the hash ring, as reported by a routing node, with
+    the storage nodes Kubernetes knows about, and tells the cluster about any
+    node that has departed. This runs on its own thread, with its own sockets,
+    so a slow or dead routing node never stalls the management server's main
+    loop. The outcome of each check is published on the results queue, and
+    its duration is recorded in loop_stats, if given.
+    '''
+
+    def __init__(self, pod_cache, context, period=CHECK_PERIOD,
+                 timeout=ROUTING_TIMEOUT, loop_stats=None):
+        super().__init__(daemon=True)
+
+        self.pod_cache = pod_cache
+        self.context = context
+        self.period = period
+        self.timeout = timeout
+        self.loop_stats = loop_stats
+
+        self.results = queue.Queue()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.time()
+
+            try:
+                result = self.check()
+            except Exception as e:
+                logging.error('Unexpected error while checking hash ring: %s'
+                              % (str(e)))
+                result = HashRingCheck(time.time(), None, [], str(e))
+
+            self.results.put(result)
+
+            elapsed = time.time() - start
+            if self.loop_stats:
+                self.loop_stats.record_handler('check_hash_ring', elapsed)
+
+            self.stopped.wait(max(0, self.period - elapsed))
+
+    def stop(self):
+        self.stopped.set()
+
+    def get_results(self):
+        '''
+        Returns every check result published since the last call, without
+        blocking.
+        '''
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def check(self):
+        route_ips = self.pod_cache.get_pod_ips('role=routing')
+
+        # If there are no routing nodes in the system currently, the system is
+        # still starting, so we do nothing.
+        if not route_ips:
+            return HashRingCheck(time.time(), None, [], None)
+
+        router, cluster = self.get_membership(route_ips)
+        if cluster is None:
+            return HashRingCheck(time.time(), None, [],
+                                 'No routing node responded.')
+
+        tiers = cluster.tiers
+
+        # If there are no tiers, then we don't need to evaluate anything.
+        if len(tiers) == 0:
+            return HashRingCheck(time.time(), router, [], None)
+        elif len(tiers) == 1:
+            # If there is one tier, it will be the memory tier.
+            mem_tier, ebs_tier = tiers[0], None
+        else:
+            # If there are two tiers, we need to make sure that we assign the
+            # correct tiers as the memory and EBS tiers, respectively.
+            if tiers[0].tier_id == MEMORY:
+                mem_tier = tiers[0]
+                ebs_tier = tiers[1]
+            else:
+                mem_tier = tiers[1]
+                ebs_tier = tiers[0]
+
+        # Queries the Kubernetes master for the list of memory nodes its aware
+        # of -- if any of the nodes in the hash ring aren't currently running,
+        # we add those the departed list.
+        mem_ips = self.pod_cache.get_pod_ips('role=memory')
+        departed = []
+        for node in mem_tier.servers:
+            if node.private_ip not in mem_ips:
+                departed.append(('0', node))
+
+        # Performs the same process for the EBS tier if it exists.
+        ebs_ips = []
+        if ebs_tier:
+            ebs_ips = self.pod_cache.get_pod_ips('role=ebs')
+            for node in ebs_tier.servers:
+                if node.private_ip not in ebs_ips:
+                    departed.append(('1', node))
+
+        logging.info('Found %d departed nodes.' % (len(departed)))
+        mon_ips = self.pod_cache.get_pod_ips('role=monitoring')
+        storage_ips = mem_ips + ebs_ips
+
+        # For each departed node the cluster is unaware of, we inform all
+        # storage nodes, all monitoring nodes, and all routing nodes that it
+        # has departed.
+        for pair in departed:
+            logging.info('Informing cluster that node %s/%s has departed.' %
+                         (pair[1].public_ip, pair[1].private_ip))
+
+            msg = pair[0] + ':' + pair[1].public_ip + ':' + \
+                pair[1].private_ip
+            depart_msg = 'depart:' + msg
+
+            # NOTE: In this code, we are presuming there are 4 threads per
+            # storage/routing node. If there are more, this will be buggy; if
+            # there are fewer, this is fine as the messages will go into the
+            # void.
+            messages = []
+            for ip in storage_ips:
+                for t in range(4):
+                    messages.append((get_storage_depart_address(ip, t), msg))
+
+            for ip in route_ips:
+                for t in range(4):
+                    messages.append((get_routing_depart_address(ip, t),
+                                     depart_msg))
+
+            for ip in mon_ips:
+                messages.append((get_monitoring_depart_address(ip),
+                                 depart_msg))
+
+            send_messages(self.context, messages)
+
+        return HashRingCheck(time.time(), router, departed, None)
+
+    def get_membership(self, route_ips):
+        '''
+        Asks the routing nodes, in random order, for the current cluster
+        membership, and returns the IP of the first one that answers within
+        the timeout along with its response. Returns (None, None) if none of
+        them answer.
+        '''
+        route_ips = list(route_ips)
+        random.shuffle(route_ips)
+
+        for ip in route_ips:
+            # A REQ socket can't be reused after a request goes unanswered, so
+            # we use a fresh socket for each attempt and discard it right away.
+            socket = self.context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.setsockopt(zmq.SNDTIMEO, int(self.timeout * 1000))
+            socket.setsockopt(zmq.RCVTIMEO, int(self.timeout * 1000))
+            socket.connect(get_routing_seed_address(ip, 0))
+
+            try:
+                socket.send_string('')
+                resp = socket.recv()
+            except zmq.ZMQError:
+                logging.error(('Routing node %s did not respond within ' +
+                               '%.1f seconds.') % (ip, self.timeout))
+                continue
+            finally:
+                socket.close()
+
+            cluster = ClusterMembership()
+            cluster.ParseFromString(resp)
+            return ip, cluster
+
+        return None, None
@@ -0,0 +1,269 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import logging
+import threading
+import time
+
+import zmq
+
+from hydro.management.sketch import QuantileSketch
+
+# The port on which the management server serves a JSON snapshot of its loop
+# statistics.
+STATS_PORT = 7007
+
+# The port on which the Kubernetes server serves a JSON snapshot of its
+# provisioning statistics.
+PROVISIONING_STATS_PORT = 7008
+
+# An epoch that starts more than this many seconds after it was due counts as
+# an overrun. The loop wakes up when each epoch is due and stops draining
+# sockets when it is, so an epoch this late means a single handler or the
+# previous epoch's policy ran for far too long.
+EPOCH_OVERRUN_THRESHOLD = 1.0
+
+
+class HandlerStats():
+    '''
+    How often one branch of the management loop ran, how many messages it
+    processed, how long it took, and how often it left messages behind on its
+    socket.
+    '''
+
+    def __init__(self):
+        self.messages = 0
+        self.time = 0.0
+        self.latencies = QuantileSketch()
+
+        # The number of calls after which the handler's socket still had
+        # messages waiting, and the largest number of messages a single call
+        # processed.
+        self.backlogged = 0
+        self.max_batch = 0
+
+    def record(self, elapsed, count, backlogged):
+        self.messages += count
+        self.time += elapsed
+        self.latencies.add(elapsed)
+
+        if backlogged:
+            self.backlogged += 1
+        if count > self.max_batch:
+            self.max_batch = count
+
+    def summarize(self):
+        summary = _summarize(self.latencies)
+        summary.update({
+            'messages': self.messages,
+            'time': self.time,
+            'backlogged': self.backlogged,
+            'max_batch': self.max_batch
+        })
+
+        return summary
+
+
+class LoopStats():
+    '''
+    Counters and latency distributions for the management server's main loop:
+    how many times each handler and policy call ran, how long each took, how
+    often each socket was left with a backlog, how long each loop iteration
+    and each policy epoch took, how late each epoch started, and how long pins
+    took to be acknowledged. The loop records into this object, and snapshot()
+    may be called from any other thread.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+        self.handlers = {}
+        self.iterations = QuantileSketch()
+        self.epochs = QuantileSketch()
+        self.epoch_delays = QuantileSketch()
+        self.epoch_overruns = 0
+        self.pins = QuantileSketch()
+
+    def record_handler(self, name, elapsed, count=0, socket=None):
+        '''
+        Records one call to the named handler, which took elapsed seconds and
+        processed count messages (none, for policy calls and timers). If the
+        handler's socket is given, we also record whether it still has
+        messages waiting, which tells us that the loop is not keeping up with
+        that socket.
+        '''
+        backlogged = socket is not None and has_backlog(socket)
+
+        with self.lock:
+            if name not in self.handlers:
+                self.handlers[name] = HandlerStats()
+
+            self.handlers[name].record(elapsed, count, backlogged)
+
+    def record_iteration(self, elapsed):
+        with self.lock:
+            self.iterations.add(elapsed)
+
+    def record_epoch(self, elapsed, delay):
+        '''
+        Records how long the policy took to run for one epoch, and how long
+        after its scheduled time the epoch started.
+        '''
+        delay = max(delay, 0.0)
+
+        with self.lock:
+            self.epochs.add(elapsed)
+            self.epoch_delays.add(delay)
+
+            if delay > EPOCH_OVERRUN_THRESHOLD:
+                self.epoch_overruns += 1
+
+    def record_pin(self, elapsed):
+        with self.lock:
+            self.pins.add(elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.time() - self.start
+            handlers = {name: stats.summarize() for name, stats in
+                        self.handlers.items()}
+            messages = {name: stats['messages'] for name, stats in
+                        handlers.items()}
+
+            return {
+                'uptime': elapsed,
+                'messages': messages,
+                'message_rate': sum(messages.values()) / elapsed,
+                'handlers': handlers,
+                'iteration': _summarize(self.iterations),
+                'epoch': _summarize(self.epochs),
+                'epoch_delay': _summarize(self.epoch_delays),
+                'epoch_overruns': self.epoch_overruns,
+                'pin': _summarize(self.pins)
+            }
+
+
+class ProvisioningStats():
+    '''
+    Statistics for the Kubernetes server's node requests: how many requests
+    were waiting at the start of each provisioning cycle, how many were
+    merged into another request of the same kind, how many function nodes
+    came from the warm pool, and how long each took from when it was
+    received until its nodes were running (time to capacity) or removed.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+        self.cycles = 0
+        self.queue_depths = QuantileSketch()
+        self.max_queue_depth = 0
+        self.coalesced = 0
+        self.promoted = 0
+
+        self.time_to_capacity = {}
+        self.removals = QuantileSketch()
+
+    def record_cycle(self, depth, coalesced):
+        with self.lock:
+            self.cycles += 1
+            self.queue_depths.add(depth)
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self.coalesced += coalesced
+
+    def record_capacity(self, kind, elapsed):
+        with self.lock:
+            self.time_to_capacity.setdefault(kind, QuantileSketch()) \
+                .add(elapsed)
+
+    def record_promotion(self, count):
+        with self.lock:
+            self.promoted += count
+
+    def record_removal(self, elapsed):
+        with self.lock:
+            self.removals.add(elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'uptime': time.time() - self.start,
+                'cycles': self.cycles,
+                'queue_depth': _summarize(self.queue_depths),
+                'max_queue_depth': self.max_queue_depth,
+                'coalesced': self.coalesced,
+                'promoted': self.promoted,
+                'time_to_capacity': {kind: _summarize(sketch) for kind, sketch
+                                     in self.time_to_capacity.items()},
+                'removal': _summarize(self.removals)
+            }
+
+
+class StatsServer(threading.Thread):
+    '''
+    Serves a JSON snapshot of the loop statistics (or any other object with a
+    snapshot method) to any request on a REP socket. This runs on its own
+    thread, so we can still inspect the loop when it has fallen behind.
+    '''
+
+    def __init__(self, loop_stats, context, port=STATS_PORT):
+        super().__init__(daemon=True)
+
+        self.loop_stats = loop_stats
+        self.socket = context.socket(zmq.REP)
+        self.socket.bind('tcp://*:%d' % (port))
+
+        self.stopped = threading.Event()
+
+    def run(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+
+        while not self.stopped.is_set():
+            if not poller.poll(timeout=500):
+                continue
+
+            self.socket.recv()
+            try:
+                snapshot = self.loop_stats.snapshot()
+            except Exception as e:
+                logging.error('Unable to snapshot loop statistics: %s' %
+                              (str(e)))
+                snapshot = {'error': str(e)}
+
+            self.socket.send_string(json.dumps(snapshot))
+
+        self.socket.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def has_backlog(socket):
+    # ZMQ doesn't tell us how many messages are queued, but it does tell us
+    # whether at least one is, without a system call.
+    return bool(socket.getsockopt(zmq.EVENTS) & zmq.POLLIN)
+
+
+def _summarize(sketch):
+    return {
+        'count': sketch.count,
+        'mean': sketch.mean,
+        'p50': sketch.p50,
+        'p99': sketch.p99,
+        'max': sketch.max if sketch.count else None
+    }
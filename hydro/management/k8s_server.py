@@ -16,21 +16,92 @@
 
 import logging
 import os
+import time
 
 import zmq
 
 from hydro.cluster.add_nodes import add_nodes
-from hydro.cluster.remove_node import remove_node
+from hydro.cluster.remove_node import remove_nodes
+from hydro.cluster.warm_pool import KopsPoolBackend, WarmPool
+from hydro.management.instrumentation import (
+    PROVISIONING_STATS_PORT,
+    ProvisioningStats,
+    StatsServer
+)
 from hydro.shared import util
+from hydro.shared.pod_cache import PodCache
+from hydro.shared.wait import wait_for_file, WaitTimeout
 
 logging.basicConfig(filename='log_k8s.txt', level=logging.INFO)
 
 
-def run():
+class NodeRequests():
+    '''
+    The node add and remove requests received since the last provisioning
+    cycle. Adds of the same kind are merged into one, and repeated removals
+    of the same node are dropped.
+    '''
+
+    def __init__(self):
+        # Maps each kind to the number of nodes to add, and to the times at
+        # which its add requests arrived.
+        self.adds = {}
+        self.add_times = {}
+
+        # Maps each kind to a map from the IP of each node to remove to the
+        # time its request arrived.
+        self.removes = {}
+
+        self.messages = 0
+
+    def add(self, kind, count, now):
+        self.adds[kind] = self.adds.get(kind, 0) + count
+        self.add_times.setdefault(kind, []).append(now)
+        self.messages += 1
+
+    def remove(self, kind, ip, now):
+        self.removes.setdefault(kind, {}).setdefault(ip, now)
+        self.messages += 1
+
+    @property
+    def coalesced(self):
+        # The number of requests that were merged into another one: we make
+        # one add and one removal per kind.
+        return self.messages - len(self.adds) - len(self.removes)
+
+
+def drain(socket, handler):
+    while True:
+        try:
+            msg = socket.recv_string(zmq.DONTWAIT)
+        except zmq.ZMQError:
+            break  # We've run out of messages.
+
+        args = msg.split(':')
+        handler(args[0], args[1], time.time())
+
+
+def run(warm_pool_size=0):
     context = zmq.Context(1)
     client, apps_client = util.init_k8s()
 
+    pod_cache = PodCache(client)
+    pod_cache.start()
+
     prefix = os.path.join(os.environ['HYDRO_HOME'], 'cluster/hydro/cluster')
+    cfile = '/hydro/anna/conf/anna-config.yml'
+
+    # New function nodes are promoted from the warm pool when there is one,
+    # and only added the slow way when it runs out.
+    warm_pool = None
+    if warm_pool_size > 0:
+        backend = KopsPoolBackend(client, apps_client, cfile, prefix)
+        warm_pool = WarmPool(backend, warm_pool_size)
+        warm_pool.start()
+
+    stats = ProvisioningStats()
+    stats_server = StatsServer(stats, context, PROVISIONING_STATS_PORT)
+    stats_server.start()
 
     node_add_socket = context.socket(zmq.PULL)
     node_add_socket.bind('ipc:///tmp/node_add')
@@ -42,38 +113,97 @@ def run():
     poller.register(node_add_socket, zmq.POLLIN)
     poller.register(node_remove_socket, zmq.POLLIN)
 
-    cfile = '/hydro/anna/conf/anna-config.yml'
-
     while True:
-        socks = dict(poller.poll(timeout=1000))
-
-        if node_add_socket in socks and socks[node_add_socket] == zmq.POLLIN:
-            msg = node_add_socket.recv_string()
-            args = msg.split(':')
-
-            ntype = args[0]
-            num = int(args[1])
-            logging.info('Adding %d new %s node(s)...' % (num, ntype))
-
-            add_nodes(client, apps_client, cfile, [ntype], [num],
-                      prefix=prefix)
-            logging.info('Successfully added %d %s node(s).' % (num, ntype))
-
-        if node_remove_socket in socks and socks[node_remove_socket] == \
-                zmq.POLLIN:
-            msg = node_remove_socket.recv_string()
-            args = msg.split(':')
-
-            ntype = args[0]
-            ip = args[1]
-
-            remove_node(ip, ntype)
-            logging.info('Successfully removed node %s.' % (ip))
+        poller.poll(timeout=1000)
+
+        # Each cycle takes in every request that arrived while the last one
+        # ran, which can take minutes, and applies them all at once.
+        requests = NodeRequests()
+        drain(node_add_socket, lambda kind, count, now:
+              requests.add(kind, int(count), now))
+        drain(node_remove_socket, requests.remove)
+        if requests.messages == 0:
+            continue
+
+        stats.record_cycle(requests.messages, requests.coalesced)
+        logging.info(('Provisioning cycle: %d request(s) queued, adding %s, ' +
+                      'removing %s.') %
+                     (requests.messages, requests.adds,
+                      {kind: len(ips) for kind, ips in
+                       requests.removes.items()}))
+
+        # We remove nodes first, because their executors have already
+        # departed, and so the add below sees the new group sizes.
+        for kind, ips in requests.removes.items():
+            remove_requested_nodes(kind, ips, warm_pool, pod_cache, stats)
+
+        if requests.adds:
+            add_requested_nodes(client, apps_client, cfile, prefix,
+                                requests, warm_pool, stats)
+
+
+def remove_requested_nodes(kind, ips, warm_pool, pod_cache, stats):
+    pooled = [ip for ip in ips if warm_pool is not None and
+              warm_pool.owns(ip)]
+    others = [ip for ip in ips if ip not in pooled]
+
+    if pooled:
+        warm_pool.remove(pooled)
+    if others:
+        remove_nodes(others, kind, pod_cache)
+
+    now = time.time()
+    for requested in ips.values():
+        stats.record_removal(now - requested)
+
+    logging.info('Successfully removed %d %s node(s): %s.' %
+                 (len(ips), kind, ', '.join(ips)))
+
+
+def add_requested_nodes(client, apps_client, cfile, prefix, requests,
+                        warm_pool, stats):
+    counts = dict(requests.adds)
+
+    promoted = 0
+    if warm_pool is not None and counts.get('function', 0) > 0:
+        promoted = warm_pool.take(counts['function'])
+        counts['function'] -= promoted
+        stats.record_promotion(promoted)
+
+        # If the pool covered every function node, those requests have their
+        # capacity now rather than after the other kinds are added.
+        if counts['function'] == 0:
+            del counts['function']
+            record_capacity(stats, 'function', requests)
+
+    kinds = [kind for kind, count in counts.items() if count > 0]
+    if kinds:
+        # If some of the nodes never come up, we give up on them rather than
+        # stop serving requests; the policy asks again if it still needs them.
+        try:
+            add_nodes(client, apps_client, cfile, kinds,
+                      [counts[kind] for kind in kinds], prefix=prefix)
+        except WaitTimeout as e:
+            logging.error('Unable to add %s node(s): %s' % (counts, str(e)))
+            return
+
+    for kind in kinds:
+        record_capacity(stats, kind, requests)
+
+    logging.info(('Successfully added %s node(s), %d function node(s) from ' +
+                  'the warm pool.') % (requests.adds, promoted))
+
+
+def record_capacity(stats, kind, requests):
+    now = time.time()
+    for requested in requests.add_times[kind]:
+        stats.record_capacity(kind, now - requested)
 
 
 if __name__ == '__main__':
     # Wait for this file to be copied into the pod before starting.
-    while not os.path.isfile('/hydro/setup_complete'):
-        pass
+    wait_for_file('/hydro/setup_complete')
 
-    run()
+    # WARM_POOL_SIZE optionally sets the number of function nodes to keep
+    # booted on standby.
+    run(int(os.environ.get('WARM_POOL_SIZE', 0)))
@@ -0,0 +1,163 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+def is_gpu_function(fname):
+    # When no GPU functions were declared, functions that haven't been pinned
+    # on a GPU executor yet fall back to the naming convention used by the GPU
+    # benchmarks.
+    return 'gpu' in fname
+
+
+class FunctionLocationIndex():
+    '''
+    Tracks where each function is pinned in both directions: the executor
+    threads each function is pinned on, and the functions pinned on each
+    executor thread. Executor threads are keyed by (ip, tid).
+
+    We also keep the GPU executor threads that have nothing pinned on them in
+    free_gpu_executors, since a GPU can only be used by one function at a
+    time, and the set of functions that need a GPU. Those are the functions
+    declared in gpu_functions, along with any function we see pinned on a GPU
+    executor. Only if gpu_functions is empty do we also treat functions with
+    'gpu' in their names as GPU functions.
+
+    The index is updated as each ThreadStatus arrives (see set_functions) and
+    as pins and unpins succeed, so the policy and the scaler always read the
+    same, current view without rebuilding it. A status that was sent before a
+    pin or unpin succeeded can briefly undo it, until the executor's next
+    status arrives; this is the same staleness we had when the locations were
+    rebuilt from statuses every epoch.
+    '''
+
+    def __init__(self, gpu_functions=()):
+        self.locations = {}
+        self.executors = {}
+
+        self.gpu_functions = set(gpu_functions)
+        self.declared_gpu_functions = bool(self.gpu_functions)
+        self.gpu_executors = set()
+        self.free_gpu_executors = set()
+
+    def set_executor_type(self, key, gpu):
+        '''
+        Records whether the executor thread key has a GPU.
+        '''
+        if gpu:
+            self.gpu_executors.add(key)
+        else:
+            self.gpu_executors.discard(key)
+
+        self._update_gpu_occupancy(key)
+
+    def is_gpu(self, fname):
+        if fname in self.gpu_functions:
+            return True
+
+        return not self.declared_gpu_functions and is_gpu_function(fname)
+
+    def set_functions(self, key, functions):
+        '''
+        Replaces the set of functions pinned on an executor thread with the
+        ones it reported in its latest status.
+        '''
+        functions = set(functions)
+        previous = self.executors.get(key, set())
+        if functions == previous:
+            return
+
+        for fname in previous - functions:
+            self._discard_location(fname, key)
+
+        for fname in functions - previous:
+            self.locations.setdefault(fname, set()).add(key)
+
+        if functions:
+            self.executors[key] = functions
+        else:
+            self.executors.pop(key, None)
+
+        self._update_gpu_occupancy(key)
+
+    def add(self, fname, key):
+        '''
+        Records that fname was pinned on the executor thread key.
+        '''
+        self.locations.setdefault(fname, set()).add(key)
+        self.executors.setdefault(key, set()).add(fname)
+        self._update_gpu_occupancy(key)
+
+    def discard(self, fname, key):
+        '''
+        Records that fname was unpinned from the executor thread key.
+        '''
+        self._discard_location(fname, key)
+
+        functions = self.executors.get(key)
+        if functions is not None:
+            functions.discard(fname)
+            if not functions:
+                del self.executors[key]
+
+        self._update_gpu_occupancy(key)
+
+    def remove_executor(self, key):
+        for fname in self.executors.pop(key, ()):
+            self._discard_location(fname, key)
+
+        self.gpu_executors.discard(key)
+        self.free_gpu_executors.discard(key)
+
+    def get(self, fname, default=None):
+        '''
+        Returns the set of executor threads fname is pinned on. The set is
+        owned by the index and must not be modified by the caller.
+        '''
+        return self.locations.get(fname, default)
+
+    def get_functions(self, key):
+        return self.executors.get(key, set())
+
+    def __getitem__(self, fname):
+        return self.locations[fname]
+
+    def __contains__(self, fname):
+        return fname in self.locations
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def _discard_location(self, fname, key):
+        keys = self.locations.get(fname)
+        if keys is None:
+            return
+
+        keys.discard(key)
+        if not keys:
+            del self.locations[fname]
+
+    def _update_gpu_occupancy(self, key):
+        if key not in self.gpu_executors:
+            self.free_gpu_executors.discard(key)
+            return
+
+        functions = self.executors.get(key)
+        if functions:
+            self.free_gpu_executors.discard(key)
+            self.gpu_functions.update(functions)
+        else:
+            self.free_gpu_executors.add(key)
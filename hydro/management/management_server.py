@@ -12,42 +12,107 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from functools import partial
 import logging
 import os
-import random
+import threading
 import time
 import sys
 
 import zmq
 
-from anna.zmq_util import SocketCache
-
+from hydro.management.dispatcher import SocketDispatcher
+from hydro.management.hash_ring_monitor import HashRingMonitor
+from hydro.management.instrumentation import LoopStats, StatsServer
 from hydro.management.scaler.default_scaler import DefaultScaler
-from hydro.management.policy.default_policy import DefaultHydroPolicy
-from hydro.management.util import (
-    get_monitoring_depart_address,
-    get_routing_depart_address,
-    get_routing_seed_address,
-    get_storage_depart_address,
-    send_message
+from hydro.management.scaler.placement import LoadAwarePlacement
+from hydro.management.shards import EpochSummary, StatisticsShards
+from hydro.management.policy.gpu_policy import GpuCapacityPolicy
+from hydro.management.policy.predictive_policy import PredictiveHydroPolicy
+from hydro.management.policy.slo_policy import (
+    load_slos,
+    PredictiveSLOHydroPolicy,
+    SLOHydroPolicy
+)
+from hydro.management.policy.vectorized_policy import VectorizedHydroPolicy
+from hydro.management.recorder import (
+    CHURN,
+    DEPART,
+    EPOCH,
+    LIST_EXECUTORS,
+    LIST_SCHEDULERS,
+    Recorder,
+    RESTART,
+    STATISTICS,
+    STATUS
 )
+from hydro.management.status_store import ExecutorStatusStore
+from hydro.management.util import get_socket_pool, SOCKET_POOL_CAPACITY
 from hydro.shared import util
+from hydro.shared.pod_cache import PodCache
 from hydro.shared.proto.internal_pb2 import ThreadStatus, ExecutorStatistics
 from hydro.shared.proto.shared_pb2 import StringSet
-from hydro.shared.proto.metadata_pb2 import ClusterMembership, MEMORY
+from hydro.shared.wait import wait_for_file
 
 REPORT_PERIOD = 5
 
 PIN_ACCEPT_PORT = '5010'
 
+STATUS_PORT = 7003
+STATISTICS_PORT = 7006
+
+# ThreadStatus messages are small and cheap to handle, so we take more of them
+# per batch than we do from the other sockets.
+STATUS_BATCH = 1000
+
 logging.basicConfig(filename='log_management.txt', level=logging.INFO,
                     format='%(asctime)s %(message)s')
 
 
-def run(self_ip):
+def run(self_ip, pod_cache=None, loop_stats=None, stopped=None,
+        num_shards=0, recorder=None, slos=None, gpu_functions=(),
+        predictive=False, predictive_args=None):
+    '''
+    Runs the management server until the stopped event (if any) is set. The
+    pod cache, loop statistics, and stop event can be passed in to drive the
+    server in-process, e.g., from the load-replay benchmark; by default, the
+    server watches the real Kubernetes cluster and runs forever.
+
+    If num_shards is positive, ExecutorStatistics and ThreadStatus messages
+    are parsed and aggregated by that many worker processes (see
+    StatisticsShards), and this process only merges their summaries once per
+    epoch.
+
+    If a Recorder is given, every message received (other than pin
+    responses) is appended to its log, along with a marker each time the
+    policy runs, so the run can be replayed with replay.py.
+
+    If slos maps DAG names to DagSlos, the SLO policy scales those DAGs'
+    functions to meet their p99 latency targets. gpu_functions names the
+    functions that must be pinned on GPU executors. If predictive is set,
+    replicas and nodes are added ahead of forecast load (see
+    PredictiveHydroPolicy); by default, they are added once load arrives.
+    predictive_args holds any arguments to the predictive policy, such as
+    its lead_time and confidence.
+    The two combine: with both slos and predictive, the SLO policy adjusts
+    the predictive policy (see PredictiveSLOHydroPolicy), and with slos
+    alone, it adjusts the default one.
+    '''
+    if loop_stats is None:
+        loop_stats = LoopStats()
+
+    if stopped is None:
+        stopped = threading.Event()
+
     context = zmq.Context(1)
 
-    pusher_cache = SocketCache(context, zmq.PUSH)
+    # The socket pool alone may hold SOCKET_POOL_CAPACITY sockets, which is
+    # more than ZMQ allows per context by default.
+    context.set(zmq.MAX_SOCKETS, SOCKET_POOL_CAPACITY + 64)
+
+    # The pool is shared with the policy, the scaler, and the hash ring checks,
+    # all of which send their messages through the same context.
+    pusher_cache = get_socket_pool(context)
 
     restart_pull_socket = context.socket(zmq.REP)
     restart_pull_socket.bind('tcp://*:7000')
@@ -58,328 +123,393 @@ def run(self_ip):
     list_executors_socket = context.socket(zmq.PULL)
     list_executors_socket.bind('tcp://*:7002')
 
-    function_status_socket = context.socket(zmq.PULL)
-    function_status_socket.bind('tcp://*:7003')
-
     list_schedulers_socket = context.socket(zmq.REP)
     list_schedulers_socket.bind('tcp://*:7004')
 
     executor_depart_socket = context.socket(zmq.PULL)
     executor_depart_socket.bind('tcp://*:7005')
 
-    statistics_socket = context.socket(zmq.PULL)
-    statistics_socket.bind('tcp://*:7006')
-
     pin_accept_socket = context.socket(zmq.PULL)
-    pin_accept_socket.setsockopt(zmq.RCVTIMEO, 10000) # 10 seconds.
     pin_accept_socket.bind('tcp://*:' + PIN_ACCEPT_PORT)
 
-    poller = zmq.Poller()
-    poller.register(restart_pull_socket, zmq.POLLIN)
-    poller.register(churn_pull_socket, zmq.POLLIN)
-    poller.register(function_status_socket, zmq.POLLIN)
-    poller.register(list_executors_socket, zmq.POLLIN)
-    poller.register(list_schedulers_socket, zmq.POLLIN)
-    poller.register(executor_depart_socket, zmq.POLLIN)
-    poller.register(statistics_socket, zmq.POLLIN)
-
     add_push_socket = context.socket(zmq.PUSH)
     add_push_socket.connect('ipc:///tmp/node_add')
 
     remove_push_socket = context.socket(zmq.PUSH)
     remove_push_socket.connect('ipc:///tmp/node_remove')
 
-    client, _ = util.init_k8s()
-
-    scaler = DefaultScaler(self_ip, context, add_push_socket, remove_push_socket, pin_accept_socket)
-    policy = DefaultHydroPolicy(scaler)
+    # Answers membership queries from memory; it is kept up to date by a
+    # Kubernetes watch, so we don't list pods on every request.
+    if pod_cache is None:
+        client, _ = util.init_k8s()
+        pod_cache = PodCache(client)
+        pod_cache.start()
+
+    # Checks the hash ring for departed storage nodes in the background, so
+    # an unresponsive routing node can't stall this loop.
+    hash_ring_monitor = HashRingMonitor(pod_cache, context,
+                                        period=REPORT_PERIOD,
+                                        loop_stats=loop_stats)
+    hash_ring_monitor.start()
+
+    # Serves a snapshot of the loop statistics from its own thread, so we can
+    # see which handler is responsible when the loop falls behind.
+    stats_server = StatsServer(loop_stats, context)
+    stats_server.start()
 
     # Tracks the self-reported statuses of each executor thread in the system.
-    executor_statuses = {}
+    executor_statuses = ExecutorStatusStore(gpu_functions=gpu_functions)
+
+    # Places new replicas on lightly loaded threads, spread across nodes and
+    # next to the functions they exchange data with.
+    placement = LoadAwarePlacement(executor_statuses,
+                                   {dname: slo.functions for dname, slo in
+                                    (slos or {}).items()})
+    scaler = DefaultScaler(self_ip, context, add_push_socket,
+                           remove_push_socket, pin_accept_socket, loop_stats,
+                           placement)
+
+    predictive_args = predictive_args or {}
+    if slos and predictive:
+        policy = PredictiveSLOHydroPolicy(scaler, slos, **predictive_args)
+    elif slos:
+        policy = SLOHydroPolicy(scaler, slos)
+    elif predictive:
+        policy = PredictiveHydroPolicy(scaler, **predictive_args)
+    else:
+        policy = VectorizedHydroPolicy(scaler)
+
+    # Scales the GPU node group, which the policy above doesn't.
+    gpu_policy = GpuCapacityPolicy(scaler)
 
     # Tracks of which executors are departing. This is used to ensure all
     # threads acknowledge that they are finished before we remove a thread from
     # the system.
     departing_executors = {}
 
-    # Tracks how often each function is called.
-    function_frequencies = {}
+    # Tracks how often each function and DAG is called, and the distributions
+    # of function runtimes, DAG runtimes, and DAG request interarrival times
+    # over the current epoch.
+    summary = EpochSummary()
+
+    def recorded(kind, handler):
+        if recorder is None:
+            return handler
+
+        return recorder.wrap(kind, handler)
+
+    # Drains every socket in budgeted batches, answering REP requests first.
+    dispatcher = SocketDispatcher(loop_stats)
+    dispatcher.register('restart', restart_pull_socket,
+                        recorded(RESTART,
+                                 partial(handle_restart, pod_cache)),
+                        reply=True)
+    dispatcher.register('list_schedulers', list_schedulers_socket,
+                        recorded(LIST_SCHEDULERS,
+                                 partial(handle_list_schedulers, pod_cache)),
+                        reply=True)
+    dispatcher.register('churn', churn_pull_socket,
+                        recorded(CHURN, partial(handle_churn, scaler)))
+    dispatcher.register('list_executors', list_executors_socket,
+                        recorded(LIST_EXECUTORS,
+                                 partial(handle_list_executors, pod_cache,
+                                         pusher_cache)))
+    dispatcher.register('depart', executor_depart_socket,
+                        recorded(DEPART,
+                                 partial(handle_depart, scaler,
+                                         departing_executors)))
+    dispatcher.register('pin_responses', pin_accept_socket,
+                        scaler.handle_pin_response, copy=False)
+
+    if num_shards > 0:
+        # The shards bind the status and statistics ports themselves.
+        shards = StatisticsShards(context, num_shards, STATISTICS_PORT,
+                                  STATUS_PORT, capture=recorder is not None)
+        shards.start()
+
+        # The shards' proxies copy the messages they forward to us, so we
+        # record the same inputs as we would without shards.
+        for port, kind, name in ((STATUS_PORT, STATUS, 'status_capture'),
+                                 (STATISTICS_PORT, STATISTICS,
+                                  'statistics_capture')):
+            if port in shards.captures:
+                dispatcher.register(name, shards.captures[port],
+                                    partial(recorder.record, kind),
+                                    max_batch=STATUS_BATCH)
+    else:
+        shards = None
+
+        function_status_socket = context.socket(zmq.PULL)
+        function_status_socket.bind('tcp://*:%d' % (STATUS_PORT))
+        dispatcher.register('status', function_status_socket,
+                            recorded(STATUS,
+                                     partial(handle_status, executor_statuses,
+                                             departing_executors)),
+                            max_batch=STATUS_BATCH)
+
+        statistics_socket = context.socket(zmq.PULL)
+        statistics_socket.bind('tcp://*:%d' % (STATISTICS_PORT))
+        dispatcher.register('statistics', statistics_socket,
+                            recorded(STATISTICS,
+                                     partial(handle_statistics, summary)))
 
-    # Tracks the aggregated runtime for each function.
-    function_runtimes = {}
+    start = time.time()
+    while not stopped.is_set():
+        # We wake up in time for the next epoch, and at least once a second
+        # so that we notice when we have been stopped.
+        next_epoch = start + REPORT_PERIOD
+        timeout = min(1000, max(0, int((next_epoch - time.time()) * 1000)))
 
-    # Tracks the arrival times of DAG requests.
-    arrival_times = {}
+        ready = dispatcher.poll(timeout)
+        iteration_start = time.time()
 
-    # Tracks how often each DAG is called.
-    dag_frequencies = {}
+        # Anything left over when the epoch is due stays queued until after
+        # the policy runs, so overload can't delay the policy.
+        dispatcher.dispatch(ready, deadline=next_epoch)
 
-    # Tracks how long each DAG request spends in the system, end to end.
-    dag_runtimes = {}
+        # Pins are sent without waiting for a response, so we retry the ones
+        # that have been outstanding for too long on every iteration.
+        handler_start = time.time()
+        scaler.check_pin_timeouts()
+        loop_stats.record_handler('pin_timeouts', time.time() - handler_start)
 
-    start = time.time()
-    while True:
-        socks = dict(poller.poll(timeout=1000))
-
-        if (churn_pull_socket in socks and socks[churn_pull_socket] ==
-                zmq.POLLIN):
-            msg = churn_pull_socket.recv_string()
-            args = msg.split(':')
-
-            if args[0] == 'add':
-                scaler.add_vms(args[2], args[1])
-            elif args[0] == 'remove':
-                scaler.remove_vms(args[2], args[1])
-
-        if (restart_pull_socket in socks and socks[restart_pull_socket] ==
-                zmq.POLLIN):
-            msg = restart_pull_socket.recv_string()
-            args = msg.split(':')
-
-            pod = util.get_pod_from_ip(client, args[1])
-            count = str(pod.status.container_statuses[0].restart_count)
-
-            restart_pull_socket.send_string(count)
-
-        if (list_executors_socket in socks and socks[list_executors_socket] ==
-                zmq.POLLIN):
-            # We can safely ignore this message's contents, and the response
-            # does not depend on it.
-            response_ip = list_executors_socket.recv_string()
-
-            ips = StringSet()
-            for ip in util.get_pod_ips(client, 'role=function'):
-                ips.keys.append(ip)
-            for ip in util.get_pod_ips(client, 'role=gpu'):
-                ips.keys.append(ip)
-
-            sckt = pusher_cache.get(response_ip)
-            sckt.send(ips.SerializeToString())
-
-        if (function_status_socket in socks and
-                socks[function_status_socket] == zmq.POLLIN):
-            # Dequeue all available ThreadStatus messages rather than doing
-            # them one at a time---this prevents starvation if other operations
-            # (e.g., pin) take a long time.
-            while True:
-                status = ThreadStatus()
-                try:
-                    status.ParseFromString(function_status_socket.recv(zmq.DONTWAIT))
-                except:
-                    break # We've run out of messages.
-
-                key = (status.ip, status.tid)
-
-                # If this executor is one of the ones that's currently departing,
-                # we can just ignore its status updates since we don't want
-                # utilization to be skewed downwards. The reason we might still
-                # receive this message is because the depart message may not have
-                # arrived when this was sent.
-                if key[0] in departing_executors:
+        end = time.time()
+        loop_stats.record_iteration(end - iteration_start)
+
+        if end >= next_epoch:
+            if shards:
+                flush_shards(shards, summary, executor_statuses,
+                             departing_executors, loop_stats)
+
+            for dname, runtimes in summary.dag_runtimes.items():
+                if runtimes.count == 0:
                     continue
 
-                executor_statuses[key] = status
-                logging.info(('Received thread status update from %s:%d: %.4f ' +
-                              'occupancy, %d functions pinned') %
-                             (status.ip, status.tid, status.utilization,
-                              len(status.functions)))
-
-        if (list_schedulers_socket in socks and
-                socks[list_schedulers_socket] == zmq.POLLIN):
-            # We can safely ignore this message's contents, and the response
-            # does not depend on it.
-            list_schedulers_socket.recv_string()
-
-            ips = StringSet()
-            for ip in util.get_pod_ips(client, 'role=scheduler'):
-                ips.keys.append(ip)
-
-            list_schedulers_socket.send(ips.SerializeToString())
-
-        if (executor_depart_socket in socks and
-                socks[executor_depart_socket] == zmq.POLLIN):
-            ip = executor_depart_socket.recv_string()
-            departing_executors[ip] -= 1
-
-            # We wait until all the threads at this executor have acknowledged
-            # that they are ready to leave, and we then remove the VM from the
-            # system.
-            if departing_executors[ip] == 0:
-                logging.info('Removing node with ip %s' % ip)
-                scaler.remove_vms('function', ip)
-                del departing_executors[ip]
-
-        if (statistics_socket in socks and
-                socks[statistics_socket] == zmq.POLLIN):
-            stats = ExecutorStatistics()
-            stats.ParseFromString(statistics_socket.recv())
-
-            # Aggregates statistics reported for individual functions including
-            # call frequencies, processed requests, and total runtimes.
-            for fstats in stats.functions:
-                fname = fstats.name
-
-                if fname not in function_frequencies:
-                    function_frequencies[fname] = 0
-
-                if fname not in function_runtimes:
-                    function_runtimes[fname] = (0.0, 0)
-
-                if fstats.runtime:
-                    old_latency = function_runtimes[fname]
-
-                    # This tracks how many calls were processed for the
-                    # function and the length of the total runtime of all
-                    # calls.
-                    function_runtimes[fname] = (
-                          old_latency[0] + sum(fstats.runtime),
-                          old_latency[1] + fstats.call_count)
-                else:
-                    # This tracks how many calls are made to the function.
-                    function_frequencies[fname] += fstats.call_count
-
-            # Aggregates statistics for DAG requests, including call
-            # frequencies, arrival rates, and end-to-end runtimes.
-            for dstats in stats.dags:
-                dname = dstats.name
-
-                # Tracks the interarrival rates of requests to this function as
-                # perceived by the scheduler.
-                if dname not in arrival_times:
-                    arrival_times[dname] = []
-
-                arrival_times[dname] += list(dstats.interarrival)
-
-                # Tracks how many calls to this DAG were received.
-                if dname not in dag_frequencies:
-                    dag_frequencies[dname] = 0
-
-                dag_frequencies[dname] += dstats.call_count
-
-                # Tracks the end-to-end runtime of individual requests
-                # completed in the last epoch.
-                if dname not in dag_runtimes:
-                    dag_runtimes[dname] = []
-
-                for rt in dstats.runtimes:
-                    dag_runtimes[dname].append(rt)
+                arrivals = summary.arrival_times[dname]
+                logging.info(('DAG %s: %.2f requests/s, latency p50 %.4f, ' +
+                              'p95 %.4f, p99 %.4f.') %
+                             (dname, arrivals.rate(end - start), runtimes.p50,
+                              runtimes.p95, runtimes.p99))
 
-        end = time.time()
-        if end - start > REPORT_PERIOD:
-            logging.info('Checking hash ring...')
-            check_hash_ring(client, context)
+            for result in hash_ring_monitor.get_results():
+                if result.error:
+                    logging.error('Hash ring check failed: %s' %
+                                  (result.error))
+                elif result.departed:
+                    logging.info('Hash ring check found %d departed nodes.'
+                                 % (len(result.departed)))
+
+            if recorder:
+                recorder.record(EPOCH, b'')
+                recorder.flush()
 
             # Invoke the configured policy to check system load and respond
             # appropriately.
-            policy.replica_policy(function_frequencies, function_runtimes,
-                                  dag_runtimes, executor_statuses,
-                                  arrival_times)
+            policy_start = time.time()
+            policy.replica_policy(summary.function_frequencies,
+                                  summary.function_runtimes,
+                                  summary.dag_runtimes, executor_statuses,
+                                  summary.arrival_times)
+            handler_start = time.time()
+            loop_stats.record_handler('replica_policy',
+                                      handler_start - policy_start)
+
             policy.executor_policy(executor_statuses, departing_executors)
+            loop_stats.record_handler('executor_policy',
+                                      time.time() - handler_start)
+
+            handler_start = time.time()
+            gpu_policy.capacity_policy(executor_statuses, departing_executors)
+            loop_stats.record_handler('gpu_policy',
+                                      time.time() - handler_start)
+
+            loop_stats.record_epoch(time.time() - policy_start,
+                                    end - start - REPORT_PERIOD)
 
             # Clears all metadata that was passed in for this epoch.
-            function_runtimes.clear()
-            function_frequencies.clear()
-            dag_runtimes.clear()
-            arrival_times.clear()
+            summary.clear()
+
+            logging.info(('Socket pool: %(size)d open, %(hits)d hits, ' +
+                          '%(misses)d misses, %(evictions)d evictions.') %
+                         pusher_cache.stats())
 
             # Restart the timer for the next reporting epoch.
             start = time.time()
 
+    if shards:
+        shards.stop()
 
-def check_hash_ring(client, context):
-    route_ips = util.get_pod_ips(client, 'role=routing')
+    if recorder:
+        recorder.close()
 
-    # If there are no routing nodes in the system currently, the system is
-    # still starting, so we do nothing.
-    if not route_ips:
-        return
+    hash_ring_monitor.stop()
+    stats_server.stop()
+    stats_server.join()
+    pod_cache.stop()
+    context.destroy(linger=0)
+
+
+def flush_shards(shards, summary, executor_statuses, departing_executors,
+                 loop_stats):
+    '''
+    Merges the shards' summaries of the epoch that just ended into summary,
+    and applies the executor statuses they received to executor_statuses.
+    '''
+    start = time.time()
+    merged = shards.flush()
+    loop_stats.record_handler('shard_flush', time.time() - start)
+
+    # The shards handled these messages in parallel, so we record the time
+    # each kind took across all of them.
+    for kind in ('statistics', 'status'):
+        loop_stats.record_handler(kind, merged.times[kind],
+                                  merged.messages[kind])
+
+    applied = 0
+    for status in merged.statuses.values():
+        # As in handle_status, we ignore departing executors' statuses.
+        if status.ip in departing_executors:
+            continue
+
+        executor_statuses.update(status, now=status.last_seen)
+        applied += 1
+
+    logging.info(('Merged %d statistics and %d status messages from shards; ' +
+                  'applied %d executor statuses.') %
+                 (merged.messages['statistics'], merged.messages['status'],
+                  applied))
+
+    merged.statuses.clear()
+    summary.merge(merged)
+
+
+def handle_churn(scaler, msg):
+    args = msg.decode().split(':')
+
+    if args[0] == 'add':
+        scaler.add_vms(args[2], args[1])
+    elif args[0] == 'remove':
+        scaler.remove_vms(args[2], args[1])
+
+
+def handle_restart(pod_cache, msg):
+    args = msg.decode().split(':')
+
+    try:
+        return str(pod_cache.get_restart_count(args[1]))
+    except IndexError:
+        # We always have to reply on a REP socket, so if the pod is unknown,
+        # we report that it has not been restarted.
+        logging.error('No pod found with IP %s.' % (args[1]))
+        return '0'
+
+
+def handle_list_executors(pod_cache, pusher_cache, msg):
+    # We can safely ignore this message's contents, and the response does not
+    # depend on it.
+    response_ip = msg.decode()
 
-    ip = random.choice(route_ips)
+    ips = StringSet()
+    for ip in pod_cache.get_pod_ips('role=function'):
+        ips.keys.append(ip)
+    for ip in pod_cache.get_pod_ips('role=gpu'):
+        ips.keys.append(ip)
 
-    # Retrieve a list of all current members of the cluster.
-    socket = context.socket(zmq.REQ)
-    socket.connect(get_routing_seed_address(ip, 0))
-    socket.send_string('')
-    resp = socket.recv()
+    sckt = pusher_cache.get(response_ip)
+    sckt.send(ips.SerializeToString())
 
-    cluster = ClusterMembership()
-    cluster.ParseFromString(resp)
-    tiers = cluster.tiers
 
-    # If there are no tiers, then we don't need to evaluate anything.
-    if len(tiers) == 0:
+def handle_status(executor_statuses, departing_executors, msg):
+    status = ThreadStatus()
+    status.ParseFromString(msg)
+
+    # If this executor is one of the ones that's currently departing, we can
+    # just ignore its status updates since we don't want utilization to be
+    # skewed downwards. The reason we might still receive this message is
+    # because the depart message may not have arrived when this was sent.
+    if status.ip in departing_executors:
         return
-    elif len(tiers) == 1:
-        # If there is one tier, it will be the memory tier.
-        mem_tier, ebs_tier = tiers[0], None
-    else:
-        # If there are two tiers, we need to make sure that we assign the
-        # correct tiers as the memory and EBS tiers, respectively.
-        if tiers[0].tier_id == MEMORY:
-            mem_tier = tiers[0]
-            ebs_tier = tiers[1]
-        else:
-            mem_tier = tiers[1]
-            ebs_tier = tiers[0]
-
-    # Queries the Kubernetes master for the list of memory nodes its aware of
-    # -- if any of the nodes in the hash ring aren't currently running, we add
-    # those the departed list.
-    mem_ips = util.get_pod_ips(client, 'role=memory')
-    departed = []
-    for node in mem_tier.servers:
-        if node.private_ip not in mem_ips:
-            departed.append(('0', node))
-
-    # Performs the same process for the EBS tier if it exists.
-    ebs_ips = []
-    if ebs_tier:
-        ebs_ips = util.get_pod_ips(client, 'role=ebs')
-        for node in ebs_tier.servers:
-            if node.private_ip not in ebs_ips:
-                departed.append(('1', node))
-
-    logging.info('Found %d departed nodes.' % (len(departed)))
-    mon_ips = util.get_pod_ips(client, 'role=monitoring')
-    storage_ips = mem_ips + ebs_ips
-
-    # For each departed node the cluster is unaware of, we inform all storage
-    # nodes, all monitoring nodes, and all routing nodes that it has departed.
-    for pair in departed:
-        logging.info('Informing cluster that node %s/%s has departed.' %
-                     (pair[1].public_ip, pair[1].private_ip))
-
-        msg = pair[0] + ':' + pair[1].public_ip + ':' + pair[1].private_ip
-
-        # NOTE: In this code, we are presuming there are 4 threads per
-        # storage/routing node. If there are more, this will be buggy; if there
-        # are fewer, this is fine as the messages will go into the void.
-        for ip in storage_ips:
-            for t in range(4):
-                send_message(context, msg, get_storage_depart_address(ip,
-                                                                      t))
-
-        msg = 'depart:' + msg
-        for ip in route_ips:
-            for t in range(4):
-                send_message(context, msg, get_routing_depart_address(ip,
-                                                                      t))
-
-        for ip in mon_ips:
-            send_message(context, msg, get_monitoring_depart_address(ip))
+
+    executor_statuses.update(status)
+    logging.info(('Received thread status update from %s:%d: %.4f ' +
+                  'occupancy, %d functions pinned') %
+                 (status.ip, status.tid, status.utilization,
+                  len(status.functions)))
+
+
+def handle_list_schedulers(pod_cache, msg):
+    # We can safely ignore this message's contents, and the response does not
+    # depend on it.
+    ips = StringSet()
+    for ip in pod_cache.get_pod_ips('role=scheduler'):
+        ips.keys.append(ip)
+
+    return ips.SerializeToString()
+
+
+def handle_depart(scaler, departing_executors, msg):
+    ip = msg.decode()
+    departing_executors[ip] -= 1
+
+    # We wait until all the threads at this executor have acknowledged that
+    # they are ready to leave, and we then remove the VM from the system.
+    if departing_executors[ip] == 0:
+        logging.info('Removing node with ip %s' % ip)
+        scaler.remove_departed(ip)
+        del departing_executors[ip]
+
+
+def handle_statistics(summary, msg):
+    stats = ExecutorStatistics()
+    stats.ParseFromString(msg)
+
+    summary.add_statistics(stats)
 
 
 if __name__ == '__main__':
     # We wait for this file to appear before starting the management server,
     # so we don't make policy decisions before the cluster has finished
     # spinning up.
-    while not os.path.isfile('/hydro/setup_complete'):
-        pass
+    wait_for_file('/hydro/setup_complete')
 
     # Waits until the kubecfg file is copied into the pod because we cannot
     # perform any Kubernetes operations without it.
-    while not os.path.isfile(os.path.join(os.environ['HOME'],
-                                          '.kube/config')):
-        pass
-
-    run(sys.argv[1])
+    wait_for_file(os.path.join(os.environ['HOME'], '.kube/config'))
+
+    # The number of statistics shards is optional, and defaults to none.
+    num_shards = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    # If MANAGEMENT_RECORD is set, we record every message we receive to the
+    # log at that path.
+    recorder = None
+    if os.environ.get('MANAGEMENT_RECORD'):
+        recorder = Recorder(os.environ['MANAGEMENT_RECORD'])
+
+    # If MANAGEMENT_SLOS is set, we load DAG latency targets from the YAML
+    # file at that path.
+    slos = None
+    if os.environ.get('MANAGEMENT_SLOS'):
+        slos = load_slos(util.load_yaml(os.environ['MANAGEMENT_SLOS']))
+
+    # MANAGEMENT_GPU_FUNCTIONS optionally lists the functions that need a GPU,
+    # separated by commas. If it is unset, functions with 'gpu' in their names
+    # are also treated as GPU functions.
+    gpu_functions = [fname for fname in
+                     os.environ.get('MANAGEMENT_GPU_FUNCTIONS', '').split(',')
+                     if fname]
+
+    # If MANAGEMENT_PREDICTIVE is set, we scale ahead of forecast load.
+    # MANAGEMENT_LEAD_TIME optionally sets how far ahead (in seconds) we plan,
+    # and MANAGEMENT_CONFIDENCE the confidence bound we plan for.
+    predictive = bool(os.environ.get('MANAGEMENT_PREDICTIVE'))
+    predictive_args = {}
+    if os.environ.get('MANAGEMENT_LEAD_TIME'):
+        predictive_args['lead_time'] = float(
+            os.environ['MANAGEMENT_LEAD_TIME'])
+    if os.environ.get('MANAGEMENT_CONFIDENCE'):
+        predictive_args['confidence'] = float(
+            os.environ['MANAGEMENT_CONFIDENCE'])
+
+    run(sys.argv[1], num_shards=num_shards, recorder=recorder, slos=slos,
+        gpu_functions=gpu_functions, predictive=predictive,
+        predictive_args=predictive_args)
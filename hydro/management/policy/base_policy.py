@@ -26,7 +26,10 @@ class BaseHydroPolicy():
         be taken care of by the executor policy when it is invoked.
 
         The metrics that this policy is evaluated on include call frequencies,
-        function runtimes, dag runtimes, and request arrival rates.
+        function runtimes, dag runtimes, and request arrival rates. Runtimes
+        and interarrival times are passed in as a QuantileSketch per function
+        or DAG, which track their count, sum, and quantiles. Executor statuses
+        are passed in as an ExecutorStatusStore.
         '''
 
         raise NotImplementedError
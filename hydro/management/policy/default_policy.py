@@ -17,13 +17,9 @@ import math
 import random
 import time
 
+from hydro.management.location_index import FunctionLocationIndex
 from hydro.management.policy.base_policy import BaseHydroPolicy
-from hydro.management.util import (
-    get_executor_depart_address,
-    NUM_EXEC_THREADS,
-    send_message
-)
-from hydro.shared.proto.internal_pb2 import CPU, GPU
+from hydro.management.util import NUM_EXEC_THREADS
 
 EXECUTOR_REPORT_PERIOD = 5
 
@@ -31,9 +27,14 @@ EXECUTOR_REPORT_PERIOD = 5
 class DefaultHydroPolicy(BaseHydroPolicy):
     def __init__(self, scaler, max_utilization=.60, min_utilization=.10,
                  max_pin_count=.8, max_latency_deviation=1.25,
-                 scale_increase=4, grace_period=120):
+                 scale_increase=4, grace_period=120, replica_threshold=.7,
+                 dereplica_threshold=.1, clock=time.time):
         self.grace_start = 0
 
+        # Returns the current time; the simulator replaces this with its
+        # virtual clock.
+        self.clock = clock
+
         self.scaler = scaler
 
         self.max_utilization = max_utilization
@@ -43,30 +44,19 @@ class DefaultHydroPolicy(BaseHydroPolicy):
         self.scale_increase = scale_increase
         self.grace_period = grace_period
 
+        # We add replicas of a function when its call count exceeds this
+        # fraction of its replicas' throughput, and remove replicas when it is
+        # under the second fraction.
+        self.replica_threshold = replica_threshold
+        self.dereplica_threshold = dereplica_threshold
+
         self.latency_history = {}
-        self.function_locations = {}
+        self.function_locations = FunctionLocationIndex()
 
     def replica_policy(self, function_frequencies, function_runtimes,
                        dag_runtimes, executor_statuses, arrival_times):
-        # Construct a reverse index that tracks where each function is
-        # currently replicated.
-        self.function_locations = {}
-        for key in executor_statuses:
-            status = executor_statuses[key]
-            for fname in status.functions:
-                if fname not in self.function_locations:
-                    self.function_locations[fname] = set()
-
-                self.function_locations[fname].add(key)
-
-        cpu_executors = set()
-        gpu_executors = set()
-        for key in executor_statuses:
-            status = executor_statuses[key]
-            if status.type == CPU:
-                cpu_executors.add(key)
-            else:
-                gpu_executors.add(key)
+        cpu_executors, gpu_executors = self.update_locations(
+            executor_statuses)
 
         # Evaluate the policy decisions for each function that is reporting
         # metadata.
@@ -74,10 +64,10 @@ class DefaultHydroPolicy(BaseHydroPolicy):
             runtime = function_runtimes[fname]
             call_count = function_frequencies[fname]
 
-            if call_count == 0 or runtime[0] == 0:
+            if call_count == 0 or runtime.sum == 0:
                 continue
 
-            avg_latency = runtime[0] / runtime[1]
+            avg_latency = runtime.sum / runtime.count
             num_replicas = len(self.function_locations[fname])
             thruput = float(num_replicas *
                             EXECUTOR_REPORT_PERIOD) * (1 / avg_latency)
@@ -91,11 +81,12 @@ class DefaultHydroPolicy(BaseHydroPolicy):
                                                        avg_latency, thruput,
                                                        num_replicas))
 
-            if call_count > thruput * .7:
+            if call_count > thruput * self.replica_threshold:
                 # First, we compare the throughput of the system for a function
                 # to the number of calls for it. We add replicas if the number
                 # of calls exceeds a percentage of the throughput.
-                increase = (math.ceil(call_count / (thruput * .7))
+                increase = (math.ceil(call_count /
+                                      (thruput * self.replica_threshold))
                             * num_replicas) - num_replicas + 1
                 logging.info(('Function %s: %d calls in recent period exceeds'
                               + ' threshold. Adding %d replicas.') %
@@ -103,7 +94,7 @@ class DefaultHydroPolicy(BaseHydroPolicy):
                 self.scaler.replicate_function(fname, increase,
                                                self.function_locations,
                                                cpu_executors, gpu_executors)
-            elif call_count < thruput * .1:
+            elif call_count < thruput * self.dereplica_threshold:
                 pass
                 # Similarly, we check to see if the call count is significantly
                 # below the achieved throughput -- we then remove replicas.
@@ -137,11 +128,30 @@ class DefaultHydroPolicy(BaseHydroPolicy):
 
             # Recalculates total runtime for this function and the historical
             # call count and updates latency history metadata.
-            rt = runtime[0] + historical * count
-            hist_count = runtime[1] + count
+            rt = runtime.sum + historical * count
+            hist_count = runtime.count + count
             avg_latency = rt / hist_count
             self.latency_history[fname] = (avg_latency, hist_count)
 
+    def update_locations(self, executor_statuses):
+        '''
+        Picks up the index that tracks where each function is currently
+        replicated, and returns the sets of CPU and GPU executor threads.
+        '''
+        # The store maintains the index and these sets as statuses arrive, and
+        # the scaler updates the index as pins and unpins succeed, so we
+        # don't need to rebuild any of them.
+        self.function_locations = executor_statuses.locations
+        return executor_statuses.cpu_executors, executor_statuses.gpu_executors
+
+    def expected_utilization(self, avg_utilization):
+        '''
+        Returns the average executor utilization that executor_policy should
+        plan for, given the current average. Policies that anticipate load can
+        override this to add or keep executors ahead of it.
+        '''
+        return avg_utilization
+
     def executor_policy(self, executor_statuses, departing_executors):
         # If no executors have joined yet, we don't need to calcuate anything.
         if len(executor_statuses) == 0:
@@ -151,18 +161,13 @@ class DefaultHydroPolicy(BaseHydroPolicy):
         # elasticity decisions are made. We start the grace period when we
         # decide to add or remove a VM and wait until after its over to make
         # sure we don't put the system in hysteresis.
-        if time.time() < (self.grace_start + self.grace_period):
+        if self.clock() < (self.grace_start + self.grace_period):
             return
 
-        utilization_sum = 0.0
-        pinned_function_count = 0
-        for status in executor_statuses.values():
-            utilization_sum += status.utilization
-            pinned_function_count += len(status.functions)
-
-        avg_utilization = utilization_sum / len(executor_statuses)
-        avg_pinned_count = pinned_function_count / len(executor_statuses)
-        num_nodes = len(executor_statuses) / NUM_EXEC_THREADS
+        avg_utilization = executor_statuses.average_utilization()
+        avg_pinned_count = executor_statuses.average_pinned_count()
+        # GPU nodes are scaled separately, by the GPU capacity policy.
+        num_nodes = len(executor_statuses.cpu_executors) / NUM_EXEC_THREADS
 
         logging.info(('There are currently %d executor nodes active in the ' +
                      'system (%d threads).') % (num_nodes,
@@ -171,6 +176,9 @@ class DefaultHydroPolicy(BaseHydroPolicy):
         logging.info('Average pinned function count: %.2f' %
                      (avg_pinned_count))
 
+        # The utilization we plan for; by default, this is the current one.
+        avg_utilization = self.expected_utilization(avg_utilization)
+
         # We check to see if the average utilization or number of pinned
         # functions exceeds the policy's thresholds and add machines to the
         # system in both cases.
@@ -183,41 +191,39 @@ class DefaultHydroPolicy(BaseHydroPolicy):
             self.scaler.add_vms('function', self.scale_increase)
 
             # start the grace period after adding nodes
-            self.grace_start = time.time()
+            self.grace_start = self.clock()
 
         # We also look at any individual nodes that might be overloaded. Since
         # we currently only pin one function per node, that means that function
         # is very expensive, so we proactively replicate it onto two other
         # threads.
-        for status in executor_statuses.values():
-            if status.utilization > .9:
-                logging.info(('Node %s:%d has over 90%% utilization.'
-                              + ' Replicating its functions.') % (status.ip,
-                                                                  status.tid))
-
-                executors = set(executor_statuses.keys())
-                for fname in status.functions:
-                    self.scaler.replicate_function(fname, 2,
-                                                   self.function_locations,
-                                                   executors)
+        for status in executor_statuses.get_overloaded(.9):
+            logging.info(('Node %s:%d has over 90%% utilization.'
+                          + ' Replicating its functions.') % (status.ip,
+                                                              status.tid))
+
+            executors = set(executor_statuses.keys())
+            for fname in status.functions:
+                self.scaler.replicate_function(fname, 2,
+                                               self.function_locations,
+                                               executors)
 
         # We only decide to kill nodes if they are underutilized and if there
         # are at least 5 executors in the system -- we never scale down past
         # that.
         if avg_utilization < self.min_utilization and num_nodes > 5:
-            ip = random.choice(list(executor_statuses.values())).ip
+            ip = random.choice(sorted(executor_statuses.cpu_executors))[0]
             logging.info(('Average utilization is %.4f, and there are %d '
                           + 'executors. Removing IP %s.') %
                          (avg_utilization, len(executor_statuses), ip))
 
-            for tid in range(NUM_EXEC_THREADS):
-                send_message(self.scaler.context, '',
-                             get_executor_depart_address(ip, tid))
+            self.scaler.depart_executors(ip)
 
+            for tid in range(NUM_EXEC_THREADS):
                 if (ip, tid) in executor_statuses:
                     del executor_statuses[(ip, tid)]
 
             departing_executors[ip] = NUM_EXEC_THREADS
 
             # start the grace period after removing nodes
-            self.grace_start = time.time()
+            self.grace_start = self.clock()
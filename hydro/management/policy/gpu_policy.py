@@ -0,0 +1,139 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import math
+import random
+import time
+
+from hydro.management.util import NUM_GPU_EXEC_THREADS
+
+
+class GpuCapacityPolicy():
+    '''
+    Grows and shrinks the GPU node group. The executor policy only scales the
+    CPU function nodes, and GPU functions can only be pinned on a GPU that has
+    nothing else pinned, so GPU capacity is driven by demand for free GPUs
+    rather than by average utilization.
+
+    Each epoch, we add enough GPU nodes to place every GPU replica the scaler
+    couldn't place for lack of a free GPU (see take_gpu_demand). The replica
+    policy asks for the same replicas again every epoch until they are
+    placed, so unmet demand is a level, not a sum: we act on the most
+    replicas left unplaced in any one epoch since our last decision, less
+    the GPUs on nodes we have asked for that haven't joined yet. We stop
+    waiting for nodes that haven't joined after join_timeout seconds. If
+    every GPU is occupied and their average utilization is over
+    max_utilization, we also add scale_increase nodes, since the replica
+    policy will soon ask for more. When there was no unmet demand and more
+    than spare_nodes GPU nodes have nothing pinned, we remove one of them, as
+    long as at least min_nodes remain. As with the executor policy, we make
+    no decisions for grace_period seconds after adding or removing nodes.
+    '''
+
+    def __init__(self, scaler, max_utilization=.7, scale_increase=1,
+                 min_nodes=1, spare_nodes=0, grace_period=300,
+                 join_timeout=600, clock=time.time):
+        self.scaler = scaler
+        self.max_utilization = max_utilization
+        self.scale_increase = scale_increase
+        self.min_nodes = min_nodes
+        self.spare_nodes = spare_nodes
+        self.grace_period = grace_period
+        self.join_timeout = join_timeout
+        self.clock = clock
+
+        self.grace_start = 0
+
+        # The most GPU replicas left unplaced in one epoch since our last
+        # decision, which includes any epochs in the grace period.
+        self.demand = 0
+
+        # The number of GPU nodes we have asked for that haven't joined yet,
+        # and when we stop waiting for them.
+        self.pending = 0
+        self.pending_expiry = 0
+
+        # The GPU nodes that had reported as of the last epoch, so we can tell
+        # when the nodes we asked for join.
+        self.known_nodes = set()
+
+    def capacity_policy(self, executor_statuses, departing_executors):
+        self.demand = max(self.demand, self.scaler.take_gpu_demand())
+
+        gpu_executors = executor_statuses.gpu_executors
+        free = executor_statuses.locations.free_gpu_executors
+
+        nodes = {}
+        for key in gpu_executors:
+            nodes.setdefault(key[0], []).append(key)
+
+        joined = len(set(nodes).difference(self.known_nodes))
+        self.known_nodes = set(nodes)
+        if self.clock() >= self.pending_expiry:
+            self.pending = 0
+        else:
+            self.pending = max(self.pending - joined, 0)
+
+        if self.clock() < (self.grace_start + self.grace_period):
+            return
+
+        occupied = [key for key in gpu_executors if key not in free]
+        utilization = 0.0
+        if occupied:
+            utilization = sum(executor_statuses[key].utilization for key in
+                              occupied) / len(occupied)
+
+        idle_nodes = sorted(ip for ip, keys in nodes.items() if
+                            all(key in free for key in keys))
+
+        logging.info(('There are %d GPU nodes (%d idle, %d more requested); ' +
+                      'occupied GPUs are %.4f utilized, and %d GPU replicas ' +
+                      'are unplaced.') %
+                     (len(nodes), len(idle_nodes), self.pending, utilization,
+                      self.demand))
+
+        unmet = self.demand - self.pending * NUM_GPU_EXEC_THREADS
+        self.demand = 0
+
+        if unmet > 0:
+            count = int(math.ceil(unmet / NUM_GPU_EXEC_THREADS))
+            logging.info('Adding %d GPU nodes for unplaced replicas.' %
+                         (count))
+            self.add_nodes(count)
+        elif self.pending > 0:
+            # The nodes we are waiting for will absorb the load, so there is
+            # nothing to decide until they join.
+            return
+        elif occupied and not free and utilization > self.max_utilization:
+            logging.info(('Every GPU is occupied and %.4f utilized. Adding ' +
+                          '%d GPU nodes.') % (utilization,
+                                              self.scale_increase))
+            self.add_nodes(self.scale_increase)
+        elif len(idle_nodes) > self.spare_nodes and \
+                len(nodes) > self.min_nodes:
+            ip = random.choice(idle_nodes)
+            logging.info('GPU node %s is idle. Removing it.' % (ip))
+
+            departing_executors[ip] = self.scaler.depart_executors(ip, 'gpu')
+            for key in nodes[ip]:
+                del executor_statuses[key]
+
+            self.grace_start = self.clock()
+
+    def add_nodes(self, count):
+        self.scaler.add_vms('gpu', count)
+        self.pending += count
+        self.pending_expiry = self.clock() + self.join_timeout
+        self.grace_start = self.clock()
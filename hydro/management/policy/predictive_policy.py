@@ -0,0 +1,215 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import math
+
+from hydro.management.forecast import HoltWintersForecaster, normal_quantile
+from hydro.management.policy.default_policy import EXECUTOR_REPORT_PERIOD
+from hydro.management.policy.vectorized_policy import (
+    REPLICATE,
+    VectorizedHydroPolicy
+)
+
+# The indices of the point forecast and its upper bound in the tuples returned
+# by HoltWintersForecaster.interval.
+POINT = 1
+UPPER = 2
+
+
+class PredictiveHydroPolicy(VectorizedHydroPolicy):
+    '''
+    A replica and executor policy that scales ahead of predicted load, rather
+    than only after call counts exceed the measured throughput. We keep a
+    time series of the number of calls to each function and the number of
+    requests to each DAG per epoch, and forecast them with Holt-Winters
+    smoothing (see HoltWintersForecaster).
+
+    Each epoch, we take the peak of each function's forecast over the next
+    lead_time seconds, and run the default replica policy as if the function
+    had received that many calls (or its actual call count, if that is
+    higher). Functions are therefore replicated before their load arrives,
+    and they are not dereplicated while their load is expected to return.
+    Similarly, the executor policy plans for the current utilization scaled
+    by the ratio of the predicted to the current call volume, so nodes are
+    added while there is still time for them to boot. We plan for the upper
+    confidence bound of the forecast only while its trend is significant (see
+    predict); on steady load, we plan for the point forecast.
+
+    lead_time is how far ahead (in seconds) we plan; it should cover the time
+    it takes to boot a node and pin a function. confidence is the
+    probability with which the actual load should fall under the bound we
+    plan for. season_length is the length (in epochs) of any recurring
+    pattern in the load; with the default of 0, we only forecast level and
+    trend.
+    '''
+
+    def __init__(self, scaler, lead_time=60, confidence=.9, season_length=0,
+                 alpha=.5, beta=.1, gamma=.1, **kwargs):
+        super().__init__(scaler, **kwargs)
+
+        self.lead_epochs = max(1, int(math.ceil(lead_time /
+                                                EXECUTOR_REPORT_PERIOD)))
+        self.z = normal_quantile(confidence)
+        self.forecaster_args = {'alpha': alpha, 'beta': beta,
+                                'gamma': gamma,
+                                'season_length': season_length}
+
+        self.function_forecasts = {}
+        self.dag_forecasts = {}
+
+        # The ratio of the predicted peak call volume over the lead time to
+        # the current call volume, as of the last epoch.
+        self.load_ratio = 1.0
+
+    def replica_policy(self, function_frequencies, function_runtimes,
+                       dag_runtimes, executor_statuses, arrival_times):
+        cpu_executors, gpu_executors = self.update_locations(
+            executor_statuses)
+
+        self.observe(function_frequencies, arrival_times)
+
+        active = {}
+        idle = {}
+        current_total = 0
+        predicted_total = 0.0
+        for fname, forecaster in self.function_forecasts.items():
+            call_count = function_frequencies.get(fname, 0)
+            predicted = self.predict(forecaster)
+
+            current_total += call_count
+            predicted_total += predicted
+
+            expected = max(call_count, int(math.ceil(predicted)))
+            if expected > call_count:
+                logging.info(('Function %s: %d calls in recent period, up ' +
+                              'to %d predicted in the next %d epochs.') %
+                             (fname, call_count, expected, self.lead_epochs))
+
+            runtime = function_runtimes.get(fname)
+            if runtime is not None and runtime.sum > 0:
+                active[fname] = expected
+            else:
+                idle[fname] = expected
+
+        if current_total > 0:
+            self.load_ratio = max(1.0, predicted_total / current_total)
+        else:
+            self.load_ratio = 1.0
+
+        decisions = self.evaluate(active, function_runtimes)
+        for action, fname, count in decisions:
+            if action == REPLICATE:
+                self.scaler.replicate_function(fname, count,
+                                               self.function_locations,
+                                               cpu_executors, gpu_executors)
+            else:
+                self.scaler.dereplicate_function(fname, count,
+                                                 self.function_locations)
+
+        for fname, expected in idle.items():
+            self.prewarm(fname, expected, cpu_executors, gpu_executors)
+
+    def observe(self, function_frequencies, arrival_times):
+        '''
+        Adds this epoch's call counts and DAG request counts to their time
+        series. Functions and DAGs we have seen before but that weren't
+        reported this epoch had no calls.
+        '''
+        for fname in function_frequencies:
+            if fname not in self.function_forecasts:
+                self.function_forecasts[fname] = HoltWintersForecaster(
+                    **self.forecaster_args)
+
+        for fname, forecaster in list(self.function_forecasts.items()):
+            forecaster.update(function_frequencies.get(fname, 0))
+
+            # We stop tracking functions that have gone quiet and are no
+            # longer pinned anywhere, so the series don't grow without bound.
+            if fname not in self.function_locations and \
+                    self.predict(forecaster) < 1:
+                del self.function_forecasts[fname]
+
+        for dname in arrival_times:
+            if dname not in self.dag_forecasts:
+                self.dag_forecasts[dname] = HoltWintersForecaster(
+                    **self.forecaster_args)
+
+        for dname, forecaster in list(self.dag_forecasts.items()):
+            arrivals = arrival_times.get(dname)
+            forecaster.update(arrivals.count if arrivals else 0)
+
+            predicted = self.predict(forecaster)
+            if predicted < 1 and dname not in arrival_times:
+                del self.dag_forecasts[dname]
+                continue
+
+            logging.info(('DAG %s: %.2f requests/s, up to %.2f requests/s ' +
+                          'predicted in the next %d epochs.') %
+                         (dname, (arrivals.count if arrivals else 0) /
+                          EXECUTOR_REPORT_PERIOD,
+                          predicted / EXECUTOR_REPORT_PERIOD,
+                          self.lead_epochs))
+
+    def predict(self, forecaster):
+        '''
+        Returns the largest forecast of the forecaster over the lead time: the
+        upper confidence bound if the load is rising significantly, and the
+        point forecast otherwise. Noise alone keeps the upper bound above the
+        actual load, so planning for it on steady load would over-provision.
+        '''
+        bound = UPPER if self.is_rising(forecaster) else POINT
+        return max(forecaster.interval(horizon, self.z)[bound] for horizon in
+                   range(1, self.lead_epochs + 1))
+
+    def is_rising(self, forecaster):
+        '''
+        Whether the forecaster's trend is expected to raise the load by more
+        than its forecast error over the lead time.
+        '''
+        rise = forecaster.trend * self.lead_epochs
+        return rise > self.z * math.sqrt(forecaster.error_variance)
+
+    def prewarm(self, fname, expected, cpu_executors, gpu_executors):
+        '''
+        Adds replicas ahead of predicted load for a function that didn't
+        report any runtimes this epoch, based on its historical latency.
+        '''
+        replicas = len(self.function_locations.get(fname, ()))
+        row = self.function_index.get(fname)
+        if expected == 0 or replicas == 0 or row is None or \
+                self.history_count[row] == 0:
+            return
+
+        thruput = float(replicas * EXECUTOR_REPORT_PERIOD) * \
+            (1 / self.history_latency[row])
+        threshold = thruput * self.replica_threshold
+        if expected <= threshold:
+            return
+
+        increase = (math.ceil(expected / threshold) * replicas) - replicas + 1
+        logging.info(('Function %s: %d calls predicted exceeds threshold. ' +
+                      'Adding %d replicas ahead of load.') %
+                     (fname, expected, increase))
+        self.scaler.replicate_function(fname, increase,
+                                       self.function_locations,
+                                       cpu_executors, gpu_executors)
+
+    def expected_utilization(self, avg_utilization):
+        expected = avg_utilization * self.load_ratio
+        if expected > avg_utilization:
+            logging.info(('Planning for %.4f average utilization (%.2f times ' +
+                          'the current load).') % (expected, self.load_ratio))
+
+        return expected
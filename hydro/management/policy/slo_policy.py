@@ -0,0 +1,260 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import namedtuple
+import logging
+import math
+
+from hydro.management.policy.default_policy import EXECUTOR_REPORT_PERIOD
+from hydro.management.policy.predictive_policy import PredictiveHydroPolicy
+from hydro.management.policy.vectorized_policy import (
+    DEREPLICATE,
+    VectorizedHydroPolicy
+)
+
+# A DAG's end-to-end p99 latency target (in seconds) and the names of the
+# functions in it.
+DagSlo = namedtuple('DagSlo', ['target', 'functions'])
+
+# The fewest requests a DAG must complete in an epoch for us to trust its p99.
+MIN_SLO_SAMPLES = 20
+
+
+def load_slos(config):
+    '''
+    Parses the SLOs in a configuration like the following, as loaded from
+    YAML, into a map from each DAG name to its DagSlo:
+
+        dags:
+          pipeline:
+            p99: 0.5
+            functions: [preprocess, model, postprocess]
+    '''
+    slos = {}
+    for dname, spec in (config.get('dags') or {}).items():
+        slos[dname] = DagSlo(float(spec['p99']), tuple(spec['functions']))
+
+    return slos
+
+
+class SLOHydroPolicy(VectorizedHydroPolicy):
+    '''
+    A policy that scales each DAG's functions to meet its p99 end-to-end
+    latency target, on top of the throughput-driven replica policy. slos maps
+    each DAG name to its DagSlo; DAGs without one are scaled as before.
+
+    When a DAG's p99 is over its target, we attribute the miss to the DAG's
+    functions: each function's share is its p99 runtime, inflated by the
+    queueing its replicas are under (by 1 / (1 - utilization), where the
+    utilization is the fraction of its replicas' time its calls take up). The
+    functions whose share is at least bottleneck_share of the largest are the
+    bottlenecks, and each gets enough new replicas to scale its capacity by
+    the ratio of the p99 to the target. If the functions' p99 runtimes alone
+    add up to more than the target, replicas can't help, and we add none.
+
+    When a DAG's p99 has been under slack times its target for slack_epochs
+    epochs in a row, we remove one replica of its least utilized function,
+    as long as the rest stay under the replica threshold. While a DAG isn't
+    comfortably within its target, the throughput policy may not remove
+    replicas of its functions. After scaling a DAG either way, we wait
+    cooldown epochs for the change to take effect before acting on it again.
+    '''
+
+    def __init__(self, scaler, slos, bottleneck_share=.5, slack=.5,
+                 slack_epochs=6, cooldown=3, **kwargs):
+        super().__init__(scaler, **kwargs)
+
+        self.slos = slos
+        self.bottleneck_share = bottleneck_share
+        self.slack = slack
+        self.slack_epochs = slack_epochs
+        self.cooldown = cooldown
+
+        # The functions whose replicas we keep because a DAG they are in is
+        # near or over its target.
+        self.protected = set()
+
+        # The number of consecutive epochs each DAG has had slack, and the
+        # number of epochs until we may scale it again.
+        self.slack_counts = {}
+        self.cooldowns = {}
+
+    def replica_policy(self, function_frequencies, function_runtimes,
+                       dag_runtimes, executor_statuses, arrival_times):
+        latencies = self.check_slos(dag_runtimes)
+
+        super().replica_policy(function_frequencies, function_runtimes,
+                               dag_runtimes, executor_statuses, arrival_times)
+
+        for dname, p99 in latencies.items():
+            if self.cooldowns.get(dname, 0) > 0:
+                self.cooldowns[dname] -= 1
+                continue
+
+            slo = self.slos[dname]
+            if p99 > slo.target:
+                self.scale_up(dname, p99, function_frequencies,
+                              function_runtimes, executor_statuses)
+            elif self.slack_counts[dname] >= self.slack_epochs:
+                self.scale_down(dname, function_frequencies,
+                                function_runtimes)
+
+    def check_slos(self, dag_runtimes):
+        '''
+        Returns the p99 latency of each DAG that has an SLO and reported
+        enough requests this epoch, and updates the set of functions whose
+        replicas we protect and the number of epochs each DAG has had slack.
+        '''
+        latencies = {}
+        self.protected = set()
+        for dname, slo in self.slos.items():
+            runtimes = dag_runtimes.get(dname)
+            if runtimes is None or runtimes.count < MIN_SLO_SAMPLES:
+                continue
+
+            p99 = runtimes.p99
+            latencies[dname] = p99
+            logging.info('DAG %s: p99 latency %.4f, target %.4f.' %
+                         (dname, p99, slo.target))
+
+            if p99 < slo.target * self.slack:
+                self.slack_counts[dname] = self.slack_counts.get(dname, 0) + 1
+            else:
+                self.slack_counts[dname] = 0
+                self.protected.update(slo.functions)
+
+        return latencies
+
+    def evaluate(self, function_frequencies, function_runtimes):
+        decisions = super().evaluate(function_frequencies, function_runtimes)
+
+        kept = []
+        for action, fname, count in decisions:
+            if action == DEREPLICATE and fname in self.protected:
+                logging.info(('Function %s: keeping replicas, since a DAG it ' +
+                              'is in is near its latency target.') % (fname))
+                continue
+
+            kept.append((action, fname, count))
+
+        return kept
+
+    def scale_up(self, dname, p99, function_frequencies, function_runtimes,
+                 executor_statuses):
+        slo = self.slos[dname]
+        shares = {}
+        for fname in slo.functions:
+            share = self.latency_share(fname, function_frequencies,
+                                       function_runtimes)
+            if share is not None:
+                shares[fname] = share
+
+        if not shares:
+            return
+
+        # If the functions' runtimes alone add up to more than the target,
+        # no number of replicas will meet it, so we don't add any.
+        floor = sum(function_runtimes[fname].p99 for fname in shares)
+        if floor >= slo.target:
+            logging.warning(('DAG %s: p99 latency target %.4f is below the ' +
+                             'sum of its functions\' p99 runtimes (%.4f); ' +
+                             'not scaling for it.') %
+                            (dname, slo.target, floor))
+            return
+
+        largest = max(shares.values())
+        ratio = p99 / slo.target
+        for fname, share in shares.items():
+            if share < largest * self.bottleneck_share:
+                continue
+
+            replicas = len(self.function_locations.get(fname, ()))
+            increase = max(int(math.ceil(replicas * ratio)) - replicas, 1)
+            logging.info(('DAG %s: p99 latency %.4f exceeds target %.4f. ' +
+                          'Adding %d replicas of bottleneck function %s.') %
+                         (dname, p99, slo.target, increase, fname))
+
+            self.scaler.replicate_function(fname, increase,
+                                           self.function_locations,
+                                           executor_statuses.cpu_executors,
+                                           executor_statuses.gpu_executors)
+
+        self.cooldowns[dname] = self.cooldown
+        self.slack_counts[dname] = 0
+
+    def scale_down(self, dname, function_frequencies, function_runtimes):
+        slo = self.slos[dname]
+
+        candidates = []
+        for fname in slo.functions:
+            replicas = len(self.function_locations.get(fname, ()))
+            utilization = self.utilization(fname, function_frequencies,
+                                           function_runtimes, replicas - 1)
+
+            # The scaler never reduces a function below two replicas.
+            if replicas > 2 and utilization is not None and \
+                    utilization < self.replica_threshold:
+                candidates.append((utilization, fname, replicas))
+
+        if not candidates:
+            return
+
+        utilization, fname, replicas = min(candidates)
+        logging.info(('DAG %s has been under %.2f times its latency target ' +
+                      'for %d epochs. Reducing %s to %d replicas.') %
+                     (dname, self.slack, self.slack_counts[dname], fname,
+                      replicas - 1))
+        self.scaler.dereplicate_function(fname, replicas - 1,
+                                         self.function_locations)
+
+        self.cooldowns[dname] = self.cooldown
+        self.slack_counts[dname] = 0
+
+    def latency_share(self, fname, function_frequencies, function_runtimes):
+        '''
+        Estimates how much of its DAGs' tail latency the function accounts
+        for: its p99 runtime, inflated by the queueing at its replicas.
+        '''
+        runtime = function_runtimes.get(fname)
+        if runtime is None or runtime.count == 0:
+            return None
+
+        replicas = len(self.function_locations.get(fname, ()))
+        utilization = self.utilization(fname, function_frequencies,
+                                       function_runtimes, replicas)
+        if utilization is None:
+            return None
+
+        return runtime.p99 / max(1 - utilization, .01)
+
+    def utilization(self, fname, function_frequencies, function_runtimes,
+                    replicas):
+        '''
+        The fraction of the time of the given number of replicas that the
+        function's calls in the last epoch would take up.
+        '''
+        runtime = function_runtimes.get(fname)
+        if runtime is None or runtime.count == 0 or replicas <= 0:
+            return None
+
+        work = function_frequencies.get(fname, 0) * runtime.mean
+        return work / (replicas * EXECUTOR_REPORT_PERIOD)
+
+
+class PredictiveSLOHydroPolicy(SLOHydroPolicy, PredictiveHydroPolicy):
+    '''
+    The SLO policy on top of the predictive replica and executor policy (see
+    PredictiveHydroPolicy), rather than the vectorized one: the throughput
+    policy it adjusts scales ahead of forecast load.
+    '''
@@ -0,0 +1,183 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+
+import numpy as np
+
+from hydro.management.policy.default_policy import (
+    DefaultHydroPolicy,
+    EXECUTOR_REPORT_PERIOD
+)
+
+REPLICATE = 'replicate'
+DEREPLICATE = 'dereplicate'
+
+
+class VectorizedHydroPolicy(DefaultHydroPolicy):
+    '''
+    A drop-in replacement for DefaultHydroPolicy that evaluates the replica
+    policy for every function in one vectorized pass. Per-function call
+    counts, runtimes, replica counts, and latency history are held in NumPy
+    arrays, and the scale up, scale down, and latency deviation checks are
+    computed for all functions at once. The resulting decisions are identical
+    to the ones DefaultHydroPolicy makes, and they are handed to the scaler in
+    the same order.
+    '''
+
+    def __init__(self, scaler, **kwargs):
+        super().__init__(scaler, **kwargs)
+
+        # Maps each function name to its row in the history arrays.
+        self.function_index = {}
+
+        # The historical average latency and the number of calls it was
+        # computed over, for each function. A count of 0 means we have no
+        # history for that function yet.
+        self.history_latency = np.zeros(0)
+        self.history_count = np.zeros(0, dtype=np.int64)
+
+    def replica_policy(self, function_frequencies, function_runtimes,
+                       dag_runtimes, executor_statuses, arrival_times):
+        cpu_executors, gpu_executors = self.update_locations(
+            executor_statuses)
+
+        decisions = self.evaluate(function_frequencies, function_runtimes)
+        for action, fname, count in decisions:
+            if action == REPLICATE:
+                self.scaler.replicate_function(fname, count,
+                                               self.function_locations,
+                                               cpu_executors, gpu_executors)
+            else:
+                self.scaler.dereplicate_function(fname, count,
+                                                 self.function_locations)
+
+    def evaluate(self, function_frequencies, function_runtimes):
+        '''
+        Computes the replica decisions for this epoch and updates the latency
+        history. Returns a list of (action, function name, count) tuples,
+        where the action is REPLICATE (add count replicas) or DEREPLICATE
+        (reduce to count replicas).
+        '''
+        names = []
+        calls = []
+        sums = []
+        counts = []
+        replicas = []
+        for fname, call_count in function_frequencies.items():
+            runtime = function_runtimes[fname]
+            if call_count == 0 or runtime.sum == 0:
+                continue
+
+            # The scalar policy can't compute a throughput for a function
+            # that isn't pinned anywhere, so we skip it rather than divide by
+            # zero.
+            if not self.function_locations.get(fname):
+                logging.info('Function %s has no replicas, skipping.' %
+                             (fname))
+                continue
+
+            names.append(fname)
+            calls.append(call_count)
+            sums.append(runtime.sum)
+            counts.append(runtime.count)
+            replicas.append(len(self.function_locations[fname]))
+
+        if not names:
+            return []
+
+        rows = self._get_rows(names)
+        calls = np.array(calls, dtype=np.float64)
+        sums = np.array(sums, dtype=np.float64)
+        counts = np.array(counts, dtype=np.int64)
+        replicas = np.array(replicas, dtype=np.int64)
+
+        historical = self.history_latency[rows]
+        hist_counts = self.history_count[rows]
+        has_history = hist_counts > 0
+
+        avg_latency = sums / counts
+        thruput = (replicas * EXECUTOR_REPORT_PERIOD).astype(np.float64) * \
+            (1 / avg_latency)
+
+        scale_up = calls > thruput * self.replica_threshold
+        scale_down = ~scale_up & (calls < thruput * self.dereplica_threshold)
+
+        ratio = np.zeros(len(names))
+        np.divide(avg_latency, historical, out=ratio, where=has_history)
+        deviating = ~scale_up & ~scale_down & has_history & \
+            (ratio > self.max_latency_deviation)
+
+        increase = (np.ceil(calls / (thruput * self.replica_threshold)) *
+                    replicas) - replicas + 1
+        decrease = np.ceil((calls / thruput) * replicas) + 1
+        scaled_ratio = ratio * replicas
+        deviation_increase = np.ceil(scaled_ratio) - replicas + 1
+
+        # Recalculates total runtime for each function and the historical
+        # call count and updates latency history metadata.
+        self.history_latency[rows] = (sums + historical * hist_counts) / \
+            (counts + hist_counts)
+        self.history_count[rows] = counts + hist_counts
+
+        logging.info(('Evaluated %d functions: %d to scale up, %d to scale ' +
+                      'down, %d with deviating latency.') %
+                     (len(names), scale_up.sum(), scale_down.sum(),
+                      deviating.sum()))
+
+        decisions = []
+        for i in np.flatnonzero(scale_up | scale_down | deviating):
+            fname = names[i]
+
+            if scale_up[i]:
+                count = int(increase[i])
+                logging.info(('Function %s: %d calls in recent period exceeds'
+                              + ' threshold. Adding %d replicas.') %
+                             (fname, calls[i], count))
+                decisions.append((REPLICATE, fname, count))
+            elif scale_down[i]:
+                count = int(decrease[i])
+                logging.info(('Function %s: %d calls in recent period under ' +
+                              'threshold. Reducing to %d replicas.') %
+                             (fname, calls[i], count))
+                decisions.append((DEREPLICATE, fname, count))
+            else:
+                count = int(deviation_increase[i])
+                logging.info(('Function %s: recent latency average (%.4f) '
+                              + 'is %.2f times the historical average. '
+                              + 'Adding %d replicas.')
+                             % (fname, avg_latency[i], scaled_ratio[i], count))
+                decisions.append((REPLICATE, fname, count))
+
+        return decisions
+
+    def _get_rows(self, names):
+        rows = np.empty(len(names), dtype=np.intp)
+        for i, fname in enumerate(names):
+            if fname not in self.function_index:
+                self.function_index[fname] = len(self.function_index)
+
+            rows[i] = self.function_index[fname]
+
+        # Grow the history arrays geometrically so that new functions don't
+        # cost a copy every epoch.
+        old_size = len(self.history_latency)
+        if len(self.function_index) > old_size:
+            size = max(len(self.function_index), 2 * old_size)
+            self.history_latency = np.resize(self.history_latency, size)
+            self.history_count = np.resize(self.history_count, size)
+            self.history_latency[old_size:] = 0.0
+            self.history_count[old_size:] = 0
+
+        return rows
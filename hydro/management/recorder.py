@@ -0,0 +1,147 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import mmap
+import struct
+import time
+
+# Identifies a management log, and the version of its format.
+MAGIC = b'HYDROLOG'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sI')
+
+# Each record starts with the time it was received, its kind, and the length
+# of the message that follows.
+RECORD_HEADER = struct.Struct('<dBI')
+
+# The kinds of records; each is the raw message received on the socket of the
+# same name, except EPOCH, which is empty and marks the point at which the
+# policy ran.
+STATUS = 1
+STATISTICS = 2
+CHURN = 3
+DEPART = 4
+LIST_EXECUTORS = 5
+LIST_SCHEDULERS = 6
+RESTART = 7
+EPOCH = 8
+
+KIND_NAMES = {
+    STATUS: 'status',
+    STATISTICS: 'statistics',
+    CHURN: 'churn',
+    DEPART: 'depart',
+    LIST_EXECUTORS: 'list_executors',
+    LIST_SCHEDULERS: 'list_schedulers',
+    RESTART: 'restart',
+    EPOCH: 'epoch'
+}
+
+# We write the buffered records to the file once they reach this size, and at
+# the end of every epoch.
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+class Recorder():
+    '''
+    Appends every message the management server receives to a log, so that
+    the inputs that led to a policy decision can be replayed later (see
+    replay.py). Records are appended to an in-memory buffer, which costs a
+    struct pack and a copy of the message, and the buffer is written out in
+    large chunks, so recording doesn't add a system call per message.
+    '''
+
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.count = 0
+
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+    def record(self, kind, msg, now=None):
+        if now is None:
+            now = time.time()
+
+        buffer = self.buffer
+        buffer += RECORD_HEADER.pack(now, kind, len(msg))
+        buffer += msg
+        self.count += 1
+
+        if len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def wrap(self, kind, handler):
+        '''
+        Returns a handler that records each message before passing it to
+        handler, for registration with the SocketDispatcher.
+        '''
+        def recorded(msg):
+            self.record(kind, msg)
+            return handler(msg)
+
+        return recorded
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class LogReader():
+    '''
+    Reads the records of a log written by a Recorder. The log is memory-mapped
+    rather than read into memory, so only the pages holding the records being
+    read are resident, and even logs larger than memory can be replayed.
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a management log.' % (path))
+        if version != VERSION:
+            raise ValueError('Unsupported management log version %d.' %
+                             (version))
+
+    def __iter__(self):
+        '''
+        Yields a (time, kind, message) tuple for each record. A partially
+        written record at the end of the log is ignored.
+        '''
+        offset = FILE_HEADER.size
+        end = len(self.map)
+        header_size = RECORD_HEADER.size
+
+        while offset + header_size <= end:
+            now, kind, length = RECORD_HEADER.unpack_from(self.map, offset)
+            offset += header_size
+            if offset + length > end:
+                break
+
+            yield now, kind, self.map[offset:offset + length]
+            offset += length
+
+    def close(self):
+        self.map.close()
+        self.file.close()
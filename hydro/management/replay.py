@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+Replays a log recorded by the management server (see recorder.py) into a
+policy, and prints the decisions it makes, one JSON object per line. The
+recorded statuses and statistics are aggregated as the management server
+does, and the policy runs wherever the log marks an epoch, with its clock set
+to the recorded time. Decisions aren't carried out; the scaler only records
+them.
+
+By default, the log is replayed as fast as possible; with --speed, it is
+paced at that multiple of the original speed (e.g., 1 for real time).
+'''
+
+import argparse
+import json
+import logging
+import time
+
+from hydro.management.recorder import (
+    CHURN,
+    DEPART,
+    EPOCH,
+    KIND_NAMES,
+    LogReader,
+    STATISTICS,
+    STATUS
+)
+from hydro.management.policy.gpu_policy import GpuCapacityPolicy
+from hydro.management.scaler.base_scaler import BaseScaler
+from hydro.management.shards import EpochSummary
+from hydro.management.simulator.sweep import parse_value, POLICIES
+from hydro.management.status_store import ExecutorStatusStore
+from hydro.management.util import NUM_EXEC_THREADS, NUM_GPU_EXEC_THREADS
+from hydro.shared.proto.internal_pb2 import ExecutorStatistics, ThreadStatus
+
+
+class ReplayScaler(BaseScaler):
+    '''
+    A scaler that records the decisions made by the policy, along with the
+    recorded time at which each was made, rather than carrying them out.
+    '''
+
+    def __init__(self):
+        self.now = 0.0
+        self.decisions = []
+        self.departing_kinds = {}
+
+    def replicate_function(self, fname, num_replicas, function_locations,
+                           cpu_executors, gpu_executors=None):
+        self._decide('replicate', function=fname, replicas=num_replicas)
+
+    def handle_pin_responses(self):
+        return 0
+
+    def check_pin_timeouts(self):
+        pass
+
+    def dereplicate_function(self, fname, num_replicas, function_locations):
+        self._decide('dereplicate', function=fname, replicas=num_replicas)
+
+    def depart_executors(self, ip, kind='function'):
+        self._decide('depart', ip=ip, kind=kind)
+        self.departing_kinds[ip] = kind
+        return NUM_GPU_EXEC_THREADS if kind == 'gpu' else NUM_EXEC_THREADS
+
+    def remove_departed(self, ip):
+        self.remove_vms(self.departing_kinds.pop(ip, 'function'), ip)
+
+    def take_gpu_demand(self):
+        # Pins aren't replayed, so we never know of unplaced GPU replicas.
+        return 0
+
+    def add_vms(self, kind, count):
+        self._decide('add_vms', kind=kind, count=int(count))
+
+    def remove_vms(self, kind, ip):
+        self._decide('remove_vms', kind=kind, ip=ip)
+
+    def _decide(self, action, **args):
+        decision = {'time': self.now, 'action': action}
+        decision.update(args)
+        self.decisions.append(decision)
+
+
+def replay(path, policy_class, policy_args=None, speed=0, on_decision=None):
+    '''
+    Replays the log at path into a new instance of policy_class, constructed
+    with policy_args. If speed is positive, records are replayed at that
+    multiple of the speed at which they were recorded. on_decision, if given,
+    is called with each decision as it is made.
+
+    Returns the ReplayScaler holding the decisions and a map from each kind
+    of record to the number replayed.
+    '''
+    scaler = ReplayScaler()
+    args = dict(policy_args or {})
+    args['clock'] = lambda: scaler.now
+    policy = policy_class(scaler, **args)
+    gpu_policy = GpuCapacityPolicy(scaler, clock=args['clock'])
+
+    executor_statuses = ExecutorStatusStore()
+    departing_executors = {}
+    summary = EpochSummary()
+    counts = {name: 0 for name in KIND_NAMES.values()}
+
+    reader = LogReader(path)
+    first = None
+    start = time.time()
+    reported = 0
+    for now, kind, msg in reader:
+        if first is None:
+            first = now
+
+        if speed > 0:
+            delay = (now - first) / speed - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        scaler.now = now
+        name = KIND_NAMES.get(kind, 'unknown')
+        counts[name] = counts.get(name, 0) + 1
+
+        if kind == STATUS:
+            status = ThreadStatus()
+            status.ParseFromString(msg)
+
+            # As in the management server, we ignore departing executors.
+            if status.ip not in departing_executors:
+                executor_statuses.update(status, now)
+        elif kind == STATISTICS:
+            stats = ExecutorStatistics()
+            stats.ParseFromString(msg)
+            summary.add_statistics(stats)
+        elif kind == CHURN:
+            parts = msg.decode().split(':')
+            if parts[0] == 'add':
+                scaler.add_vms(parts[2], parts[1])
+            elif parts[0] == 'remove':
+                scaler.remove_vms(parts[2], parts[1])
+        elif kind == DEPART:
+            # The policy we replay into may not have chosen the same nodes to
+            # remove as the one that was recorded, so we only count the
+            # acknowledgements from nodes it is waiting for.
+            ip = msg.decode()
+            if ip in departing_executors:
+                departing_executors[ip] -= 1
+                if departing_executors[ip] == 0:
+                    scaler.remove_departed(ip)
+                    del departing_executors[ip]
+        elif kind == EPOCH:
+            policy.replica_policy(summary.function_frequencies,
+                                  summary.function_runtimes,
+                                  summary.dag_runtimes, executor_statuses,
+                                  summary.arrival_times)
+            policy.executor_policy(executor_statuses, departing_executors)
+            gpu_policy.capacity_policy(executor_statuses, departing_executors)
+            summary.clear()
+
+        if on_decision:
+            for decision in scaler.decisions[reported:]:
+                on_decision(decision)
+            reported = len(scaler.decisions)
+
+    reader.close()
+
+    return scaler, counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('log', help='The path of the recorded log.')
+    parser.add_argument('--policy', choices=sorted(POLICIES),
+                        default='vectorized')
+    parser.add_argument('--param', action='append', default=[],
+                        help='A policy parameter, as name=value; may be ' +
+                        'repeated.')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='Replay at this multiple of the recorded ' +
+                        'speed; 0 replays as fast as possible.')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show the policy\'s log messages.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else
+                        logging.WARNING)
+
+    policy_args = {}
+    for param in args.param:
+        name, value = param.split('=', 1)
+        policy_args[name] = parse_value(value)
+
+    start = time.time()
+    scaler, counts = replay(args.log, POLICIES[args.policy], policy_args,
+                            args.speed,
+                            lambda decision: print(json.dumps(decision)))
+
+    logging.warning('Replayed %d records (%s) in %.2f seconds; %d decisions.'
+                    % (sum(counts.values()),
+                       ', '.join('%d %s' % (count, name) for name, count in
+                                 sorted(counts.items()) if count),
+                       time.time() - start, len(scaler.decisions)))
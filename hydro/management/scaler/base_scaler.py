@@ -18,18 +18,59 @@ class BaseScaler():
         raise NotImplementedError
 
     def replicate_function(self, fname, num_replicas, function_locations,
-                           executors):
+                           cpu_executors, gpu_executors=None):
         '''
         Adds num_replicas more copies of the function named fname. The
-        function_locations map is used to exclude the executor threads that
-        already have functions pinned on them.
+        function_locations index (a FunctionLocationIndex) is used to exclude
+        the executor threads that already have functions pinned on them, and
+        it is updated as the new replicas are pinned. This should not block
+        waiting for executors to respond; see handle_pin_responses.
+        '''
+        raise NotImplementedError
+
+    def handle_pin_responses(self):
+        '''
+        Processes the responses to outstanding pin requests. This is called by
+        the management server whenever the pin accept socket is readable, and
+        returns the number of responses processed.
+        '''
+        raise NotImplementedError
+
+    def check_pin_timeouts(self):
+        '''
+        Retries or abandons pin requests that have not been answered in time.
+        This is called on every iteration of the management server loop.
         '''
         raise NotImplementedError
 
     def dereplicate_function(self, fname, num_replicas, function_locations):
         '''
-        Removes num_replicas of the function named fname from the list of
-        locations that are stored in function_locations.
+        Reduces the function named fname to num_replicas replicas, and removes
+        the unpinned locations from the function_locations index.
+        '''
+        raise NotImplementedError
+
+    def depart_executors(self, ip, kind='function'):
+        '''
+        Asks every executor thread on the node with the given IP, of the given
+        kind (function or gpu), to finish its outstanding work and leave the
+        system. Returns the number of threads asked to depart. Each thread
+        acknowledges on the management server's depart socket, after which
+        the node is removed by remove_departed.
+        '''
+        raise NotImplementedError
+
+    def remove_departed(self, ip):
+        '''
+        Removes a node whose executors have all departed from the node group
+        of the kind it was departed as.
+        '''
+        raise NotImplementedError
+
+    def take_gpu_demand(self):
+        '''
+        Returns the number of GPU function replicas that couldn't be placed
+        for lack of a free GPU executor since the last call, and resets it.
         '''
         raise NotImplementedError
 
@@ -12,86 +12,320 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections import deque
 import logging
 import random
+import time
+
 import zmq
 
 from hydro.management.util import (
+    get_executor_depart_address,
     get_executor_pin_address,
     get_executor_unpin_address,
-    send_message
+    NUM_EXEC_THREADS,
+    NUM_GPU_EXEC_THREADS,
+    send_message,
+    send_messages
 )
 from hydro.management.scaler.base_scaler import BaseScaler
+from hydro.management.scaler.placement import RandomPlacement
 from hydro.shared.proto.internal_pb2 import PinFunction
 from hydro.shared.proto.cloudburst_pb2 import GenericResponse
 
+# How long (in seconds) we wait for an executor to accept or reject a pin
+# before we give up on it and try another executor.
+PIN_TIMEOUT = 10
+
+# The number of executors we try for each replica before giving up on it.
+MAX_PIN_ATTEMPTS = 3
+
+
+class PinRequest():
+    '''
+    A single replica of a function that we are trying to pin somewhere. Each
+    request has its own correlation ID, and it carries the pool of candidate
+    executors it can be retried on if its current target times out or rejects
+    the pin.
+    '''
+
+    def __init__(self, request_id, fname, candidates, locations):
+        self.id = request_id
+        self.fname = fname
+
+        # This set is shared by all the replicas requested in the same call
+        # to replicate_function, so they never pick the same executor.
+        self.candidates = candidates
+
+        # The FunctionLocationIndex to record the target in once the pin
+        # succeeds.
+        self.locations = locations
+
+        self.target = None
+        self.sent = None
+        self.deadline = None
+        self.attempts = 0
+
 
 class DefaultScaler(BaseScaler):
-    def __init__(self, ip, ctx, add_socket, remove_socket, pin_accept_socket):
+    def __init__(self, ip, ctx, add_socket, remove_socket, pin_accept_socket,
+                 loop_stats=None, placement=None):
         self.ip = ip
         self.context = ctx
         self.add_socket = add_socket
         self.remove_socket = remove_socket
         self.pin_accept_socket = pin_accept_socket
+        self.loop_stats = loop_stats
 
-    def replicate_function(self, fname, num_replicas, function_locations,
-                           cpu_executors, gpu_executors):
+        # Decides which of the free candidates each replica is pinned on.
+        if placement is None:
+            placement = RandomPlacement()
+        self.placement = placement
 
-        existing_replicas = function_locations[fname]
+        self.next_pin_id = 0
 
-        msg = PinFunction()
-        msg.name = fname
-        msg.response_address = self.ip
+        # Pin responses don't say which thread they came from, only which node
+        # (by their peer address), so we allow at most one outstanding pin per
+        # node. This maps each node IP to the request currently in flight
+        # there.
+        self.pending_pins = {}
+
+        # Maps the IP of each node whose pin timed out to the expired request,
+        # the thread it was sent to, and the time until which a late response
+        # from that node may still arrive. We don't send new pins to these
+        # nodes until then, so a late response is never mistaken for a
+        # response to a different request.
+        self.expired_pins = {}
+
+        # Requests whose remaining candidates all have a pin in flight.
+        self.queued_pins = deque()
+
+        # The number of GPU replicas we couldn't place because there were no
+        # free GPU executors, since the last call to take_gpu_demand.
+        self.gpu_demand = 0
 
-        # TODO: Add proper support for autoscaling GPU instances and for
-        # checking whether batching is enabled.
-        if 'gpu' in fname:
-            candidate_nodes = gpu_executors.difference(existing_replicas)
+        # The kind of each node whose executors we have asked to depart.
+        self.departing_kinds = {}
 
-            for key in function_locations:
-                if 'gpu' in key:
-                    for location in function_locations[key]:
-                        candidate_nodes.discard(location)
+    def replicate_function(self, fname, num_replicas, function_locations,
+                           cpu_executors, gpu_executors=None):
+        '''
+        Sends pins for num_replicas new replicas of fname in parallel and
+        returns immediately. Responses are collected by handle_pin_responses,
+        and the locations are updated as each pin succeeds.
+        '''
+        existing_replicas = function_locations.get(fname, ())
+
+        # TODO: Add support for checking whether batching is enabled.
+        gpu = function_locations.is_gpu(fname)
+        if gpu:
+            # A GPU can only be used by one function at a time, so we only
+            # pick from the GPU executors that have nothing pinned.
+            candidate_nodes = set(function_locations.free_gpu_executors)
         else:
             candidate_nodes = cpu_executors.difference(existing_replicas)
 
-        for _ in range(num_replicas):
-            if len(candidate_nodes) == 0:
-                continue
+        # Don't pick executors that already have a pin for this function in
+        # flight. A free GPU executor with any pin in flight will be taken.
+        for request in self._outstanding_requests():
+            if request.fname == fname or (gpu and request.locations.is_gpu(
+                    request.fname)):
+                candidate_nodes.discard(request.target)
 
-            ip, tid = random.sample(candidate_nodes, 1)[0]
-            send_message(self.context, msg.SerializeToString(),
-                         get_executor_pin_address(ip, tid))
+        # We record the GPU replicas we have nowhere to put, so the GPU
+        # capacity policy can add nodes for them.
+        if gpu and len(candidate_nodes) < num_replicas:
+            logging.info('Only %d free GPU executors for %d replicas of %s.'
+                         % (len(candidate_nodes), num_replicas, fname))
+            self.gpu_demand += num_replicas - len(candidate_nodes)
+            num_replicas = len(candidate_nodes)
 
-            response = GenericResponse()
+        for _ in range(num_replicas):
+            request = PinRequest(self.next_pin_id, fname, candidate_nodes,
+                                 function_locations)
+            self.next_pin_id += 1
+            self._dispatch(request)
+
+    def handle_pin_responses(self):
+        '''
+        Processes every pin response that has arrived so far without blocking.
+        Successful pins are recorded in the function's locations, and rejected
+        pins are retried on another candidate executor. Returns the number of
+        responses processed.
+        '''
+        count = 0
+        while True:
             try:
-                response.ParseFromString(self.pin_accept_socket.recv())
+                frame = self.pin_accept_socket.recv(zmq.DONTWAIT, copy=False)
             except zmq.ZMQError:
-                logging.error('Pin operation to %s:%d timed out for %s.' %
-                              (ip, tid, fname))
-                candidate_nodes.remove((ip, tid))
+                break  # We've run out of messages.
+
+            count += 1
+            self.handle_pin_response(frame)
+
+        self._dispatch_queued()
+
+        return count
+
+    def handle_pin_response(self, frame):
+        '''
+        Processes a single pin response, received as a zmq.Frame so that we
+        can tell which node sent it. Requests that were queued waiting for
+        that node are dispatched by the next call to check_pin_timeouts.
+        '''
+        response = GenericResponse()
+        response.ParseFromString(frame.bytes)
+
+        ip = _get_peer_address(frame)
+        if ip in self.expired_pins:
+            self._handle_late_response(ip, response)
+            return
+
+        request = self._match_response(ip)
+        if request is None:
+            return
+
+        ip, tid = request.target
+        if response.success:
+            elapsed = time.time() - request.sent
+            logging.info(('Pin %d of %s to %s:%d successful after ' +
+                          '%.4f seconds.') % (request.id, request.fname,
+                                              ip, tid, elapsed))
+            request.locations.add(request.fname, request.target)
+
+            if self.loop_stats:
+                self.loop_stats.record_pin(elapsed)
+        else:
+            # The pin operation was rejected, so we try another node.
+            logging.error('Node %s:%d rejected pin %d for %s.' %
+                          (ip, tid, request.id, request.fname))
+            self._dispatch(request)
+
+    def check_pin_timeouts(self):
+        '''
+        Retries every pin that hasn't been answered within PIN_TIMEOUT seconds
+        on another candidate executor.
+        '''
+        now = time.time()
+        for ip, request in list(self.pending_pins.items()):
+            if now < request.deadline:
                 continue
 
-            if response.success:
-                logging.info('Pin operation to %s:%d for %s successful.' %
-                              (ip, tid, fname))
-                function_locations[fname].add((ip, tid))
-            else:
-                # The pin operation was rejected, remove node and try again.
-                logging.error('Node %s:%d rejected pin for %s.'
-                              % (ip, tid, fname))
-            candidate_nodes.remove((ip, tid))
+            del self.pending_pins[ip]
+            self.expired_pins[ip] = (request, request.target,
+                                     now + PIN_TIMEOUT)
+
+            logging.error('Pin %d to %s:%d timed out for %s.' %
+                          (request.id, ip, request.target[1], request.fname))
+            self._dispatch(request)
+
+        for ip, (_, _, expiry) in list(self.expired_pins.items()):
+            if now >= expiry:
+                del self.expired_pins[ip]
+
+        self._dispatch_queued()
+
+    def _dispatch(self, request):
+        if request.attempts >= MAX_PIN_ATTEMPTS or not request.candidates:
+            logging.error(('Unable to find an executor for pin %d of %s ' +
+                           'after %d attempts.') % (request.id, request.fname,
+                                                    request.attempts))
+            if request.locations.is_gpu(request.fname):
+                self.gpu_demand += 1
+            return
+
+        free = [key for key in request.candidates
+                if key[0] not in self.pending_pins and
+                key[0] not in self.expired_pins]
+        if not free:
+            self.queued_pins.append(request)
+            return
+
+        pending = [other.target for other in self.pending_pins.values()
+                   if other.fname == request.fname]
+        target = self.placement.choose(request.fname, free, request.locations,
+                                       pending)
+        request.candidates.discard(target)
+        request.target = target
+        request.attempts += 1
+        request.sent = time.time()
+        request.deadline = request.sent + PIN_TIMEOUT
+
+        msg = PinFunction()
+        msg.name = request.fname
+        msg.response_address = self.ip
+
+        self.pending_pins[target[0]] = request
+        send_message(self.context, msg.SerializeToString(),
+                     get_executor_pin_address(*target))
+
+    def _dispatch_queued(self):
+        for _ in range(len(self.queued_pins)):
+            self._dispatch(self.queued_pins.popleft())
+
+    def _handle_late_response(self, ip, response):
+        # This is a late response to a pin that we already retried elsewhere;
+        # if it succeeded, the function is pinned there anyway.
+        request, target, _ = self.expired_pins.pop(ip)
+        if response.success:
+            logging.info('Late pin response for %s from %s:%d: successful.' %
+                         (request.fname, ip, target[1]))
+            request.locations.add(request.fname, target)
+        else:
+            logging.info('Late pin response for %s from %s:%d: rejected.' %
+                         (request.fname, ip, target[1]))
+
+    def _match_response(self, ip):
+        if ip in self.pending_pins:
+            return self.pending_pins.pop(ip)
+
+        # If we couldn't read the peer's address, we can only attribute the
+        # response when there is exactly one pin in flight.
+        if ip is None and len(self.pending_pins) == 1:
+            _, request = self.pending_pins.popitem()
+            return request
+
+        logging.error('Received a pin response from %s with no pin pending.'
+                      % (ip))
+        return None
+
+    def _outstanding_requests(self):
+        for request in self.pending_pins.values():
+            yield request
+
+        for request in self.queued_pins:
+            yield request
 
     def dereplicate_function(self, fname, num_replicas, function_locations):
         if num_replicas < 2:
             return
 
-        while len(function_locations[fname]) > num_replicas:
-            ip, tid = random.sample(function_locations[fname], 1)[0]
+        # We unpin a random subset of the replicas, leaving num_replicas.
+        replicas = sorted(function_locations.get(fname, ()))
+        random.shuffle(replicas)
+
+        for ip, tid in replicas[num_replicas:]:
             send_message(self.context, fname,
                          get_executor_unpin_address(ip, tid))
 
-            function_locations[fname].discard((ip, tid))
+            function_locations.discard(fname, (ip, tid))
+
+    def depart_executors(self, ip, kind='function'):
+        threads = NUM_GPU_EXEC_THREADS if kind == 'gpu' else NUM_EXEC_THREADS
+        send_messages(self.context,
+                      [(get_executor_depart_address(ip, tid), '')
+                       for tid in range(threads)])
+
+        self.departing_kinds[ip] = kind
+        return threads
+
+    def remove_departed(self, ip):
+        self.remove_vms(self.departing_kinds.pop(ip, 'function'), ip)
+
+    def take_gpu_demand(self):
+        demand = self.gpu_demand
+        self.gpu_demand = 0
+        return demand
 
     def add_vms(self, kind, count):
         msg = kind + ':' + str(count)
@@ -100,3 +334,10 @@ class DefaultScaler(BaseScaler):
     def remove_vms(self, kind, ip):
         msg = kind + ':' + ip
         self.remove_socket.send_string(msg)
+
+
+def _get_peer_address(frame):
+    try:
+        return frame.get('Peer-Address')
+    except (zmq.ZMQError, AttributeError):
+        return None
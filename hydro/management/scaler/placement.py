@@ -0,0 +1,122 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+
+import numpy as np
+
+
+class BasePlacement():
+    '''
+    Decides which executor thread a new replica of a function is pinned on.
+    '''
+
+    def choose(self, fname, candidates, function_locations, pending=()):
+        '''
+        Returns the (ip, tid) key in candidates to pin the next replica of
+        fname on. function_locations is the FunctionLocationIndex of where
+        every function is pinned, and pending holds the keys that already
+        have a pin for fname in flight.
+        '''
+        raise NotImplementedError
+
+
+class RandomPlacement(BasePlacement):
+    '''
+    Picks a uniformly random candidate.
+    '''
+
+    def choose(self, fname, candidates, function_locations, pending=()):
+        return random.choice(sorted(candidates))
+
+
+class LoadAwarePlacement(BasePlacement):
+    '''
+    Scores each candidate executor thread and picks the lowest score. A
+    thread's score is the weighted sum of:
+
+      * its last reported utilization,
+      * the number of functions pinned on it,
+      * the number of replicas of the function already on its node, pinned or
+        with a pin in flight, which spreads a batch of replicas across nodes
+        so that one node going down or running hot doesn't take out several
+        of them, and
+      * minus the number of the function's DAG neighbors (the functions
+        immediately upstream or downstream of it) pinned on its node, since
+        the data passed between them then doesn't leave the node.
+
+    executor_statuses is the ExecutorStatusStore the utilization and pin
+    counts are read from, and dags maps each DAG name to its functions in
+    order; see set_dags.
+    '''
+
+    def __init__(self, executor_statuses, dags=None, utilization_weight=1.0,
+                 pin_weight=.5, spread_weight=.5, colocation_weight=.25):
+        self.executor_statuses = executor_statuses
+        self.utilization_weight = utilization_weight
+        self.pin_weight = pin_weight
+        self.spread_weight = spread_weight
+        self.colocation_weight = colocation_weight
+
+        self.neighbors = {}
+        self.set_dags(dags or {})
+
+    def set_dags(self, dags):
+        '''
+        Records the neighbors of each function, given a map from each DAG name
+        to the sequence of functions in it.
+        '''
+        self.neighbors = {}
+        for functions in dags.values():
+            for upstream, downstream in zip(functions, functions[1:]):
+                self.neighbors.setdefault(upstream, set()).add(downstream)
+                self.neighbors.setdefault(downstream, set()).add(upstream)
+
+    def choose(self, fname, candidates, function_locations, pending=()):
+        # We sort the candidates so that, with the random module seeded, ties
+        # are broken the same way on every run.
+        candidates = sorted(candidates)
+        statuses = self.executor_statuses
+
+        # Counts replicas of the function and of its neighbors on each node.
+        replicas = {}
+        for ip, _ in list(function_locations.get(fname, ())) + list(pending):
+            replicas[ip] = replicas.get(ip, 0) + 1
+
+        neighbors = {}
+        for neighbor in self.neighbors.get(fname, ()):
+            for ip, _ in function_locations.get(neighbor, ()):
+                neighbors[ip] = neighbors.get(ip, 0) + 1
+
+        # We read the utilization and pin counts straight from the store's
+        # arrays. Threads that haven't reported yet are treated as idle.
+        slots = np.array([statuses.slots.get(key, -1) for key in candidates],
+                         dtype=np.int64)
+        known = slots >= 0
+        utilization = np.zeros(len(candidates))
+        pin_counts = np.zeros(len(candidates))
+        utilization[known] = statuses.utilization[slots[known]]
+        pin_counts[known] = statuses.pin_counts[slots[known]]
+
+        spread = np.array([replicas.get(ip, 0) for ip, _ in candidates])
+        colocated = np.array([neighbors.get(ip, 0) for ip, _ in candidates])
+
+        scores = (self.utilization_weight * utilization +
+                  self.pin_weight * pin_counts +
+                  self.spread_weight * spread -
+                  self.colocation_weight * colocated)
+
+        # Breaks ties at random, so equally good threads share the load.
+        best = np.flatnonzero(scores <= scores.min() + 1e-9)
+        return candidates[random.choice(best)]
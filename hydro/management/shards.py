@@ -0,0 +1,382 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import multiprocessing
+import pickle
+import threading
+import time
+
+import zmq
+
+from hydro.management.sketch import QuantileSketch
+from hydro.management.status_store import ExecutorStatus
+from hydro.shared.proto.internal_pb2 import ExecutorStatistics, ThreadStatus
+
+# How long (in seconds) we wait for every shard to hand over its summary at the
+# end of an epoch. A summary that arrives later is merged into the next epoch.
+FLUSH_TIMEOUT = .5
+
+SHARD_STATISTICS_ADDRESS = 'ipc:///tmp/management_shard_statistics'
+SHARD_STATUS_ADDRESS = 'ipc:///tmp/management_shard_status'
+SHARD_CONTROL_ADDRESS = 'ipc:///tmp/management_shard_control_%d'
+SHARD_CAPTURE_ADDRESS = 'inproc://shard_capture_%d'
+
+# The most messages a worker takes from one socket before checking whether it
+# has been asked to flush.
+SHARD_BATCH = 1000
+
+FLUSH = b'flush'
+STOP = b'stop'
+
+
+class EpochSummary():
+    '''
+    Everything the policy needs from one epoch of ExecutorStatistics and
+    ThreadStatus messages: call counts and runtime and interarrival sketches
+    for each function and DAG, and the latest status of each executor thread.
+    Summaries built from disjoint sets of messages can be merged, and the
+    result is the same as if one summary had seen all of the messages.
+    '''
+
+    def __init__(self):
+        self.function_frequencies = {}
+        self.function_runtimes = {}
+        self.arrival_times = {}
+        self.dag_frequencies = {}
+        self.dag_runtimes = {}
+
+        # Maps each executor thread to the latest ExecutorStatus it reported,
+        # where last_seen is the time the status was received.
+        self.statuses = {}
+
+        # The number of messages of each kind, and the time spent handling
+        # them.
+        self.messages = {'statistics': 0, 'status': 0}
+        self.times = {'statistics': 0.0, 'status': 0.0}
+
+    def clear(self):
+        self.function_frequencies.clear()
+        self.function_runtimes.clear()
+        self.arrival_times.clear()
+        self.dag_frequencies.clear()
+        self.dag_runtimes.clear()
+        self.statuses.clear()
+
+        for kind in self.messages:
+            self.messages[kind] = 0
+            self.times[kind] = 0.0
+
+    def add_statistics(self, stats):
+        '''
+        Aggregates a parsed ExecutorStatistics message.
+        '''
+        # Aggregates statistics reported for individual functions including
+        # call frequencies, processed requests, and total runtimes.
+        for fstats in stats.functions:
+            fname = fstats.name
+
+            if fname not in self.function_frequencies:
+                self.function_frequencies[fname] = 0
+
+            if fname not in self.function_runtimes:
+                self.function_runtimes[fname] = QuantileSketch()
+
+            if fstats.runtime:
+                # This tracks how many calls were processed for the function
+                # and the distribution of their runtimes.
+                self.function_runtimes[fname].add_all(fstats.runtime)
+            else:
+                # This tracks how many calls are made to the function.
+                self.function_frequencies[fname] += fstats.call_count
+
+        # Aggregates statistics for DAG requests, including call frequencies,
+        # arrival rates, and end-to-end runtimes.
+        for dstats in stats.dags:
+            dname = dstats.name
+
+            # Tracks the interarrival rates of requests to this function as
+            # perceived by the scheduler.
+            if dname not in self.arrival_times:
+                self.arrival_times[dname] = QuantileSketch()
+
+            self.arrival_times[dname].add_all(dstats.interarrival)
+
+            # Tracks how many calls to this DAG were received.
+            if dname not in self.dag_frequencies:
+                self.dag_frequencies[dname] = 0
+
+            self.dag_frequencies[dname] += dstats.call_count
+
+            # Tracks the end-to-end runtime of individual requests completed
+            # in the last epoch.
+            if dname not in self.dag_runtimes:
+                self.dag_runtimes[dname] = QuantileSketch()
+
+            self.dag_runtimes[dname].add_all(dstats.runtimes)
+
+    def add_status(self, status, received):
+        '''
+        Records a parsed ThreadStatus, unless we already have a status from the
+        same thread that was received later.
+        '''
+        key = (status.ip, status.tid)
+        previous = self.statuses.get(key)
+        if previous is not None and previous.last_seen > received:
+            return
+
+        self.statuses[key] = ExecutorStatus(status.ip, status.tid,
+                                            status.type, status.utilization,
+                                            tuple(status.functions), received)
+
+    def merge(self, other):
+        for fname, count in other.function_frequencies.items():
+            self.function_frequencies[fname] = \
+                self.function_frequencies.get(fname, 0) + count
+
+        for dname, count in other.dag_frequencies.items():
+            self.dag_frequencies[dname] = \
+                self.dag_frequencies.get(dname, 0) + count
+
+        for mine, theirs in ((self.function_runtimes,
+                              other.function_runtimes),
+                             (self.arrival_times, other.arrival_times),
+                             (self.dag_runtimes, other.dag_runtimes)):
+            for name, sketch in theirs.items():
+                if name in mine:
+                    mine[name].merge(sketch)
+                else:
+                    mine[name] = sketch
+
+        for key, status in other.statuses.items():
+            previous = self.statuses.get(key)
+            if previous is None or previous.last_seen < status.last_seen:
+                self.statuses[key] = status
+
+        for kind in other.messages:
+            self.messages[kind] = self.messages.get(kind, 0) + \
+                other.messages[kind]
+            self.times[kind] = self.times.get(kind, 0.0) + other.times[kind]
+
+
+class StatisticsShards():
+    '''
+    Spreads the parsing and aggregation of ExecutorStatistics and ThreadStatus
+    messages across a pool of worker processes, so ingestion isn't limited to
+    the one core the management server's loop runs on.
+
+    The statistics and status ports are bound by ZMQ proxies, which run in C
+    on background threads and hand the raw messages to the workers round-robin
+    without parsing them. Each worker aggregates the messages it receives into
+    an EpochSummary. At the end of each epoch, flush collects and merges the
+    workers' summaries. Summaries are mergeable, so the merged result is the
+    same no matter which worker handled which message.
+
+    If capture is True, the proxies also copy every message they forward to
+    a PULL socket in self.captures, keyed by the port it was received on, so
+    the messages can be recorded.
+    '''
+
+    def __init__(self, context, num_shards, statistics_port, status_port,
+                 capture=False):
+        self.context = context
+        self.capture = capture
+        self.num_shards = num_shards
+        self.ports = {SHARD_STATISTICS_ADDRESS: statistics_port,
+                      SHARD_STATUS_ADDRESS: status_port}
+
+        self.workers = []
+        self.controls = []
+        self.outstanding = []
+
+        self.proxies = []
+        self.proxy_controls = []
+        self.captures = {}
+
+    def start(self):
+        # We spawn rather than fork the workers, since the management server
+        # already has ZMQ and Kubernetes threads running.
+        mp = multiprocessing.get_context('spawn')
+        for i in range(self.num_shards):
+            worker = mp.Process(target=run_shard, args=(i,), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+            control = self.context.socket(zmq.PAIR)
+            control.connect(SHARD_CONTROL_ADDRESS % (i))
+            self.controls.append(control)
+            self.outstanding.append(0)
+
+        for i, (backend, port) in enumerate(self.ports.items()):
+            control_address = 'inproc://shard_proxy_%d' % (i)
+            control = self.context.socket(zmq.PAIR)
+            control.bind(control_address)
+            self.proxy_controls.append(control)
+
+            capture_address = None
+            if self.capture:
+                capture_address = SHARD_CAPTURE_ADDRESS % (i)
+                capture = self.context.socket(zmq.PULL)
+                capture.bind(capture_address)
+                self.captures[port] = capture
+
+            proxy = threading.Thread(target=self._run_proxy,
+                                     args=(port, backend, control_address,
+                                           capture_address),
+                                     daemon=True)
+            proxy.start()
+            self.proxies.append(proxy)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        '''
+        Collects the summary of the current epoch from every worker and
+        returns them merged. Workers that don't answer within the timeout are
+        skipped, and their summaries are merged into a later epoch instead.
+        '''
+        for i, control in enumerate(self.controls):
+            control.send(FLUSH)
+            self.outstanding[i] += 1
+
+        poller = zmq.Poller()
+        for control in self.controls:
+            poller.register(control, zmq.POLLIN)
+
+        summary = EpochSummary()
+        deadline = time.time() + timeout
+        while any(self.outstanding):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            for control in dict(poller.poll(timeout=remaining * 1000)):
+                i = self.controls.index(control)
+                summary.merge(pickle.loads(control.recv()))
+                self.outstanding[i] -= 1
+
+        for i, worker in enumerate(self.workers):
+            if self.outstanding[i]:
+                logging.error('Statistics shard %d did not respond (%s).' %
+                              (i, 'alive' if worker.is_alive() else 'dead'))
+
+        return summary
+
+    def stop(self):
+        for control in self.proxy_controls:
+            control.send(b'TERMINATE')
+
+        for proxy in self.proxies:
+            proxy.join()
+
+        for control in self.controls:
+            control.send(STOP)
+
+        for worker in self.workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+
+        for control in self.controls + self.proxy_controls + \
+                list(self.captures.values()):
+            control.close(linger=0)
+
+    def _run_proxy(self, port, backend_address, control_address,
+                   capture_address):
+        frontend = self.context.socket(zmq.PULL)
+        frontend.bind('tcp://*:%d' % (port))
+
+        backend = self.context.socket(zmq.PUSH)
+        backend.bind(backend_address)
+
+        control = self.context.socket(zmq.PAIR)
+        control.connect(control_address)
+
+        capture = None
+        if capture_address:
+            capture = self.context.socket(zmq.PUSH)
+            capture.connect(capture_address)
+
+        # This returns when stop sends TERMINATE on the control socket.
+        zmq.proxy_steerable(frontend, backend, capture, control)
+
+        for sckt in (frontend, backend, control, capture):
+            if sckt is not None:
+                sckt.close(linger=0)
+
+
+def run_shard(index):
+    '''
+    The main loop of a statistics worker process: aggregates the statistics
+    and statuses handed to it until it is asked to flush its summary or stop.
+    '''
+    context = zmq.Context(1)
+
+    statistics_socket = context.socket(zmq.PULL)
+    statistics_socket.connect(SHARD_STATISTICS_ADDRESS)
+
+    status_socket = context.socket(zmq.PULL)
+    status_socket.connect(SHARD_STATUS_ADDRESS)
+
+    control_socket = context.socket(zmq.PAIR)
+    control_socket.bind(SHARD_CONTROL_ADDRESS % (index))
+
+    poller = zmq.Poller()
+    poller.register(statistics_socket, zmq.POLLIN)
+    poller.register(status_socket, zmq.POLLIN)
+    poller.register(control_socket, zmq.POLLIN)
+
+    summary = EpochSummary()
+    while True:
+        socks = dict(poller.poll())
+
+        if statistics_socket in socks:
+            _drain(statistics_socket, summary, 'statistics',
+                   lambda msg: summary.add_statistics(_parse(
+                       ExecutorStatistics, msg)))
+
+        if status_socket in socks:
+            _drain(status_socket, summary, 'status',
+                   lambda msg: summary.add_status(_parse(ThreadStatus, msg),
+                                                  time.time()))
+
+        if control_socket in socks:
+            if control_socket.recv() == STOP:
+                break
+
+            control_socket.send(pickle.dumps(summary,
+                                             pickle.HIGHEST_PROTOCOL))
+            summary = EpochSummary()
+
+    context.destroy(linger=0)
+
+
+def _drain(socket, summary, kind, handle):
+    start = time.time()
+    count = 0
+    while count < SHARD_BATCH:
+        try:
+            msg = socket.recv(zmq.DONTWAIT)
+        except zmq.ZMQError:
+            break  # We've run out of messages.
+
+        handle(msg)
+        count += 1
+
+    summary.messages[kind] += count
+    summary.times[kind] += time.time() - start
+
+
+def _parse(message_type, msg):
+    message = message_type()
+    message.ParseFromString(msg)
+    return message
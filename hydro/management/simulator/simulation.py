@@ -0,0 +1,460 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+A discrete-event simulator for the management server's policies. A
+Simulation runs any BaseHydroPolicy against a SimulatedScaler on a virtual
+clock: executor nodes take boot_delay seconds to join after they are added,
+pins take pin_latency seconds to be acknowledged, and every executor thread
+serves the requests routed to it in order, one at a time. Requests arrive
+from a workload (see workload.py), and each epoch the policy sees the same
+statistics and executor statuses the management server would give it.
+
+The result of a run reports end-to-end request latency, replica counts, and
+the node-hours spent, so a policy configuration can be evaluated in seconds
+rather than on a live cluster (see sweep.py).
+'''
+
+import heapq
+import logging
+import random
+import time
+
+import numpy as np
+
+from hydro.management.policy.default_policy import EXECUTOR_REPORT_PERIOD
+from hydro.management.scaler.base_scaler import BaseScaler
+from hydro.management.scaler.default_scaler import MAX_PIN_ATTEMPTS
+from hydro.management.shards import EpochSummary
+from hydro.management.sketch import QuantileSketch
+from hydro.management.status_store import (
+    ExecutorStatus,
+    ExecutorStatusStore
+)
+from hydro.management.util import NUM_EXEC_THREADS
+from hydro.shared.proto.internal_pb2 import CPU
+
+# The state of a simulated node.
+BOOTING = 'booting'
+ACTIVE = 'active'
+DEPARTING = 'departing'
+
+
+class SimulatedThread():
+    def __init__(self, ip, tid):
+        self.ip = ip
+        self.tid = tid
+
+        # The function pinned on this thread, if any. Like Cloudburst
+        # executors, a thread accepts at most one pinned function.
+        self.function = None
+
+        # The time at which this thread finishes the requests queued on it.
+        self.busy_until = 0.0
+
+        # The time spent running requests since the last status report.
+        self.busy = 0.0
+
+    @property
+    def key(self):
+        return (self.ip, self.tid)
+
+
+class SimulatedNode():
+    def __init__(self, ip, requested):
+        self.ip = ip
+        self.state = BOOTING
+
+        # The time the node was requested, from which it is billed.
+        self.requested = requested
+
+        self.threads = [SimulatedThread(ip, tid) for tid in
+                        range(NUM_EXEC_THREADS)]
+
+
+class SimulatedScaler(BaseScaler):
+    '''
+    A scaler that acts on a Simulation rather than on executors and
+    Kubernetes. Pins are acknowledged after the simulation's pin latency and
+    are rejected by threads that already have a function pinned, in which
+    case we retry on another candidate, as the DefaultScaler does.
+    '''
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+
+        # The executor threads that have a pin in flight.
+        self.pending = set()
+
+        self.pins = 0
+        self.rejected_pins = 0
+        self.failed_pins = 0
+        self.unpins = 0
+
+    def replicate_function(self, fname, num_replicas, function_locations,
+                           cpu_executors, gpu_executors=None):
+        existing_replicas = function_locations.get(fname, ())
+        candidates = sorted(key for key in cpu_executors if key not in
+                            existing_replicas and key not in self.pending)
+
+        for _ in range(num_replicas):
+            self._dispatch(fname, candidates, function_locations, 0)
+
+    def handle_pin_responses(self):
+        return 0
+
+    def check_pin_timeouts(self):
+        pass
+
+    def dereplicate_function(self, fname, num_replicas, function_locations):
+        if num_replicas < 2:
+            return
+
+        replicas = sorted(function_locations.get(fname, ()))
+        random.shuffle(replicas)
+
+        for key in replicas[num_replicas:]:
+            self.simulation.unpin(key, fname)
+            function_locations.discard(fname, key)
+            self.unpins += 1
+
+    def depart_executors(self, ip, kind='function'):
+        self.simulation.depart_node(ip)
+        return NUM_EXEC_THREADS
+
+    def remove_departed(self, ip):
+        self.remove_vms('function', ip)
+
+    def take_gpu_demand(self):
+        # The simulated cluster has no GPU executors.
+        return 0
+
+    def add_vms(self, kind, count):
+        if kind != 'function':
+            logging.info('Ignoring request for %d %s nodes.' % (count, kind))
+            return
+
+        self.simulation.add_nodes(count)
+
+    def remove_vms(self, kind, ip):
+        self.simulation.remove_node(ip)
+
+    def _dispatch(self, fname, candidates, function_locations, attempts):
+        if attempts >= MAX_PIN_ATTEMPTS or not candidates:
+            self.failed_pins += 1
+            return
+
+        target = candidates.pop(random.randrange(len(candidates)))
+        self.pending.add(target)
+        self.simulation.schedule(self.simulation.pin_latency, self._respond,
+                                 fname, target, candidates,
+                                 function_locations, attempts + 1)
+
+    def _respond(self, fname, target, candidates, function_locations,
+                 attempts):
+        self.pending.discard(target)
+
+        if self.simulation.pin(target, fname):
+            function_locations.add(fname, target)
+            self.pins += 1
+        else:
+            self.rejected_pins += 1
+            self._dispatch(fname, candidates, function_locations, attempts)
+
+
+class Simulation():
+    '''
+    Simulates a cluster running the given workload for duration seconds,
+    scaled by an instance of policy_class, which is constructed with
+    policy_args. The cluster starts with initial_nodes executor nodes, and
+    each of the workload's functions is pinned on initial_replicas threads.
+
+    Requests are routed to a uniformly random replica of their function, so
+    queueing delay grows as the replicas of a function get busier. A request
+    to a function that has no replicas is dropped.
+    '''
+
+    def __init__(self, workload, policy_class, policy_args=None,
+                 duration=3600, initial_nodes=6, initial_replicas=1,
+                 boot_delay=120, pin_latency=.1, seed=0):
+        self.workload = workload
+        self.duration = duration
+        self.boot_delay = boot_delay
+        self.pin_latency = pin_latency
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+
+        self.now = 0.0
+        self.events = []
+        self.next_event = 0
+
+        self.nodes = {}
+        self.next_ip = 0
+
+        # Maps each function to the threads it is pinned on that can take
+        # requests.
+        self.replicas = {}
+
+        self.scaler = SimulatedScaler(self)
+        args = dict(policy_args or {})
+        args['clock'] = lambda: self.now
+        self.policy = policy_class(self.scaler, **args)
+
+        self.executor_statuses = ExecutorStatusStore()
+        self.departing_executors = {}
+        self.summary = EpochSummary()
+        self.last_arrival = {}
+
+        self.latencies = QuantileSketch()
+        self.requests = 0
+        self.dropped = 0
+        self.node_seconds = 0.0
+        self.nodes_added = 0
+        self.nodes_removed = 0
+        self.replica_samples = []
+        self.node_samples = []
+
+        for _ in range(initial_nodes):
+            node = self._create_node()
+            node.state = ACTIVE
+
+        self._place(initial_replicas)
+
+    def schedule(self, delay, callback, *args):
+        '''
+        Runs callback with args delay seconds from now on the virtual clock.
+        '''
+        heapq.heappush(self.events, (self.now + delay, self.next_event,
+                                     callback, args))
+        self.next_event += 1
+
+    def run(self):
+        '''
+        Runs the simulation to the end and returns a report of the results.
+        '''
+        # The policies and the scaler use the random module, so we seed it to
+        # make runs repeatable. This relies on them sorting any set they
+        # sample from, since the iteration order of a set of strings changes
+        # from one process to the next.
+        random.seed(self.seed)
+        start = time.time()
+
+        self.schedule(EXECUTOR_REPORT_PERIOD, self._epoch)
+        while self.events and self.events[0][0] <= self.duration:
+            when, _, callback, args = heapq.heappop(self.events)
+            self._serve(self.now, when)
+            self.now = when
+            callback(*args)
+
+        self._serve(self.now, self.duration)
+        self.now = self.duration
+
+        for node in self.nodes.values():
+            self.node_seconds += self.duration - node.requested
+
+        return self.report(time.time() - start)
+
+    def report(self, wall_time):
+        return {
+            'requests': self.requests,
+            'dropped': self.dropped,
+            'latency_p50': self.latencies.p50,
+            'latency_p99': self.latencies.p99,
+            'latency_mean': self.latencies.mean,
+            'replicas_mean': float(np.mean(self.replica_samples))
+            if self.replica_samples else 0.0,
+            'replicas_max': max(self.replica_samples, default=0),
+            'nodes_max': max(self.node_samples, default=0),
+            'node_hours': self.node_seconds / 3600,
+            'nodes_added': self.nodes_added,
+            'nodes_removed': self.nodes_removed,
+            'pins': self.scaler.pins,
+            'failed_pins': self.scaler.failed_pins,
+            'unpins': self.scaler.unpins,
+            'wall_time': wall_time
+        }
+
+    def add_nodes(self, count):
+        for _ in range(count):
+            node = self._create_node()
+            self.schedule(self.boot_delay, self._boot, node.ip)
+
+        self.nodes_added += count
+
+    def depart_node(self, ip):
+        node = self.nodes.get(ip)
+        if node is None or node.state != ACTIVE:
+            return
+
+        node.state = DEPARTING
+        for thread in node.threads:
+            if thread.function is not None:
+                self.unpin(thread.key, thread.function)
+
+        # Each thread acknowledges its departure once it has finished the
+        # requests queued on it, and the node is removed after the last one.
+        drained = max(thread.busy_until for thread in node.threads)
+        self.schedule(max(drained - self.now, 0.0), self._departed, ip)
+
+    def remove_node(self, ip):
+        node = self.nodes.pop(ip, None)
+        if node is None:
+            return
+
+        self.node_seconds += self.now - node.requested
+        self.nodes_removed += 1
+
+    def pin(self, key, fname):
+        '''
+        Pins fname on the thread with the given key, and returns whether the
+        thread accepted the pin.
+        '''
+        thread = self._get_thread(key)
+        if thread is None or thread.function is not None:
+            return False
+
+        thread.function = fname
+        if fname not in self.replicas:
+            self.replicas[fname] = []
+
+        self.replicas[fname].append(thread)
+        return True
+
+    def unpin(self, key, fname):
+        thread = self._get_thread(key)
+        if thread is None or thread.function != fname:
+            return
+
+        thread.function = None
+        self.replicas[fname].remove(thread)
+
+    def _create_node(self):
+        ip = '10.%d.%d.%d' % (self.next_ip // 65536 % 256,
+                              self.next_ip // 256 % 256, self.next_ip % 256)
+        self.next_ip += 1
+
+        node = SimulatedNode(ip, self.now)
+        self.nodes[ip] = node
+        return node
+
+    def _get_thread(self, key):
+        node = self.nodes.get(key[0])
+        if node is None or node.state != ACTIVE:
+            return None
+
+        return node.threads[key[1]]
+
+    def _place(self, initial_replicas):
+        threads = [thread for node in self.nodes.values() for thread in
+                   node.threads]
+        index = 0
+        for fname in self.workload.functions:
+            for _ in range(initial_replicas):
+                if index == len(threads):
+                    logging.warning(('Not enough executor threads to place ' +
+                                     '%d replicas of every function.') %
+                                    (initial_replicas))
+                    return
+
+                self.pin(threads[index].key, fname)
+                index += 1
+
+    def _boot(self, ip):
+        node = self.nodes.get(ip)
+        if node is not None:
+            node.state = ACTIVE
+
+    def _departed(self, ip):
+        # This is what the management server does once every thread on the
+        # node has acknowledged its departure.
+        if ip in self.departing_executors:
+            del self.departing_executors[ip]
+
+        self.scaler.remove_departed(ip)
+
+    def _serve(self, start, end):
+        '''
+        Routes the requests that arrive in [start, end) to the threads their
+        functions are pinned on. The pinned threads only change between
+        these intervals, at control events.
+        '''
+        summary = self.summary
+        for fname, (times, runtimes) in self.workload.arrivals(start,
+                                                               end).items():
+            count = len(times)
+            self.requests += count
+            summary.function_frequencies[fname] = \
+                summary.function_frequencies.get(fname, 0) + count
+
+            if fname not in summary.arrival_times:
+                summary.arrival_times[fname] = QuantileSketch()
+                summary.function_runtimes[fname] = QuantileSketch()
+                summary.dag_runtimes[fname] = QuantileSketch()
+
+            previous = self.last_arrival.get(fname)
+            interarrivals = np.diff(times)
+            if previous is not None:
+                interarrivals = np.append(times[0] - previous, interarrivals)
+            summary.arrival_times[fname].add_all(interarrivals.tolist())
+            self.last_arrival[fname] = times[-1]
+
+            threads = self.replicas.get(fname)
+            if not threads:
+                self.dropped += count
+                continue
+
+            choices = self.rng.randint(len(threads), size=count).tolist()
+            latencies = []
+            for t, runtime, choice in zip(times.tolist(), runtimes.tolist(),
+                                          choices):
+                thread = threads[choice]
+                finish = max(t, thread.busy_until) + runtime
+                thread.busy_until = finish
+                thread.busy += runtime
+                latencies.append(finish - t)
+
+            summary.function_runtimes[fname].add_all(runtimes.tolist())
+            summary.dag_runtimes[fname].add_all(latencies)
+            self.latencies.add_all(latencies)
+
+    def _epoch(self):
+        now = self.now
+        for node in self.nodes.values():
+            if node.state != ACTIVE:
+                continue
+
+            for thread in node.threads:
+                utilization = min(thread.busy / EXECUTOR_REPORT_PERIOD, 1.0)
+                thread.busy = 0.0
+
+                functions = (thread.function,) if thread.function else ()
+                self.executor_statuses.update(
+                    ExecutorStatus(node.ip, thread.tid, CPU, utilization,
+                                   functions, now), now)
+
+        summary = self.summary
+        self.policy.replica_policy(summary.function_frequencies,
+                                   summary.function_runtimes,
+                                   summary.dag_runtimes,
+                                   self.executor_statuses,
+                                   summary.arrival_times)
+        self.policy.executor_policy(self.executor_statuses,
+                                    self.departing_executors)
+        summary.clear()
+
+        self.replica_samples.append(sum(len(threads) for threads in
+                                        self.replicas.values()))
+        self.node_samples.append(len(self.nodes))
+
+        self.schedule(EXECUTOR_REPORT_PERIOD, self._epoch)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+Sweeps a grid of policy and simulation parameters through the simulator and
+prints one JSON line per configuration with its results. For example,
+
+    python3 -m hydro.management.simulator.sweep --pattern ramp \\
+        --grid max_utilization=.5,.6,.7 --grid scale_increase=2,4 \\
+        --grid boot_delay=60,120
+
+runs all 12 combinations. Parameters of Simulation (e.g., boot_delay,
+pin_latency, initial_nodes) configure the simulated cluster, and all others
+are passed to the policy. Configurations run in parallel across processes.
+'''
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+
+from hydro.management.policy.default_policy import DefaultHydroPolicy
+from hydro.management.policy.predictive_policy import PredictiveHydroPolicy
+from hydro.management.policy.slo_policy import (
+    DagSlo,
+    PredictiveSLOHydroPolicy,
+    SLOHydroPolicy
+)
+from hydro.management.policy.vectorized_policy import VectorizedHydroPolicy
+from hydro.management.simulator.simulation import Simulation
+from hydro.management.simulator.workload import (
+    PATTERNS,
+    SyntheticWorkload,
+    TraceWorkload
+)
+
+POLICIES = {
+    'default': DefaultHydroPolicy,
+    'vectorized': VectorizedHydroPolicy,
+    'predictive': PredictiveHydroPolicy,
+    'slo': SLOHydroPolicy,
+    'predictive-slo': PredictiveSLOHydroPolicy
+}
+
+SIMULATION_PARAMETERS = ('duration', 'initial_nodes', 'initial_replicas',
+                         'boot_delay', 'pin_latency', 'seed')
+
+
+def parse_value(value):
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+
+    return value
+
+
+def parse_grid(specs):
+    '''
+    Turns name=v1,v2,... specs into a list of dicts, one for each combination
+    of values.
+    '''
+    names = []
+    values = []
+    for spec in specs:
+        name, options = spec.split('=', 1)
+        names.append(name)
+        values.append([parse_value(v) for v in options.split(',')])
+
+    return [dict(zip(names, combination)) for combination in
+            itertools.product(*values)]
+
+
+def make_workload(args, seed):
+    if args.trace:
+        return TraceWorkload.load(args.trace, default_runtime=args.runtime,
+                                  seed=seed)
+
+    pattern_args = [parse_value(v) for v in args.pattern_args.split(',')] \
+        if args.pattern_args else []
+    pattern = PATTERNS[args.pattern](*pattern_args)
+
+    rates = {}
+    runtimes = {}
+    for i in range(args.functions):
+        fname = 'function-%d' % (i)
+        rates[fname] = args.rate
+        runtimes[fname] = args.runtime
+
+    return SyntheticWorkload(rates, runtimes, pattern, seed)
+
+
+def run_configuration(job):
+    args, config = job
+
+    simulation_args = {'duration': args.duration, 'seed': args.seed}
+    policy_args = {}
+    for name, value in config.items():
+        if name in SIMULATION_PARAMETERS:
+            simulation_args[name] = value
+        else:
+            policy_args[name] = value
+
+    workload = make_workload(args, simulation_args['seed'])
+
+    # Each simulated function is its own DAG, so every DAG gets the same
+    # target.
+    if args.policy in ('slo', 'predictive-slo'):
+        policy_args['slos'] = {fname: DagSlo(args.slo, (fname,)) for fname in
+                               workload.functions}
+    simulation = Simulation(workload, POLICIES[args.policy], policy_args,
+                            **simulation_args)
+
+    result = dict(config)
+    result.update(simulation.run())
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--policy', choices=sorted(POLICIES),
+                        default='default')
+    parser.add_argument('--grid', action='append', default=[],
+                        help='A parameter and the values to try, as ' +
+                        'name=v1,v2,...; may be repeated.')
+    parser.add_argument('--duration', type=float, default=3600,
+                        help='Simulated seconds per configuration.')
+    parser.add_argument('--trace', help='A CSV trace of time,function' +
+                        '[,runtime] rows to replay instead of synthetic load.')
+    parser.add_argument('--functions', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=10,
+                        help='Base requests per second to each function.')
+    parser.add_argument('--runtime', type=float, default=.1,
+                        help='Mean function runtime in seconds.')
+    parser.add_argument('--pattern', choices=sorted(PATTERNS),
+                        default='constant')
+    parser.add_argument('--pattern-args', default='',
+                        help='Comma-separated arguments to the pattern.')
+    parser.add_argument('--slo', type=float, default=1.0,
+                        help='The p99 latency target of every DAG, in ' +
+                        'seconds, for the slo policies.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show the policy\'s log messages.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else
+                        logging.WARNING)
+
+    jobs = [(args, config) for config in parse_grid(args.grid)]
+    if args.processes > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.imap(run_configuration, jobs)
+            for result in results:
+                print(json.dumps(result))
+    else:
+        for job in jobs:
+            print(json.dumps(run_configuration(job)))
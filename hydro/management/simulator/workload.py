@@ -0,0 +1,199 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import bisect
+import csv
+import math
+
+import numpy as np
+
+
+class Constant():
+    '''
+    A load pattern that keeps every function at its base request rate.
+    '''
+
+    def __call__(self, t):
+        return 1.0
+
+
+class Ramp():
+    '''
+    A load pattern that scales the base request rates linearly from start to
+    end times over the given number of seconds, and holds them there after.
+    '''
+
+    def __init__(self, start=1.0, end=10.0, length=600):
+        self.start = start
+        self.end = end
+        self.length = length
+
+    def __call__(self, t):
+        fraction = min(t / self.length, 1.0)
+        return self.start + (self.end - self.start) * fraction
+
+
+class Diurnal():
+    '''
+    A load pattern that scales the base request rates along a sine wave with
+    the given period (in seconds); the rates swing amplitude times the base
+    rate above and below it.
+    '''
+
+    def __init__(self, period=3600, amplitude=.8):
+        self.period = period
+        self.amplitude = amplitude
+
+    def __call__(self, t):
+        return max(1.0 + self.amplitude *
+                   math.sin(2 * math.pi * t / self.period), 0.0)
+
+
+class Spike():
+    '''
+    A load pattern that multiplies the base request rates by factor for
+    length seconds, starting at time at.
+    '''
+
+    def __init__(self, at=600, length=300, factor=10.0):
+        self.at = at
+        self.length = length
+        self.factor = factor
+
+    def __call__(self, t):
+        if self.at <= t < self.at + self.length:
+            return self.factor
+
+        return 1.0
+
+
+PATTERNS = {
+    'constant': Constant,
+    'ramp': Ramp,
+    'diurnal': Diurnal,
+    'spike': Spike
+}
+
+
+class SyntheticWorkload():
+    '''
+    Poisson request arrivals for a set of single-function DAGs. rates maps
+    each function to its base request rate (in requests per second), and
+    runtimes maps it to its mean runtime (in seconds); runtimes are drawn from
+    an exponential distribution. The rates are scaled over time by pattern,
+    which is called with the time in seconds and returns a multiplier.
+    '''
+
+    def __init__(self, rates, runtimes, pattern=None, seed=0):
+        self.rates = rates
+        self.runtimes = runtimes
+        self.pattern = pattern if pattern is not None else Constant()
+        self.rng = np.random.RandomState(seed)
+
+    @property
+    def functions(self):
+        return list(self.rates.keys())
+
+    def arrivals(self, start, end):
+        '''
+        Returns a map from each function to a sorted array of the times at
+        which requests to it arrive in [start, end), and an array of the
+        runtimes of those requests.
+        '''
+        length = end - start
+        if length <= 0:
+            return {}
+
+        # The intervals between control events are short relative to the
+        # load patterns, so we use the rate at the middle of each interval.
+        multiplier = self.pattern((start + end) / 2)
+
+        result = {}
+        for fname, rate in self.rates.items():
+            count = self.rng.poisson(rate * multiplier * length)
+            if count == 0:
+                continue
+
+            times = np.sort(self.rng.uniform(start, end, count))
+            runtimes = self.rng.exponential(self.runtimes[fname], count)
+            result[fname] = (times, runtimes)
+
+        return result
+
+
+class TraceWorkload():
+    '''
+    Replays recorded request arrivals. Each record is a (time, function,
+    runtime) tuple, where the time is in seconds from the start of the trace;
+    if a record's runtime is None, it is drawn from an exponential
+    distribution around the function's mean runtime in runtimes, or around
+    default_runtime for functions that aren't listed.
+    '''
+
+    def __init__(self, records, runtimes=None, default_runtime=.1, seed=0):
+        self.records = sorted(records, key=lambda record: record[0])
+        self.times = [record[0] for record in self.records]
+        self.runtimes = runtimes if runtimes is not None else {}
+        self.default_runtime = default_runtime
+        self.rng = np.random.RandomState(seed)
+
+    @staticmethod
+    def load(path, **kwargs):
+        '''
+        Reads a trace from a CSV file with a time,function[,runtime] row for
+        each request. Times may be absolute; they are shifted so the trace
+        starts at 0.
+        '''
+        records = []
+        with open(path) as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    continue
+
+                runtime = float(row[2]) if len(row) > 2 and row[2] else None
+                records.append((float(row[0]), row[1], runtime))
+
+        if records:
+            first = min(record[0] for record in records)
+            records = [(t - first, fname, runtime) for t, fname, runtime in
+                       records]
+
+        return TraceWorkload(records, **kwargs)
+
+    @property
+    def functions(self):
+        return sorted(set(record[1] for record in self.records))
+
+    @property
+    def length(self):
+        return self.times[-1] if self.times else 0.0
+
+    def arrivals(self, start, end):
+        first = bisect.bisect_left(self.times, start)
+        last = bisect.bisect_left(self.times, end)
+
+        grouped = {}
+        for t, fname, runtime in self.records[first:last]:
+            if runtime is None:
+                runtime = self.rng.exponential(
+                    self.runtimes.get(fname, self.default_runtime))
+
+            if fname not in grouped:
+                grouped[fname] = ([], [])
+
+            grouped[fname][0].append(t)
+            grouped[fname][1].append(runtime)
+
+        return {fname: (np.array(times), np.array(runtimes)) for fname,
+                (times, runtimes) in grouped.items()}
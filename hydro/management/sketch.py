@@ -0,0 +1,179 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import math
+
+# The relative error guaranteed for any quantile estimate: with the default, a
+# reported p99 of 100ms means the true p99 is between 99ms and 101ms.
+DEFAULT_RELATIVE_ACCURACY = .01
+
+# The maximum number of buckets a sketch holds. With the default accuracy,
+# this covers values across roughly 18 orders of magnitude before the
+# smallest buckets have to be collapsed together.
+DEFAULT_MAX_BUCKETS = 2048
+
+# Values smaller than this (including zero and negative values) are counted
+# in a single bucket, since they can't be placed on a logarithmic scale.
+MIN_VALUE = 1e-9
+
+
+class QuantileSketch():
+    '''
+    A mergeable, bounded-memory summary of a stream of non-negative values
+    (e.g., request runtimes or interarrival times). Values are counted in
+    logarithmically sized buckets, so every quantile estimate is within a fixed
+    relative error of the true value, and memory depends only on the range of
+    the values seen, not on how many there are. Sketches built with the same
+    accuracy can be merged, which lets us combine summaries from several
+    sources without keeping the underlying samples.
+    '''
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY,
+                 max_buckets=DEFAULT_MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+
+        self.buckets = {}
+        self.zero_count = 0
+
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.add_all((value,))
+
+    def add_all(self, values):
+        buckets = self.buckets
+        log_gamma = self.log_gamma
+
+        count = 0
+        zeros = 0
+        total = 0.0
+        low = self.min
+        high = self.max
+        for value in values:
+            count += 1
+            total += value
+
+            if value < low:
+                low = value
+            if value > high:
+                high = value
+
+            if value < MIN_VALUE:
+                zeros += 1
+            else:
+                index = math.ceil(math.log(value) / log_gamma)
+                buckets[index] = buckets.get(index, 0) + 1
+
+        self.count += count
+        self.zero_count += zeros
+        self.sum += total
+        self.min = low
+        self.max = high
+
+        if len(buckets) > self.max_buckets:
+            self._collapse()
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Cannot merge sketches with different ' +
+                             'relative accuracies.')
+
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def quantile(self, q):
+        '''
+        Returns an estimate of the q-th quantile (0 <= q <= 1) of the values
+        added so far, or None if the sketch is empty.
+        '''
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return max(self.min, 0.0)
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # The midpoint of the bucket, in the sense that it is within
+                # the relative accuracy of every value in the bucket.
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+    @property
+    def p50(self):
+        return self.quantile(.5)
+
+    @property
+    def p95(self):
+        return self.quantile(.95)
+
+    @property
+    def p99(self):
+        return self.quantile(.99)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+
+        return self.sum / self.count
+
+    def rate(self, period):
+        '''
+        The number of values added per second over a period of the given
+        length (in seconds). For a sketch of interarrival times, this is the
+        request arrival rate.
+        '''
+        return self.count / period
+
+    def clear(self):
+        self.buckets.clear()
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        return self.count
+
+    def _collapse(self):
+        # We give up accuracy on the smallest values first, since we care most
+        # about the tail of the distribution.
+        indices = sorted(self.buckets)
+        excess = len(indices) - self.max_buckets
+        target = indices[excess]
+
+        for index in indices[:excess]:
+            self.buckets[target] += self.buckets.pop(index)
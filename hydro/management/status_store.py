@@ -0,0 +1,239 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import namedtuple
+import sys
+import time
+
+import numpy as np
+
+from hydro.management.location_index import FunctionLocationIndex
+from hydro.shared.proto.internal_pb2 import CPU
+
+# The number of executor threads the store has room for before it first has to
+# grow its arrays.
+INITIAL_CAPACITY = 64
+
+# Floating point error accumulates in the running utilization sum as values
+# are added and subtracted, so we recompute it from scratch after this many
+# updates.
+RESUM_INTERVAL = 100000
+
+# A read-only view of the latest status reported by one executor thread. This
+# has the same fields as the ThreadStatus it was built from, plus the time the
+# status was received.
+ExecutorStatus = namedtuple('ExecutorStatus', ['ip', 'tid', 'type',
+                                               'utilization', 'functions',
+                                               'last_seen'])
+
+
+class ExecutorStatusStore():
+    '''
+    The latest status reported by each executor thread, keyed by (ip, tid).
+    Rather than keeping every ThreadStatus message, we keep each thread's
+    utilization, executor type, pinned function count, and last-seen time in
+    parallel arrays, indexed by a slot assigned to the thread when it first
+    reports. Pinned function names are interned, so a name pinned on many
+    threads is stored once.
+
+    The cluster-wide utilization and pin count sums, the sets of CPU and GPU
+    executors, and the index of where each function is pinned are maintained
+    on every update, so the policies can read cluster-wide averages and
+    function locations without iterating over every executor.
+
+    Lookups return ExecutorStatus views, and the store supports len, in,
+    iteration over keys, and deletion by key like the dictionary it replaces.
+    gpu_functions names the functions known to need a GPU (see
+    FunctionLocationIndex).
+    '''
+
+    def __init__(self, capacity=INITIAL_CAPACITY, gpu_functions=()):
+        self.slots = {}
+        self.free_slots = []
+
+        self.keys_by_slot = [None] * capacity
+        self.functions = [()] * capacity
+        self.utilization = np.zeros(capacity)
+        self.types = np.zeros(capacity, dtype=np.int8)
+        self.pin_counts = np.zeros(capacity, dtype=np.int32)
+        self.last_seen = np.zeros(capacity)
+
+        self.cpu_executors = set()
+        self.gpu_executors = set()
+        self.locations = FunctionLocationIndex(gpu_functions)
+
+        self.utilization_sum = 0.0
+        self.pinned_count_sum = 0
+        self.updates = 0
+
+    def update(self, status, now=None):
+        '''
+        Records a ThreadStatus reported by an executor thread, replacing the
+        previous status reported by the same thread, if any.
+        '''
+        if now is None:
+            now = time.time()
+
+        key = (sys.intern(status.ip), status.tid)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        else:
+            self.utilization_sum -= self.utilization[slot]
+            self.pinned_count_sum -= int(self.pin_counts[slot])
+
+        functions = tuple(sys.intern(fname) for fname in status.functions)
+
+        self.functions[slot] = functions
+        self.utilization[slot] = status.utilization
+        self.types[slot] = status.type
+        self.pin_counts[slot] = len(functions)
+        self.last_seen[slot] = now
+        self.locations.set_executor_type(key, status.type != CPU)
+        self.locations.set_functions(key, functions)
+
+        self.utilization_sum += status.utilization
+        self.pinned_count_sum += len(functions)
+
+        if status.type == CPU:
+            self.gpu_executors.discard(key)
+            self.cpu_executors.add(key)
+        else:
+            self.cpu_executors.discard(key)
+            self.gpu_executors.add(key)
+
+        self.updates += 1
+        if self.updates % RESUM_INTERVAL == 0:
+            self._resum()
+
+    def remove(self, key):
+        slot = self.slots.pop(key)
+
+        self.utilization_sum -= self.utilization[slot]
+        self.pinned_count_sum -= int(self.pin_counts[slot])
+
+        self.cpu_executors.discard(key)
+        self.gpu_executors.discard(key)
+        self.locations.remove_executor(key)
+
+        self.keys_by_slot[slot] = None
+        self.functions[slot] = ()
+        self.utilization[slot] = 0.0
+        self.pin_counts[slot] = 0
+        self.last_seen[slot] = 0.0
+        self.free_slots.append(slot)
+
+        if not self.slots:
+            # Resets any floating point error left over from removals.
+            self.utilization_sum = 0.0
+
+    def get(self, key, default=None):
+        slot = self.slots.get(key)
+        if slot is None:
+            return default
+
+        return self._view(slot)
+
+    def average_utilization(self):
+        if not self.slots:
+            return 0.0
+
+        return self.utilization_sum / len(self.slots)
+
+    def average_pinned_count(self):
+        if not self.slots:
+            return 0.0
+
+        return self.pinned_count_sum / len(self.slots)
+
+    def get_overloaded(self, threshold):
+        '''
+        Returns the statuses of the executor threads whose utilization is
+        above the threshold.
+        '''
+        slots = np.flatnonzero(self.utilization > threshold)
+        return [self._view(slot) for slot in slots]
+
+    def get_stale(self, timeout, now=None):
+        '''
+        Returns the keys of the executor threads that have not reported a
+        status in the last timeout seconds.
+        '''
+        if now is None:
+            now = time.time()
+
+        slots = np.flatnonzero(self.last_seen < now - timeout)
+        return [self.keys_by_slot[slot] for slot in slots if
+                self.keys_by_slot[slot] is not None]
+
+    def keys(self):
+        return self.slots.keys()
+
+    def values(self):
+        return [self._view(slot) for slot in self.slots.values()]
+
+    def items(self):
+        return [(key, self._view(slot)) for key, slot in self.slots.items()]
+
+    def __getitem__(self, key):
+        return self._view(self.slots[key])
+
+    def __delitem__(self, key):
+        self.remove(key)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _view(self, slot):
+        ip, tid = self.keys_by_slot[slot]
+        return ExecutorStatus(ip, tid, int(self.types[slot]),
+                              float(self.utilization[slot]),
+                              self.functions[slot],
+                              float(self.last_seen[slot]))
+
+    def _allocate(self, key):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = len(self.slots)
+            if slot == len(self.keys_by_slot):
+                self._grow()
+
+        self.slots[key] = slot
+        self.keys_by_slot[slot] = key
+        return slot
+
+    def _grow(self):
+        # We double the arrays so that adding threads costs amortized
+        # constant time.
+        old_size = len(self.keys_by_slot)
+        size = 2 * old_size
+
+        self.keys_by_slot.extend([None] * old_size)
+        self.functions.extend([()] * old_size)
+        for name in ('utilization', 'types', 'pin_counts', 'last_seen'):
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            new[:old_size] = old
+            setattr(self, name, new)
+
+    def _resum(self):
+        # Free slots are zeroed, so they don't contribute to the sum.
+        self.utilization_sum = float(self.utilization.sum())
@@ -12,10 +12,21 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections import OrderedDict
+import threading
+
 import zmq
 
 NUM_EXEC_THREADS = 3
 
+# GPU nodes run a single executor thread, which has the node's GPU to itself
+# (see gpu-ds.yml).
+NUM_GPU_EXEC_THREADS = 1
+
+# The maximum number of PUSH sockets that are kept open by a SocketPool before
+# the least recently used one is closed.
+SOCKET_POOL_CAPACITY = 1024
+
 TCP_BASE = 'tcp://%s:%d'
 
 EXECUTOR_DEPART_PORT = 4050
@@ -28,14 +39,100 @@ ROUTING_NOTIFY_PORT = 6400
 MONITORING_NOTIFY_PORT = 6600
 
 
+class SocketPool():
+    '''
+    A bounded cache of connected PUSH sockets, keyed by address. When the pool
+    is full, the least recently used socket is closed to make room for the new
+    one. The pool keeps counters of hits, misses, and evictions so that we can
+    tell whether it is sized appropriately for the cluster.
+    '''
+
+    def __init__(self, context, capacity=SOCKET_POOL_CAPACITY):
+        self.context = context
+        self.capacity = capacity
+        self.sockets = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, address):
+        if address in self.sockets:
+            self.hits += 1
+            self.sockets.move_to_end(address)
+            return self.sockets[address]
+
+        self.misses += 1
+        if len(self.sockets) >= self.capacity:
+            _, evicted = self.sockets.popitem(last=False)
+            evicted.close()
+            self.evictions += 1
+
+        socket = self.context.socket(zmq.PUSH)
+        socket.connect(address)
+        self.sockets[address] = socket
+
+        return socket
+
+    def send(self, message, address):
+        socket = self.get(address)
+
+        if type(message) == str:
+            socket.send_string(message)
+        else:
+            socket.send(message)
+
+    def send_batch(self, messages):
+        '''
+        Sends each message in an iterable of (address, message) pairs. Messages
+        to the same address reuse the same socket, so a batch that fans out a
+        single notification to many threads only pays for each connection
+        once.
+        '''
+        count = 0
+        for address, message in messages:
+            self.send(message, address)
+            count += 1
+
+        return count
+
+    def stats(self):
+        return {
+            'size': len(self.sockets),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def close(self):
+        for socket in self.sockets.values():
+            socket.close()
+
+        self.sockets.clear()
+
+
+# There is one shared pool per ZMQ context, so the policy, the scaler, and the
+# hash ring checks all reuse the same connections. ZMQ sockets can't be shared
+# across threads, so each thread gets its own set of pools.
+socket_pools = threading.local()
+
+
+def get_socket_pool(context):
+    if not hasattr(socket_pools, 'pools'):
+        socket_pools.pools = {}
+
+    if context not in socket_pools.pools:
+        socket_pools.pools[context] = SocketPool(context)
+
+    return socket_pools.pools[context]
+
+
 def send_message(context, message, address):
-    socket = context.socket(zmq.PUSH)
-    socket.connect(address)
-    
-    if type(message) == str:
-        socket.send_string(message)
-    else:
-        socket.send(message)
+    get_socket_pool(context).send(message, address)
+
+
+def send_messages(context, messages):
+    return get_socket_pool(context).send_batch(messages)
 
 
 def get_executor_depart_address(ip, tid):
@@ -0,0 +1,398 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+An in-memory stand-in for the parts of the Kubernetes CoreV1Api (and its watch
+streams) that the cluster and management code use. This lets us exercise the
+pod cache and the management server without a real cluster: pods are added,
+updated, and deleted directly on the FakeCoreV1Api, and every change is
+delivered to open FakeWatch streams just like the API server would. Nodes can
+be listed, read, and patched, but not watched.
+
+Run as a module with --check-pod-cache, this drives a PodCache through a fake
+watch and checks its indexes after each event.
+'''
+
+import argparse
+import json
+import queue
+import re
+import sys
+import threading
+from types import SimpleNamespace
+
+from hydro.shared.pod_cache import PodCache
+from hydro.shared.wait import wait_until
+
+# How long (in seconds) check_pod_cache waits for the cache to see each event.
+CHECK_TIMEOUT = 5
+
+
+def make_pod(name, role, ip=None, phase='Running', restart_count=0,
+             containers=('container',), node_name=None):
+    containers = [SimpleNamespace(name=cname) for cname in containers]
+    container_statuses = [SimpleNamespace(name=c.name,
+                                          restart_count=restart_count)
+                          for c in containers]
+
+    return SimpleNamespace(
+        metadata=SimpleNamespace(name=name, labels={'role': role},
+                                 resource_version=None),
+        spec=SimpleNamespace(containers=containers, node_name=node_name),
+        status=SimpleNamespace(pod_ip=ip, phase=phase,
+                               container_statuses=container_statuses))
+
+
+def make_node(name, labels, ip, taints=(), ready=True):
+    taints = [SimpleNamespace(key=key, value=value, effect=effect)
+              for key, value, effect in taints]
+
+    return SimpleNamespace(
+        metadata=SimpleNamespace(name=name, labels=dict(labels)),
+        spec=SimpleNamespace(taints=taints or None),
+        status=SimpleNamespace(
+            addresses=[SimpleNamespace(type='InternalIP', address=ip)],
+            conditions=[SimpleNamespace(type='Ready', status=str(ready))]))
+
+
+class FakeCoreV1Api():
+    def __init__(self, pods=()):
+        self.lock = threading.Lock()
+        self.pods = {}
+        self.nodes = {}
+        self.version = 0
+        self.watchers = []
+
+        # Every event published so far, so that watches started from an older
+        # resource version see the changes they missed.
+        self.history = []
+
+        # Counts the calls made to each API method, so callers can check how
+        # many round trips they would have made to a real API server.
+        self.calls = {}
+
+        for pod in pods:
+            self.add_pod(pod)
+
+    def list_namespaced_pod(self, namespace, label_selector=None,
+                            field_selector=None, **kwargs):
+        self._count('list_namespaced_pod')
+
+        with self.lock:
+            items = [pod for pod in self.pods.values()
+                     if _matches(pod, label_selector, field_selector)]
+            version = str(self.version)
+
+        return SimpleNamespace(items=items,
+                               metadata=SimpleNamespace(
+                                   resource_version=version))
+
+    def read_namespaced_pod(self, name, namespace, **kwargs):
+        self._count('read_namespaced_pod')
+
+        with self.lock:
+            return self.pods[name]
+
+    def list_node(self, label_selector=None, **kwargs):
+        self._count('list_node')
+
+        with self.lock:
+            items = [node for node in self.nodes.values()
+                     if _matches(node, label_selector, None)]
+
+        return SimpleNamespace(items=items)
+
+    def read_node(self, name, **kwargs):
+        self._count('read_node')
+
+        with self.lock:
+            return self.nodes[name]
+
+    def patch_node(self, name, body, **kwargs):
+        '''
+        Applies a patch to a node's taints, the only field we patch.
+        '''
+        self._count('patch_node')
+
+        taints = body.get('spec', {}).get('taints')
+        with self.lock:
+            node = self.nodes[name]
+            if taints is not None:
+                node.spec.taints = [SimpleNamespace(**taint) for taint in
+                                    taints] or None
+
+        return node
+
+    def add_node(self, node):
+        with self.lock:
+            self.nodes[node.metadata.name] = node
+
+    def remove_node(self, name):
+        with self.lock:
+            self.nodes.pop(name, None)
+
+    def add_pod(self, pod):
+        self._publish('ADDED', pod)
+
+    def update_pod(self, pod):
+        self._publish('MODIFIED', pod)
+
+    def delete_pod(self, name):
+        with self.lock:
+            pod = self.pods[name]
+
+        self._publish('DELETED', pod)
+
+    def expire_watches(self):
+        '''
+        Simulates the API server compacting away the resource version that
+        every open watch is reading from.
+        '''
+        event = {'type': 'ERROR', 'object': None,
+                 'raw_object': {'code': 410, 'message': 'Expired'}}
+
+        with self.lock:
+            for watcher in self.watchers:
+                watcher.put(event)
+
+    def _publish(self, event_type, pod):
+        with self.lock:
+            self.version += 1
+            pod.metadata.resource_version = str(self.version)
+
+            if event_type == 'DELETED':
+                self.pods.pop(pod.metadata.name, None)
+            else:
+                self.pods[pod.metadata.name] = pod
+
+            event = {'type': event_type, 'object': pod}
+            self.history.append((self.version, event))
+            for watcher in self.watchers:
+                watcher.put(event)
+
+    def _count(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+
+class FakeWatch():
+    '''
+    A drop-in replacement for kubernetes.watch.Watch that streams the events
+    published on a FakeCoreV1Api.
+    '''
+
+    def __init__(self):
+        self.events = None
+        self.stopped = False
+
+    def stream(self, func, resource_version=None, timeout_seconds=None,
+               label_selector=None, field_selector=None, **kwargs):
+        client = func.__self__
+        self.events = queue.Queue()
+
+        with client.lock:
+            if resource_version is not None:
+                for version, event in client.history:
+                    if version > int(resource_version):
+                        self.events.put(event)
+
+            client.watchers.append(self.events)
+
+        try:
+            while not self.stopped:
+                try:
+                    event = self.events.get(timeout=timeout_seconds)
+                except queue.Empty:
+                    return
+
+                if event is None:
+                    return
+
+                # Like the API server, we only stream the changes to objects
+                # that match the selectors.
+                obj = event['object']
+                if obj is not None and not _matches(obj, label_selector,
+                                                    field_selector):
+                    continue
+
+                yield event
+        finally:
+            with client.lock:
+                client.watchers.remove(self.events)
+
+    def stop(self):
+        self.stopped = True
+        if self.events:
+            self.events.put(None)
+
+
+def _matches(pod, label_selector, field_selector):
+    if label_selector:
+        # Requirements are either key=value or key in (value,...).
+        for requirement in re.findall(r'[^,(]+(?:\([^)]*\))?',
+                                      label_selector):
+            match = re.match(r'\s*(\S+)\s+in\s+\((.*)\)', requirement)
+            if match:
+                key = match.group(1)
+                values = [value.strip() for value in
+                          match.group(2).split(',')]
+            else:
+                key, _, value = requirement.partition('=')
+                key, values = key.strip(), [value.strip()]
+
+            if pod.metadata.labels.get(key) not in values:
+                return False
+
+    if field_selector:
+        for requirement in field_selector.split(','):
+            key, _, value = requirement.partition('=')
+            if key.strip() == 'status.podIP' and \
+                    pod.status.pod_ip != value.strip():
+                return False
+            if key.strip() == 'metadata.name' and \
+                    pod.metadata.name != value.strip():
+                return False
+
+    return True
+
+
+def check_pod_cache():
+    '''
+    Starts a PodCache on a fake client, then adds, modifies, and deletes pods,
+    expires the watch after a deletion the cache never saw, and invalidates a
+    pod by IP. Returns the cache's role and phase index, its IP index, the
+    function IPs it hands out, and its resync count after each step, along
+    with the values we expect.
+    '''
+    client = FakeCoreV1Api([make_pod('f0', 'function', '10.0.0.1'),
+                            make_pod('f1', 'function', '10.0.0.2'),
+                            make_pod('s0', 'scheduler', '10.0.1.1')])
+    cache = PodCache(client, watch_factory=FakeWatch)
+    cache.start()
+
+    steps = []
+
+    def settle():
+        wait_until(lambda: cache.resource_version == str(client.version),
+                   'the pod cache to catch up', timeout=CHECK_TIMEOUT)
+
+    def record(step):
+        with cache.lock:
+            roles = {role: {phase: sorted(names) for phase, names in
+                            phases.items()}
+                     for role, phases in cache.roles.items() if phases}
+            ips = dict(cache.ips)
+
+        steps.append({
+            'step': step,
+            'roles': roles,
+            'ips': ips,
+            'function': sorted(cache.get_pod_ips('role=function')),
+            'running': sorted(cache.get_pod_ips('role=function',
+                                                is_running=True)),
+            'resyncs': cache.resyncs
+        })
+
+    try:
+        record('start')
+
+        client.add_pod(make_pod('f2', 'function', phase='Pending'))
+        settle()
+        record('added')
+
+        # The API server sends a new object with every change, rather than
+        # mutating the one we already have.
+        client.update_pod(make_pod('f2', 'function', '10.0.0.3'))
+        settle()
+        record('modified')
+
+        client.delete_pod('f0')
+        settle()
+        record('deleted')
+
+        # A deletion that was compacted away before the watch saw it; only a
+        # resync will drop f1.
+        with client.lock:
+            client.pods.pop('f1')
+        client.expire_watches()
+        wait_until(lambda: cache.resyncs > 1, 'the pod cache to resync',
+                   timeout=CHECK_TIMEOUT)
+        record('expired')
+
+        # The watch picks up again from where the resync left off.
+        client.add_pod(make_pod('f3', 'function', '10.0.0.4'))
+        settle()
+        record('rewatched')
+
+        cache.invalidate(ip='10.0.0.3')
+        record('invalidated')
+    finally:
+        cache.stop()
+
+    expected = [
+        _expected_step('start', {'Running': ['f0', 'f1']},
+                       {'10.0.0.1': 'f0', '10.0.0.2': 'f1'}, 1),
+        _expected_step('added', {'Pending': ['f2'], 'Running': ['f0', 'f1']},
+                       {'10.0.0.1': 'f0', '10.0.0.2': 'f1'}, 1),
+        _expected_step('modified', {'Running': ['f0', 'f1', 'f2']},
+                       {'10.0.0.1': 'f0', '10.0.0.2': 'f1',
+                        '10.0.0.3': 'f2'}, 1),
+        _expected_step('deleted', {'Running': ['f1', 'f2']},
+                       {'10.0.0.2': 'f1', '10.0.0.3': 'f2'}, 1),
+        _expected_step('expired', {'Running': ['f2']}, {'10.0.0.3': 'f2'},
+                       2),
+        _expected_step('rewatched', {'Running': ['f2', 'f3']},
+                       {'10.0.0.3': 'f2', '10.0.0.4': 'f3'}, 2),
+        _expected_step('invalidated', {'Running': ['f3']},
+                       {'10.0.0.4': 'f3'}, 2)
+    ]
+
+    return {
+        'steps': steps,
+        'expected': expected,
+        'passed': steps == expected
+    }
+
+
+def _expected_step(step, function_phases, function_ips, resyncs):
+    # The scheduler pod is never touched, so it stays in every step, and the
+    # only pod that is ever pending has no IP yet, so every function IP is
+    # also a running one.
+    ips = dict(function_ips)
+    ips['10.0.1.1'] = 's0'
+
+    return {
+        'step': step,
+        'roles': {'function': function_phases,
+                  'scheduler': {'Running': ['s0']}},
+        'ips': ips,
+        'function': sorted(function_ips),
+        'running': sorted(function_ips),
+        'resyncs': resyncs
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--check-pod-cache', action='store_true',
+                        help='Check the indexes a PodCache keeps as pods ' +
+                        'are added, modified, and deleted, and after its ' +
+                        'watch expires, and exit.')
+    args = parser.parse_args()
+
+    if args.check_pod_cache:
+        result = check_pod_cache()
+        print(json.dumps(result))
+        sys.exit(0 if result['passed'] else 1)
+
+    parser.print_help()
@@ -0,0 +1,278 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import threading
+import time
+
+import kubernetes as k8s
+
+from hydro.shared import util
+
+# How long (in seconds) a single watch request stays open before we reconnect
+# from the last resource version we saw.
+WATCH_TIMEOUT = 300
+
+# How long to wait before reconnecting after the watch fails unexpectedly.
+WATCH_RETRY_DELAY = 1
+
+# The status code the API server returns when the resource version we are
+# watching from has been compacted away.
+WATCH_EXPIRED = 410
+
+
+class PodCache():
+    '''
+    An in-memory view of the pods in a namespace, kept up to date by a
+    Kubernetes watch stream that runs on a background thread. Pods are indexed
+    by their role label and their phase, and by their IP address, so
+    membership and restart count queries from the management server are
+    answered without a round trip to the API server.
+
+    If the watch expires (the API server has compacted the resource version we
+    were watching from), the cache resyncs with a full listing and resumes
+    watching from there.
+    '''
+
+    def __init__(self, client, namespace=util.NAMESPACE, watch_factory=None):
+        self.client = client
+        self.namespace = namespace
+        self.watch_factory = watch_factory or k8s.watch.Watch
+
+        self.lock = threading.Lock()
+
+        # Maps each pod name to the latest version of the pod we have seen.
+        self.pods = {}
+
+        # Maps each role to a map from phase to the names of the pods with
+        # that role in that phase.
+        self.roles = {}
+
+        # Maps each pod name to the (role, phase) it is indexed under.
+        self.index_keys = {}
+
+        # Maps each pod IP to the name of the pod that currently owns it, and
+        # each pod name to its restart count.
+        self.ips = {}
+        self.restart_counts = {}
+
+        self.resource_version = None
+        self.resyncs = 0
+
+        self.running = False
+        self.watch = None
+        self.thread = None
+
+    def start(self):
+        self.resync()
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.watch:
+            self.watch.stop()
+
+    def resync(self):
+        pod_list = self.client.list_namespaced_pod(namespace=self.namespace)
+
+        with self.lock:
+            self.pods = {}
+            self.roles = {}
+            self.index_keys = {}
+            self.ips = {}
+            self.restart_counts = {}
+            for pod in pod_list.items:
+                self._add(pod)
+
+            self.resource_version = pod_list.metadata.resource_version
+            self.resyncs += 1
+
+    def apply_event(self, event_type, pod):
+        with self.lock:
+            self._remove(pod.metadata.name)
+
+            if event_type != 'DELETED':
+                self._add(pod)
+
+            if pod.metadata.resource_version:
+                self.resource_version = pod.metadata.resource_version
+
+    def get_pod_ips(self, selector, is_running=False):
+        '''
+        Returns the IPs of the pods that match the role selector. Unlike
+        util.get_pod_ips, this never blocks: pods that have not been assigned
+        an IP yet are skipped, and if is_running is set, so are pods that are
+        not yet in the Running phase.
+        '''
+        role = _parse_role(selector)
+        if role is None:
+            return util.get_pod_ips(self.client, selector, is_running)
+
+        with self.lock:
+            phases = self.roles.get(role, {})
+            if is_running:
+                names = list(phases.get('Running', ()))
+            else:
+                names = [name for pods in phases.values() for name in pods]
+
+            ips = [self.pods[name].status.pod_ip for name in names]
+
+        return [ip for ip in ips if ip is not None]
+
+    def get_previous_count(self, kind, excluded_nodes=()):
+        with self.lock:
+            return len([name for pods in self.roles.get(kind, {}).values()
+                        for name in pods if self.pods[name].spec.node_name
+                        not in excluded_nodes])
+
+    def get_pod_from_ip(self, ip):
+        with self.lock:
+            if ip in self.ips:
+                return self.pods[self.ips[ip]]
+
+        # We might not have seen this pod yet if it was only just scheduled,
+        # so we fall back to asking the API server for it directly.
+        pod = util.get_pod_from_ip(self.client, ip)
+        with self.lock:
+            self._remove(pod.metadata.name)
+            self._add(pod)
+
+        return pod
+
+    def get_restart_count(self, ip):
+        pod = self.get_pod_from_ip(ip)
+        with self.lock:
+            return self.restart_counts.get(pod.metadata.name,
+                                           _get_restart_count(pod))
+
+    def invalidate(self, ip=None, name=None):
+        '''
+        Drops a pod from the cache, by IP or by name, without waiting for the
+        watch to report that it was deleted. This is used when we delete or
+        reschedule a pod ourselves and don't want to hand out its stale IP in
+        the meantime.
+        '''
+        with self.lock:
+            if name is None:
+                name = self.ips.get(ip)
+
+            if name is not None:
+                self._remove(name)
+
+    def _add(self, pod):
+        name = pod.metadata.name
+        self.pods[name] = pod
+
+        role = _get_role(pod)
+        phase = pod.status.phase
+        self.roles.setdefault(role, {}).setdefault(phase, set()).add(name)
+        self.index_keys[name] = (role, phase)
+
+        if pod.status.pod_ip:
+            self.ips[pod.status.pod_ip] = name
+        self.restart_counts[name] = _get_restart_count(pod)
+
+    def _remove(self, name):
+        if name not in self.pods:
+            return
+
+        pod = self.pods.pop(name)
+        role, phase = self.index_keys.pop(name)
+        del self.restart_counts[name]
+
+        # If the pod was rescheduled, its old IP may already belong to a
+        # different pod, in which case we leave that mapping alone.
+        ip = pod.status.pod_ip
+        if ip and self.ips.get(ip) == name:
+            del self.ips[ip]
+        phases = self.roles[role]
+
+        names = phases[phase]
+        names.discard(name)
+        if not names:
+            del phases[phase]
+
+    def _run(self):
+        while self.running:
+            try:
+                self._watch()
+            except k8s.client.rest.ApiException as e:
+                if e.status == WATCH_EXPIRED:
+                    logging.info('Pod watch expired, resyncing...')
+                else:
+                    logging.error('Pod watch failed: %s' % (e.reason))
+                    time.sleep(WATCH_RETRY_DELAY)
+
+                self._resync_safely()
+            except Exception as e:
+                logging.error('Unexpected error in pod watch: %s' % (str(e)))
+                time.sleep(WATCH_RETRY_DELAY)
+                self._resync_safely()
+
+    def _watch(self):
+        self.watch = self.watch_factory()
+        stream = self.watch.stream(self.client.list_namespaced_pod,
+                                   namespace=self.namespace,
+                                   resource_version=self.resource_version,
+                                   timeout_seconds=WATCH_TIMEOUT)
+
+        for event in stream:
+            if not self.running:
+                break
+
+            if event['type'] == 'ERROR':
+                raw = event.get('raw_object') or {}
+                if raw.get('code') == WATCH_EXPIRED:
+                    logging.info('Pod watch expired, resyncing...')
+                else:
+                    logging.error('Pod watch returned an error: %s' %
+                                  (raw.get('message')))
+                    time.sleep(WATCH_RETRY_DELAY)
+
+                self._resync_safely()
+                break
+
+            self.apply_event(event['type'], event['object'])
+
+    def _resync_safely(self):
+        try:
+            self.resync()
+        except Exception as e:
+            logging.error('Unable to resync pod cache: %s' % (str(e)))
+            time.sleep(WATCH_RETRY_DELAY)
+
+
+def _get_restart_count(pod):
+    if not pod.status.container_statuses:
+        return 0
+
+    return pod.status.container_statuses[0].restart_count
+
+
+def _get_role(pod):
+    labels = pod.metadata.labels or {}
+    return labels.get('role')
+
+
+def _parse_role(selector):
+    # We only index on the role label; any other selector falls back to
+    # querying the API server directly.
+    key, sep, value = selector.partition('=')
+    if sep and key.strip() == 'role' and ',' not in value:
+        return value.strip()
+
+    return None
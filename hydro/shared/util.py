@@ -12,15 +12,21 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 import os
 import subprocess
 import sys
 import tarfile
-from tempfile import TemporaryFile
+import time
 import yaml
 
 import kubernetes as k8s
 from kubernetes.stream import stream
+from kubernetes.stream.ws_client import STDIN_CHANNEL
+
+from hydro.shared import wait
 
 NAMESPACE = 'default'
 
@@ -78,86 +84,177 @@ def check_or_get_env_arg(arg_name):
     return os.environ[arg_name]
 
 
-def get_pod_ips(client, selector, is_running=False):
-    pod_list = client.list_namespaced_pod(namespace=NAMESPACE,
-                                          label_selector=selector).items
-
-    pod_ips = list(map(lambda pod: pod.status.pod_ip, pod_list))
-    running = False
-    while None in pod_ips or not running:
-        pod_list = client.list_namespaced_pod(namespace=NAMESPACE,
-                                              label_selector=selector).items
-
-        pod_ips = list(map(lambda pod: pod.status.pod_ip, pod_list))
-
-        if is_running:
-            pod_statuses = list(filter(
-                  lambda pod: pod.status.phase != 'Running', pod_list))
-            running = len(pod_statuses) == 0
-        else:
-            running = True
-
-    return pod_ips
+def get_pod_ips(client, selector, is_running=False, timeout=None):
+    # Blocks until every matching pod has an IP address (and is running, if
+    # is_running is set), watching the pods rather than re-listing them.
+    return wait.wait_for_pods(client, NAMESPACE, selector, running=is_running,
+                              timeout=timeout)
 
 
-def get_previous_count(client, kind):
+def get_previous_count(client, kind, excluded_nodes=()):
+    # Pods on the nodes in excluded_nodes (e.g., the warm pool's) aren't
+    # counted.
     selector = 'role=%s' % (kind)
     items = client.list_namespaced_pod(namespace=NAMESPACE,
                                        label_selector=selector).items
-    return len(items)
+    return len([pod for pod in items if pod.spec.node_name not in
+                excluded_nodes])
 
 
 def get_pod_from_ip(client, ip):
-    pods = client.list_namespaced_pod(namespace=NAMESPACE).items
+    # Let the API server do the filtering rather than listing every pod in the
+    # namespace.
+    pods = client.list_namespaced_pod(namespace=NAMESPACE,
+                                      field_selector='status.podIP=%s' %
+                                      (ip)).items
     pod = list(filter(lambda pod: pod.status.pod_ip == ip, pods))[0]
     return pod
 
 
-def get_service_address(client, svc_name):
+def get_service_address(client, svc_name, timeout=None):
     try:
-        service = client.read_namespaced_service(namespace=NAMESPACE,
-                                                 name=svc_name)
+        client.read_namespaced_service(namespace=NAMESPACE, name=svc_name)
     except k8s.client.rest.ApiException:
         return None
 
-    while service.status.load_balancer.ingress is None or \
-            service.status.load_balancer.ingress[0].hostname is None:
-        service = client.read_namespaced_service(namespace=NAMESPACE,
-                                                 name=svc_name)
+    # The load balancer can take a few minutes to get a hostname.
+    return wait.wait_for_service_address(client, NAMESPACE, svc_name,
+                                         timeout)
+
+
+# The number of pods we copy files into at once.
+COPY_WORKERS = 16
+
+# How long (in seconds) we wait for tar to unpack an archive in a pod.
+COPY_TIMEOUT = 60
+
+# The result of copying an archive into one container of a pod: whether it
+# succeeded, the error if it didn't, and how long (in seconds) it took.
+CopyResult = namedtuple('CopyResult', ['pod', 'container', 'success',
+                                       'error', 'elapsed'])
 
-    return service.status.load_balancer.ingress[0].hostname
+
+def make_archive(files):
+    '''
+    Builds an uncompressed tar archive in memory from a list of (path,
+    arcname) pairs, and returns its bytes. The archive is unpacked relative
+    to the directory it is copied into, so arcnames may include directories.
+    '''
+    buf = BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for path, arcname in files:
+            tar.add(path, arcname=arcname)
+
+    return buf.getvalue()
 
 
 # from https://github.com/aogier/k8s-client-python/
 # commmit: 12f1443895e80ee24d689c419b5642de96c58cc8/
 # file: examples/exec.py line 101
-def copy_file_to_pod(client, file_path, pod_name, pod_path, container):
-    exec_command = ['tar', 'xmvf', '-', '-C', pod_path]
+def copy_archive_to_pod(client, archive, pod_name, pod_path, container):
+    '''
+    Unpacks a tar archive (as bytes) into pod_path in a container of a pod,
+    and returns an error message, or None if it succeeded. The archive is
+    written as raw bytes, so binary files are copied intact. We only report
+    success once tar has exited with status 0, and raise a WaitTimeout if it
+    hasn't exited after COPY_TIMEOUT seconds.
+    '''
+    exec_command = ['tar', 'xmf', '-', '-C', pod_path]
     resp = stream(client.connect_get_namespaced_pod_exec, pod_name, NAMESPACE,
                   command=exec_command,
                   stderr=True, stdin=True,
                   stdout=True, tty=False,
                   _preload_content=False, container=container)
 
-    filename = file_path.split('/')[-1]
-    with TemporaryFile() as tar_buffer:
-        with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
-            tar.add(file_path, arcname=filename)
+    deadline = wait.Deadline('tar in %s (%s)' % (pod_name, container),
+                             COPY_TIMEOUT)
+    errors = []
+    try:
+        resp.write_stdin(archive)
 
-        tar_buffer.seek(0)
-        commands = [str(tar_buffer.read(), 'utf-8')]
+        # tar exits once it reads the end of the archive, but we also close
+        # its stdin where the client supports it, in case it reads on.
+        if hasattr(resp, 'close_channel'):
+            resp.close_channel(STDIN_CHANNEL)
 
         while resp.is_open():
             resp.update(timeout=1)
             if resp.peek_stdout():
-                pass
+                resp.read_stdout()
             if resp.peek_stderr():
-                print("Unexpected error while copying files: %s" %
-                      (resp.read_stderr()))
-                sys.exit(1)
-            if commands:
-                c = commands.pop(0)
-                resp.write_stdin(c)
-            else:
-                break
+                errors.append(resp.read_stderr())
+            deadline.remaining()
+
+        try:
+            returncode = resp.returncode
+        except (TypeError, KeyError, IndexError, ValueError):
+            # The error channel didn't carry tar's exit status.
+            returncode = None
+    finally:
         resp.close()
+
+    if returncode == 0:
+        return None
+
+    error = ''.join(errors).strip()
+    if returncode is None:
+        return error or 'tar exited without reporting a status'
+
+    return error or 'tar exited with status %d' % (returncode)
+
+
+def copy_archive_to_pods(client, archive, targets, workers=COPY_WORKERS):
+    '''
+    Copies a tar archive (as bytes) into many pods concurrently, with at most
+    workers copies in flight. targets is a list of (pod_name, pod_path,
+    container) triples, and we return a CopyResult for each, in order.
+    '''
+    def copy(target):
+        pod_name, pod_path, container = target
+        start = time.time()
+        try:
+            error = copy_archive_to_pod(client, archive, pod_name, pod_path,
+                                        container)
+        except Exception as e:
+            error = str(e)
+
+        return CopyResult(pod_name, container, error is None, error,
+                          time.time() - start)
+
+    if not targets:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(targets))) as pool:
+        return list(pool.map(copy, targets))
+
+
+def copy_file_to_pods(client, file_path, targets, arcname=None,
+                      workers=COPY_WORKERS):
+    '''
+    Copies a local file into many pods concurrently, as arcname (by default,
+    the file's own name) in each target's directory; see
+    copy_archive_to_pods. The archive is only built once.
+    '''
+    arcname = arcname or os.path.basename(file_path)
+    archive = make_archive([(file_path, arcname)])
+    return copy_archive_to_pods(client, archive, targets, workers)
+
+
+def check_copies(results):
+    '''
+    Exits if any of the copies failed, after reporting every failure.
+    '''
+    failures = [result for result in results if not result.success]
+    for result in failures:
+        print('Unexpected error while copying files to %s (%s): %s' %
+              (result.pod, result.container, result.error))
+
+    if failures:
+        sys.exit(1)
+
+
+def copy_file_to_pod(client, file_path, pod_name, pod_path, container,
+                     arcname=None):
+    results = copy_file_to_pods(client, file_path,
+                                [(pod_name, pod_path, container)], arcname)
+    check_copies(results)
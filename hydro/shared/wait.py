@@ -0,0 +1,313 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+Waits for the cluster to reach some state -- pods to come up, a service to get
+an address, a file to be copied into the pod -- without spinning. Kubernetes
+objects are waited on with watch streams, files with inotify where it is
+available, and anything else by polling with jittered exponential backoff.
+Every wait takes an optional timeout (in seconds) and raises WaitTimeout when
+it runs out.
+'''
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import random
+import select
+import time
+
+import kubernetes as k8s
+
+# The status code the API server returns when the resource version we are
+# watching from has been compacted away.
+WATCH_EXPIRED = 410
+
+# The longest a single watch request stays open before we reconnect.
+WATCH_TIMEOUT = 300
+
+# The inotify events that mean a file has been fully written into a directory.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class WaitTimeout(TimeoutError):
+    def __init__(self, description, elapsed):
+        super().__init__('Timed out after %.1f seconds waiting for %s.' %
+                         (elapsed, description))
+        self.description = description
+        self.elapsed = elapsed
+
+
+class Backoff():
+    '''
+    Produces the delays between retries: each is factor times the last, up to
+    maximum, and is then scaled by a random amount of up to jitter of itself,
+    so many waiters don't all hit the API server at the same moment.
+    '''
+
+    def __init__(self, initial=.1, maximum=5, factor=2, jitter=.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+        self.delay = initial
+
+    def next(self):
+        delay = self.delay * (1 - self.jitter * random.random())
+        self.delay = min(self.delay * self.factor, self.maximum)
+        return delay
+
+    def reset(self):
+        self.delay = self.initial
+
+
+class Deadline():
+    def __init__(self, description, timeout=None, clock=time.time):
+        self.description = description
+        self.clock = clock
+        self.start = clock()
+        self.end = None if timeout is None else self.start + timeout
+
+    def remaining(self):
+        '''
+        The seconds left until the deadline, or None if there is none. Raises
+        WaitTimeout once it has passed.
+        '''
+        if self.end is None:
+            return None
+
+        now = self.clock()
+        if now >= self.end:
+            raise WaitTimeout(self.description, now - self.start)
+
+        return self.end - now
+
+    def bound(self, delay):
+        remaining = self.remaining()
+        return delay if remaining is None else min(delay, remaining)
+
+
+def wait_until(predicate, description, timeout=None, backoff=None,
+               sleep=time.sleep, clock=time.time):
+    '''
+    Calls predicate until it returns a truthy value, which is returned,
+    sleeping with jittered backoff in between.
+    '''
+    deadline = Deadline(description, timeout, clock)
+    backoff = backoff or Backoff()
+
+    while True:
+        result = predicate()
+        if result:
+            return result
+
+        sleep(deadline.bound(backoff.next()))
+        deadline.remaining()
+
+
+def watch_until(list_func, predicate, description, timeout=None,
+                watch_factory=None, backoff=None, **kwargs):
+    '''
+    Keeps a map from name to object of everything list_func (e.g.,
+    client.list_namespaced_pod) returns for kwargs, up to date with a watch
+    stream, and returns as soon as predicate returns a truthy value for the
+    objects. We re-list when the watch expires or fails, backing off if it
+    fails repeatedly.
+    '''
+    deadline = Deadline(description, timeout)
+    watch_factory = watch_factory or k8s.watch.Watch
+    backoff = backoff or Backoff(initial=1, maximum=10)
+
+    while True:
+        listing = list_func(**kwargs)
+        objects = {obj.metadata.name: obj for obj in listing.items}
+        version = listing.metadata.resource_version
+
+        result = predicate(objects)
+        if result:
+            return result
+
+        watch = watch_factory()
+        try:
+            remaining = deadline.bound(WATCH_TIMEOUT)
+            for event in watch.stream(list_func, resource_version=version,
+                                      timeout_seconds=max(int(remaining), 1),
+                                      **kwargs):
+                if event['type'] == 'ERROR':
+                    raw = event.get('raw_object') or {}
+                    if raw.get('code') != WATCH_EXPIRED:
+                        logging.error('Watch for %s returned an error: %s' %
+                                      (description, raw.get('message')))
+                    break
+
+                obj = event['object']
+                if event['type'] == 'DELETED':
+                    objects.pop(obj.metadata.name, None)
+                else:
+                    objects[obj.metadata.name] = obj
+
+                result = predicate(objects)
+                if result:
+                    return result
+
+                deadline.remaining()
+            else:
+                # The watch timed out normally, so we reconnect right away.
+                backoff.reset()
+                deadline.remaining()
+                continue
+        except k8s.client.rest.ApiException as e:
+            if e.status != WATCH_EXPIRED:
+                logging.error('Watch for %s failed: %s' % (description,
+                                                           e.reason))
+        finally:
+            watch.stop()
+
+        time.sleep(deadline.bound(backoff.next()))
+
+
+def wait_for_pods(client, namespace, selector, count=None, running=False,
+                  timeout=None, watch_factory=None):
+    '''
+    Waits until every pod that matches selector has an IP (and is Running, if
+    running is set), and, if count is given, there are exactly that many of
+    them. Returns their IPs.
+    '''
+    def ready(pods):
+        pods = list(pods.values())
+        if count is not None and len(pods) != count:
+            return None
+
+        if any(pod.status.pod_ip is None or
+               (running and pod.status.phase != 'Running') for pod in pods):
+            return None
+
+        return [pod.status.pod_ip for pod in pods]
+
+    description = 'pods %s' % (selector)
+    if count is not None:
+        description = '%d %s' % (count, description)
+
+    # No pods at all is a valid answer when no count was asked for, so we
+    # wrap the IPs to tell an empty list apart from not being ready.
+    def predicate(pods):
+        ips = ready(pods)
+        return None if ips is None else (ips,)
+
+    return watch_until(client.list_namespaced_pod, predicate, description,
+                       timeout, watch_factory, namespace=namespace,
+                       label_selector=selector)[0]
+
+
+def wait_for_service_address(client, namespace, name, timeout=None,
+                             watch_factory=None):
+    '''
+    Waits until the named service's load balancer has a hostname, and returns
+    it.
+    '''
+    def ready(services):
+        service = services.get(name)
+        if service is None:
+            return None
+
+        ingress = service.status.load_balancer.ingress
+        if ingress is None or ingress[0].hostname is None:
+            return None
+
+        return ingress[0].hostname
+
+    return watch_until(client.list_namespaced_service, ready,
+                       'an address for service %s' % (name), timeout,
+                       watch_factory, namespace=namespace,
+                       field_selector='metadata.name=%s' % (name))
+
+
+def wait_for_file(path, timeout=None):
+    '''
+    Waits until a file exists at path. On Linux, we sleep on inotify events
+    for its directory (once the directory exists) instead of polling.
+    '''
+    description = 'file %s' % (path)
+    deadline = Deadline(description, timeout)
+    directory = os.path.dirname(os.path.abspath(path))
+    backoff = Backoff(initial=.05, maximum=2)
+
+    while not os.path.isfile(path):
+        fd = _watch_directory(directory)
+        if fd is None:
+            time.sleep(deadline.bound(backoff.next()))
+            deadline.remaining()
+            continue
+
+        try:
+            # We check again now that the watch is in place, in case the file
+            # appeared in between. The timeout on select is a safety net for
+            # events we might miss, e.g., if the directory is replaced.
+            while not os.path.isfile(path):
+                readable, _, _ = select.select([fd], [], [],
+                                               deadline.bound(backoff.next()))
+                if readable:
+                    _drain(fd)
+                deadline.remaining()
+        finally:
+            os.close(fd)
+
+
+_libc = None
+
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        try:
+            _libc = ctypes.CDLL(name, use_errno=True)
+            _libc.inotify_init1
+        except (OSError, AttributeError):
+            _libc = False
+
+    return _libc
+
+
+def _watch_directory(directory):
+    # Returns an inotify file descriptor watching directory for new files, or
+    # None if the directory doesn't exist (yet) or inotify isn't available.
+    libc = _inotify()
+    if not libc or not os.path.isdir(directory):
+        return None
+
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass